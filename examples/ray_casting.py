@@ -11,6 +11,8 @@ if __name__ == "__main__":
     tileset_filename = "tileset_box_b3dm_crop.json"
     root_dir = "Tile_p3646_p720_glb"
     tiles = lct.TilesLoader.from_tileset(root_dir, tileset_filename)
+    # 'auto' picks the first available of embree, open3d and numpy
+    engine = lct.get_ray_engine('auto')
     meshes = tiles.models.values()
     point = [30, 30, 0]
     direction = [0, 0, 1]
@@ -18,7 +20,7 @@ if __name__ == "__main__":
     intersections = []
     for mesh in meshes:
         for m in mesh:
-            intersector = tm.ray.ray_pyembree.RayMeshIntersector(m)
+            intersector = engine(m)
             locations, index_ray, index_tri = intersector.intersects_location([point], [direction])
             if len(locations) > 0:
                 intersections.append(locations[0])
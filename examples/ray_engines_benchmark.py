@@ -0,0 +1,61 @@
+#!/usr/bin/env python3
+
+import argparse
+import time
+import logging
+import numpy as np
+import lct_solution as lct
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    argparser = argparse.ArgumentParser(description='Compare the ray engines on the meshes of a tileset')
+    argparser.add_argument('--root_dir', type=str, help='Directory of the decompressed glb files', default="new_format")
+    argparser.add_argument('--planar', type=str, help='Planar json file', default="decompressed.json")
+    argparser.add_argument('--rays', type=int, help='Number of vertical rays cast against each mesh', default=1000)
+    argparser.add_argument('--seed', type=int, default=0)
+    args = argparser.parse_args()
+
+    tiles = lct.TilesLoader.from_planar(args.root_dir, args.planar, textures=False)
+    meshes = [mesh for trimeshes in tiles.models.values() for mesh in trimeshes]
+    engines = [engine for engine in lct.RAY_ENGINES.values() if engine.available()]
+    print(f"{len(meshes)} meshes, {sum(len(mesh.faces) for mesh in meshes)} faces, {args.rays} rays per mesh")
+
+    # rays from below the meshes, like the rays of the polygon rings
+    rng = np.random.default_rng(args.seed)
+    rays = []
+    for mesh in meshes:
+        low, high = mesh.bounds
+        origins = np.column_stack([rng.uniform(low[0], high[0], args.rays),
+                                   rng.uniform(low[1], high[1], args.rays),
+                                   np.full(args.rays, low[2] - 1)])
+        rays.append((origins, np.broadcast_to([0.0, 0.0, 1.0], origins.shape)))
+
+    reference = None
+    for engine in engines:
+        build = query = 0
+        hits = []
+        for mesh, (origins, directions) in zip(meshes, rays):
+            start = time.perf_counter()
+            intersector = engine(mesh)
+            built = time.perf_counter()
+            locations, index_ray, _index_tri = intersector.intersects_location(origins, directions)
+            query += time.perf_counter() - built
+            build += built - start
+            # nearest hit of each ray
+            first = np.full(len(origins), np.nan)
+            order = np.argsort(index_ray, kind='stable')
+            rays_hit, nearest = np.unique(index_ray[order], return_index=True)
+            first[rays_hit] = locations[order][nearest, 2]
+            hits.append((len(locations), first))
+        total = sum(count for count, _first in hits)
+        line = f"{engine.name:>8}: build {build:.3f} s, query {query:.3f} s, {total} hits"
+        if reference is None:
+            reference = hits
+        else:
+            firsts = np.concatenate([first for _count, first in hits])
+            reference_firsts = np.concatenate([first for _count, first in reference])
+            same = np.isnan(firsts) == np.isnan(reference_firsts)
+            error = np.nanmax(np.abs(firsts - reference_firsts)) if np.any(~np.isnan(firsts)) else 0.0
+            line += f", nearest hits vs {engines[0].name}: {np.count_nonzero(~same)} rays differ, max error {error:.2e} m"
+        print(line)
@@ -2,16 +2,26 @@ from ._datatypes import (Tile,
     transform_mtx,
     EmptyPolygon)   
 from ._loader import TilesLoader
+from ._tileset import TilesetIndex
+from ._raycast import RayBatch
+from ._ray_engines import (RayEngine,
+    RAY_ENGINES,
+    get_ray_engine)
+from ._clustering import (cluster_heights,
+    cluster_heights_batch)
 from ._utils import (compute_origin,
                      process_geojson)
 from ._renderer import (split_images)
 from ._geography import (to_world,
     to_world_dict,
     wsg84_to_cartesian,
-    cartesian_to_wsg84)
+    cartesian_to_wsg84,
+    wsg84_to_cartesian_array,
+    cartesian_to_wsg84_array)
 from ._meshes import (Primitive,
     Point,
     PolygonSegment,
     Polygon,
     MultiPolygon)
-from .glb import GLBDecompress
+from .glb import (GLBDecompress,
+    B3DM)
@@ -0,0 +1,93 @@
+import numpy as np
+
+
+def cluster_heights_batch(heights, segments, eps=5, min_samples=2):
+    '''
+    Cluster heights like sklearn's DBSCAN on a single column, separately for each segment, in O(n log n)
+    In one dimension the neighbours of a height are a window of the sorted heights, so core heights are found
+    from the sorted heights alone and clusters are the runs of sorted core heights without a gap above eps.
+    Labels follow DBSCAN within each segment: clusters are numbered in the order of their first core height
+    in the input, heights that are neither core nor within eps of a core height are noise (-1)
+    @param heights: (n,) array
+    @param segments: (n,) array of segment ids, e.g. the index of the ring of each height
+    @param eps: maximum distance between two neighbouring heights
+    @param min_samples: number of heights within eps of a height, itself included, for it to be a core height
+    @return: (n,) int array of labels
+    '''
+    heights = np.asarray(heights, dtype=np.float64).reshape(-1)
+    segments = np.asarray(segments).reshape(-1)
+    count = len(heights)
+    labels = np.full(count, -1, dtype=np.int64)
+    if count == 0:
+        return labels
+    order = np.lexsort((heights, segments))
+    h = heights[order]
+    s = segments[order]
+    new_segment = np.r_[True, s[1:] != s[:-1]]
+    if min_samples <= 2:
+        # a height is core as soon as one other height of its segment is close enough
+        close = np.abs(np.diff(h)) <= eps
+        close &= ~new_segment[1:]
+        neighbours = 1 + np.r_[close, False] + np.r_[False, close]
+        core = neighbours >= min_samples
+    else:
+        # window of the neighbours of each height within its segment
+        low = np.empty(count, dtype=np.int64)
+        high = np.empty(count, dtype=np.int64)
+        for start, end in zip(np.flatnonzero(new_segment), np.r_[np.flatnonzero(new_segment)[1:], count]):
+            window = h[start:end]
+            low[start:end] = start + np.searchsorted(window, window - eps, side='left')
+            high[start:end] = start + np.searchsorted(window, window + eps, side='right')
+        core = high - low >= min_samples
+    core_index = np.flatnonzero(core)
+    if len(core_index) == 0:
+        return labels
+    # runs of core heights: a new cluster starts at a new segment or after a gap above eps
+    starts = np.r_[True, (s[core_index[1:]] != s[core_index[:-1]]) | (h[core_index[1:]] - h[core_index[:-1]] > eps)]
+    run = np.cumsum(starts) - 1
+    sorted_labels = np.full(count, -1, dtype=np.int64)
+    sorted_labels[core_index] = run
+    # position in the input of the first core height of each run
+    first = np.full(run[-1] + 1, count, dtype=np.int64)
+    np.minimum.at(first, run, order[core_index])
+    # border heights join the cluster of the nearest core height below or above, the one numbered first wins
+    border = np.flatnonzero(~core)
+    if len(border):
+        below = np.searchsorted(core_index, border, side='left') - 1
+        above = below + 1
+        candidates = []
+        for side in (below, above):
+            valid = (side >= 0) & (side < len(core_index))
+            neighbour = core_index[np.clip(side, 0, len(core_index) - 1)]
+            valid &= (s[neighbour] == s[border]) & (np.abs(h[neighbour] - h[border]) <= eps)
+            candidates.append(np.where(valid, run[np.clip(side, 0, len(core_index) - 1)], -1))
+        candidates = np.array(candidates)
+        candidates[candidates < 0] = np.iinfo(np.int64).max
+        chosen = candidates.min(axis=0)
+        # runs are in sorted order, the one numbered first is the one whose first core height comes first
+        has_both = (candidates != np.iinfo(np.int64).max).all(axis=0)
+        chosen[has_both] = np.where(first[candidates[0, has_both]] <= first[candidates[1, has_both]],
+                                    candidates[0, has_both], candidates[1, has_both])
+        chosen[chosen == np.iinfo(np.int64).max] = -1
+        sorted_labels[border] = chosen
+    # number the clusters of each segment in the order of their first core height in the input
+    run_segment = s[core_index[starts]]
+    run_order = np.lexsort((first, run_segment))
+    run_start = np.r_[True, run_segment[run_order][1:] != run_segment[run_order][:-1]]
+    position = np.arange(len(run_order))
+    number = np.empty(len(run_order), dtype=np.int64)
+    number[run_order] = position - np.maximum.accumulate(np.where(run_start, position, 0))
+    labels[order] = np.where(sorted_labels >= 0, number[np.maximum(sorted_labels, 0)], -1)
+    return labels
+
+
+def cluster_heights(heights, eps=5, min_samples=2):
+    '''
+    Cluster heights like sklearn's DBSCAN(eps, min_samples).fit(heights.reshape(-1, 1)).labels_
+    @param heights: (n,) array
+    @param eps: maximum distance between two neighbouring heights
+    @param min_samples: number of heights within eps of a height, itself included, for it to be a core height
+    @return: (n,) int array of labels, -1 for noise
+    '''
+    heights = np.asarray(heights, dtype=np.float64).reshape(-1)
+    return cluster_heights_batch(heights, np.zeros(len(heights), dtype=np.int64), eps, min_samples)
@@ -1,4 +1,5 @@
 import numpy as np
+import typing
 from dataclasses import dataclass
 
 
@@ -15,6 +16,8 @@ class Tile:
     # group: str
     box: np.ndarray
     geometric_error: float
+    sphere: typing.Optional[np.ndarray] = None
+    depth: int = 0
 
 
 class EmptyPolygon(Exception):
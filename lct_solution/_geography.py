@@ -38,6 +38,42 @@ def cartesian_to_wsg84(lat, lon, alt):
     return x, y, z
 
 
+def wsg84_to_cartesian_array(points):
+    '''
+    Vectorized wsg84_to_cartesian
+    @param points: (n, 3) array of cartesian x, y, z
+    @return: (n, 3) array of lat, lon (degrees) and alt
+    '''
+    points = np.asarray(points, dtype=np.float64).reshape(-1, 3)
+    x, y, z = points[:, 0], points[:, 1], points[:, 2]
+    b = math.sqrt(a**2 * (1-e**2))
+    ep = math.sqrt((a**2 - b**2) / b**2)
+    p = np.hypot(x, y)
+    th = np.arctan2(a*z, b*p)
+    lon = np.arctan2(y, x)
+    lat = np.arctan2((z + ep**2 * b * np.sin(th)**3), (p - e**2 * a * np.cos(th)**3))
+    n = a / np.sqrt(1 - e**2 * np.sin(lat)**2)
+    alt = p / np.cos(lat) - n
+    return np.column_stack([np.degrees(lat), np.degrees(lon), alt])
+
+
+def cartesian_to_wsg84_array(coords):
+    '''
+    Vectorized cartesian_to_wsg84
+    @param coords: (n, 3) array of lat, lon (degrees) and alt
+    @return: (n, 3) array of cartesian x, y, z
+    '''
+    coords = np.asarray(coords, dtype=np.float64).reshape(-1, 3)
+    lat = np.radians(coords[:, 0])
+    lon = np.radians(coords[:, 1])
+    alt = coords[:, 2]
+    n = a / np.sqrt(1 - e**2 * np.sin(lat)**2)
+    x = (n + alt) * np.cos(lat) * np.cos(lon)
+    y = (n + alt) * np.cos(lat) * np.sin(lon)
+    z = (n * (1 - e**2) + alt) * np.sin(lat)
+    return np.column_stack([x, y, z])
+
+
 def to_world(point, tf, img_size, camera_step, camera_dst):
     '''
     Convert image point to world coordinates
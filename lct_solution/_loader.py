@@ -1,64 +1,206 @@
-import pyassimp
+import concurrent.futures
+import traceback
 import trimesh as tm
 import numpy as np
 import PIL
 import pathlib
 import json
 
-from gltflib.gltf import GLTF
-from .glb import glb_to_pillow
+from .glb import glb_to_trimeshes
 import json
 import matplotlib.pyplot as plt
 import tqdm
 import glob
 import logging
+import itertools
+import os
+import pickle
+import weakref
 from ._datatypes import (Tile, 
                          transform_mtx)
 from ._utils import compute_origin
+from ._tileset import TilesetIndex
+from ._tile_cache import TileCache
+from ._snapshot import (SceneSnapshot,
+                        snapshot_key)
+from ._spatial import TileGrid
+from ._ray_engines import get_ray_engine
 from ._geography import (cartesian_to_wsg84,
-                            wsg84_to_cartesian)
+                            wsg84_to_cartesian,
+                            cartesian_to_wsg84_array,
+                            wsg84_to_cartesian_array)
+
+
+# loaders of this process, a worker forked after a loader was created inherits it, see TilesLoader.__reduce__
+_loaders = weakref.WeakValueDictionary()
+_loader_ids = itertools.count()
+
+
+def _shared_loader(key):
+    try:
+        return _loaders[key]
+    except KeyError:
+        raise pickle.UnpicklingError(f"TilesLoader {key} does not exist in this process, "
+                                     f"it can only be passed to processes forked after it was created") from None
 
 
 class TilesLoader:
     def __init__(self, root_dir):
         self._logger = logging.getLogger("tiles_loader")
+        self._key = (os.getpid(), next(_loader_ids))
+        _loaders[self._key] = self
         self._origin_translation = None
+        self._world_to_local = None
+        self._local_to_world = None
+        self._intersectors = {}
+        self._ray_engine = None
         root_dir = pathlib.Path(root_dir)
         self._root_dir = root_dir
         self._tiles = []
         
 
-    def _load(self, root_dir):
+    def _load(self, root_dir, workers=1, cache_bytes=None, textures=True, snapshot_dir=None, key=None):
         self._tfs = []
-        self._origin_rotation = compute_origin(self._tiles)
-        self._logger.info(f"origin rotation: {self._origin_rotation}")
-        self._find_corner()
-        self._logger.info(f"origin translation: {self._origin_translation}")
+        snapshot = SceneSnapshot.open(snapshot_dir, key, textures) if snapshot_dir is not None else None
+        if snapshot is not None:
+            self._logger.info(f"using snapshot {snapshot_dir}")
+            self._set_origin(snapshot.origin_rotation, snapshot.origin_translation)
+            self._min_height = snapshot.min_height
+            self._max_point = snapshot.max_point
+        else:
+            self._origin_rotation = compute_origin(self._tiles)
+            self._logger.info(f"origin rotation: {self._origin_rotation}")
+            self._find_corner()
+            self._logger.info(f"origin translation: {self._origin_translation}")
         self._loaded_models = {}
-        for tile in tqdm.tqdm(self._tiles, desc="Loading .glb models", unit="tile", leave=True):
-            if tile.uri not in self._loaded_models:
-                try:
-                    trimeshes = self.load_model(root_dir / tile.uri)
-                except (pyassimp.errors.AssimpError, FileNotFoundError) as e:
-                    self._logger.exception(f"error loading tile {tile.uri}")
-                    continue
-                for mesh in trimeshes:
-                    mesh.apply_transform(transform_mtx)
-                    box_translation = np.eye(4)
-                    box_translation[:3, 3] = tile.box[:3]
-                    mesh.apply_transform(np.linalg.inv(self.origin_translation) @ np.linalg.inv(self.origin_rotation)  @ box_translation)
-                    tf = tm.creation.axis(origin_size=1)
-                    tf.apply_transform(np.linalg.inv(self.origin_translation) @ np.linalg.inv(self.origin_rotation)  @ box_translation)
-                    self._tfs.append(tf)
-                self._loaded_models[tile.uri] = trimeshes
+        # centers and bounding radii of the tiles in the local frame of the scene
+        self._tile_centers = np.array([self._tile_transform(tile)[:3, 3] for tile in self._tiles]).reshape(-1, 3)
+        self._tile_radii = np.array([np.linalg.norm(tile.box[3:12]) for tile in self._tiles])
+        self._tile_grid = TileGrid(self._tile_centers[:, :2], self._tile_radii)
+        # a tile is loaded once even if several leaves reference it
+        unique_tiles = {}
+        for tile in self._tiles:
+            unique_tiles.setdefault(tile.uri, tile)
+        tasks = [(root_dir / uri, self._tile_transform(tile), textures) for uri, tile in unique_tiles.items()]
+        if cache_bytes is not None:
+            # lazy mode: tiles are loaded on first access to models, one axis per tile
+            for _path, transform, _textures in tasks:
+                tf = tm.creation.axis(origin_size=1)
+                tf.apply_transform(transform)
+                self._tfs.append(tf)
+            if snapshot is not None:
+                load = lambda uri: snapshot.load(root_dir, uri, textures)
+            else:
+                transforms = dict(zip(unique_tiles, (transform for _path, transform, _textures in tasks)))
+                load = lambda uri: load_tile((root_dir / uri, transforms[uri], textures))
+            self._loaded_models = TileCache(unique_tiles, load, cache_bytes)
+            return
+        if snapshot is not None:
+            results = (snapshot.load(root_dir, uri, textures) for uri in unique_tiles)
+        else:
+            results = load_tiles(tasks, workers)
+        for uri, (_path, transform, _textures), (trimeshes, error) in zip(unique_tiles, tasks, results):
+            if error is not None:
+                self._logger.error(f"error loading tile {uri}:\n{error}")
+                continue
+            # one axis per tile, as in lazy mode
+            tf = tm.creation.axis(origin_size=1)
+            tf.apply_transform(transform)
+            self._tfs.append(tf)
+            self._loaded_models[uri] = trimeshes
+        if snapshot is None and snapshot_dir is not None:
+            try:
+                SceneSnapshot.save(snapshot_dir, key, self, textures)
+            except OSError:
+                self._logger.warning(f"could not save snapshot to {snapshot_dir}", exc_info=True)
+
+
+    def __reduce__(self):
+        '''
+        Loaders are pickled by reference, so objects holding one, like Primitive, can be passed between
+        the process that created it and the workers it forked, which share its tiles copy-on-write
+        '''
+        return (_shared_loader, (self._key,))
+
+
+    def _tile_transform(self, tile):
+        '''
+        Transformation from the frame of a tile to the local frame of the scene
+        '''
+        box_translation = np.eye(4)
+        box_translation[:3, 3] = tile.box[:3]
+        return self._world_to_local @ box_translation
+
+
+    def tiles_in_rect(self, min_xy, max_xy):
+        '''
+        Tiles whose bounding sphere overlaps a rectangle in the local frame of the scene
+        @param min_xy: minimum x and y of the rectangle
+        @param max_xy: maximum x and y of the rectangle
+        @return: list of Tile, in the order of tiles
+        '''
+        return [self._tiles[i] for i in self._tile_grid.query_rect(min_xy, max_xy)]
+
+
+    def intersectors(self, uri):
+        '''
+        Ray intersectors of the meshes of a tile
+        They are built once and kept while the tile is loaded, a tile reloaded by TileCache gets new ones
+        @param uri: uri of the tile
+        @return: list of RayEngine of ray_engine, one per mesh, empty if the tile failed to load
+        '''
+        trimeshes = self.models.get(uri, ())
+        entry = self._intersectors.get(uri)
+        if entry is None or entry[0] is not trimeshes:
+            engine = self._ray_engine or get_ray_engine()
+            entry = (trimeshes, [engine(mesh) for mesh in trimeshes])
+            self._intersectors[uri] = entry
+            if isinstance(self._loaded_models, TileCache):
+                # drop the intersectors of evicted tiles, they keep their meshes alive
+                resident = set(self._loaded_models.resident)
+                for stale in [key for key in self._intersectors if key not in resident and key != uri]:
+                    del self._intersectors[stale]
+        return entry[1]
+
+
+    @property
+    def ray_engine(self):
+        '''
+        Name of the backend of the ray intersectors, see get_ray_engine
+        Until it is set, or when it is set to 'auto', the first available backend is used.
+        Setting it drops the intersectors already built
+        '''
+        return (self._ray_engine or get_ray_engine()).name
+
+
+    @ray_engine.setter
+    def ray_engine(self, name):
+        self._ray_engine = get_ray_engine(name) if name != 'auto' else None
+        self._intersectors = {}
+
+
+    def tiles_near_points(self, points):
+        '''
+        Tiles whose bounding sphere contains at least one of the points in the xy plane of the local frame
+        @param points: (m, 2) array of x and y coordinates in the local frame of the scene
+        @return: list of Tile, in the order of tiles
+        '''
+        return [self._tiles[i] for i in self._tile_grid.query_points(points)]
 
 
     @classmethod
-    def from_planar(cls, root_dir, root_tileset_filename) -> 'TilesLoader':
+    def from_planar(cls, root_dir, root_tileset_filename, workers=1, cache_bytes=None, textures=True, snapshot_dir=None) -> 'TilesLoader':
         '''
         Load tiles from a planar json file
         @param root_dir: root directory of the tileset
         @param root_tileset_filename: filename of the tileset, should be a json file at the root of the tileset
+        @param workers: number of processes loading tiles, 1 loads them in the current process
+        @param cache_bytes: if set, tiles are loaded lazily on first access to models and kept in
+            a least recently used cache of this many bytes, see TileCache. workers is then ignored
+        @param textures: if False, tiles are loaded without textures and normals, see load_model
+        @param snapshot_dir: if set, the loaded scene is saved to this directory as a SceneSnapshot and later
+            loads with the same planar json and tile files restore it instead of parsing the tiles.
+            A snapshot is only saved when all tiles are loaded, i.e. without cache_bytes
         '''
         loader = cls(root_dir)
         with open(loader._root_dir / root_tileset_filename) as f:
@@ -69,45 +211,33 @@ class TilesLoader:
             uri = tile['content']['uri']
             tile = Tile(uri, box, geometric_error)
             loader._tiles.append(tile)
-        loader._load(loader._root_dir)
+        key = None
+        if snapshot_dir is not None:
+            key = snapshot_key(loader._root_dir / root_tileset_filename, [loader._root_dir / tile.uri for tile in loader._tiles])
+        loader._load(loader._root_dir, workers, cache_bytes, textures, snapshot_dir, key)
         return loader
 
 
     @classmethod
-    def from_tileset(cls, root_dir, root_tileset_filename) -> 'TilesLoader':
+    def from_tileset(cls, root_dir, root_tileset_filename, index_path=None, index_workers=None, workers=1, cache_bytes=None, textures=True) -> 'TilesLoader':
         '''
-        Recursively load tiles from a tileset
+        Load the leaf tiles of a tileset and of all external tilesets it references
         @param root_dir: root directory of the tileset
         @param root_tileset_filename: filename of the tileset, should be a json file at the root of the tileset
+        @param index_path: path of the persisted tileset index, see TilesetIndex.load
+        @param index_workers: number of processes parsing tileset jsons when the index is built
+        @param workers: number of processes loading tiles, 1 loads them in the current process
+        @param cache_bytes: if set, tiles are loaded lazily on first access to models and kept in
+            a least recently used cache of this many bytes, see TileCache. workers is then ignored
+        @param textures: if False, tiles are loaded without textures and normals, see load_model
         '''
         loader = cls(root_dir)
-        with open(loader._root_dir / root_tileset_filename) as f:
-            root_tileset = json.load(f)
-        loader._get_child(root_tileset['root'], 0)
-        loader._load(loader._root_dir)
+        index = TilesetIndex.load(loader._root_dir, root_tileset_filename, index_path, index_workers)
+        loader._tiles.extend(index.tiles)
+        loader._load(loader._root_dir, workers, cache_bytes, textures)
         return loader
 
 
-    def _get_child(self, a, level):
-        if 'content' in a:
-            uri = a['content']['uri']
-            if uri.endswith('.json'):
-                include_file = self._root_dir / uri
-                self._logger.info(f"loading additional tileset: {include_file}")
-                with open(include_file) as f:
-                    a = json.load(f)
-                self._get_child(a['root'], level + 1)
-            else:
-                if 'children' not in a:
-                    bounding_volume = np.array(a['boundingVolume']['box'])
-                    geometric_error = a['geometricError']
-                    tile = Tile(uri, bounding_volume, geometric_error)
-                    self._tiles.append(tile)
-        if 'children' in a:
-            for i in a['children']:
-                self._get_child(i, level + 1)
-
-
     def _find_corner(self):
         min_x = min_y = min_z = float('inf')
         max_x = max_y = max_z = float('-inf')
@@ -132,7 +262,7 @@ class TilesLoader:
                 max_z = box_translation[2, 3]
         origin_translation = np.eye(4)
         origin_translation[:3, 3] = [min_x, min_y, min_z]
-        self._origin_translation = origin_translation
+        self._set_origin(self._origin_rotation, origin_translation)
         self._min_height = self.tf_to_cartesian(np.eye(4))[-1]
         self._logger.info(f"min height: {self._min_height}")
         # compute max point
@@ -142,31 +272,36 @@ class TilesLoader:
 
 
     @staticmethod
-    def load_model(path: pathlib.Path):
-        trimeshes = []
-        base_path = pathlib.Path(path).parent
-        if not pathlib.Path(path).exists():
+    def load_model(path: pathlib.Path, textures=True):
+        '''
+        Load the meshes of a model file
+        .glb files are read in a single pass with glb_to_trimeshes, other formats with pyassimp,
+        which is imported only then, so it is not needed for glb tilesets
+        @param path: path to the model
+        @param textures: if False, only vertices and faces are read: images are not decoded and
+            fix_normals is skipped, which is enough for ray casting
+        @return: list of trimesh.Trimesh
+        '''
+        path = pathlib.Path(path)
+        if not path.exists():
             raise FileNotFoundError(f"File not found: {path}")
+        if path.suffix == ".glb":
+            return glb_to_trimeshes(path, textures)
+        import pyassimp
+        trimeshes = []
+        base_path = path.parent
         with pyassimp.load(str(path)) as scene:
-            if path.suffix == ".glb":
-                gltf: GLTF = GLTF.load(path)
-                images = glb_to_pillow(gltf, save=False)
-            else:
-                images = None
-            for index, mesh in enumerate(scene.meshes):
+            for mesh in scene.meshes:
                 vertices = mesh.vertices
                 faces = mesh.faces
+                if not textures:
+                    trimeshes.append(tm.Trimesh(vertices=vertices, faces=faces))
+                    continue
                 material = mesh.material
-                if images is None:
-                    webp_texture = material.properties.get(('file', 1))
-                    texture = None
-                    if webp_texture is not None:
-                        img = PIL.Image.open(base_path / webp_texture)
-                        uvs = mesh.texturecoords[0]
-                        material = tm.visual.texture.SimpleMaterial(image=img)
-                        texture = tm.visual.TextureVisuals(uv=uvs, image=img, material=material)
-                else:
-                    img = images[index]
+                webp_texture = material.properties.get(('file', 1))
+                texture = None
+                if webp_texture is not None:
+                    img = PIL.Image.open(base_path / webp_texture)
                     uvs = mesh.texturecoords[0]
                     material = tm.visual.texture.SimpleMaterial(image=img)
                     texture = tm.visual.TextureVisuals(uv=uvs, image=img, material=material)
@@ -178,6 +313,9 @@ class TilesLoader:
     
     @property
     def models(self):
+        '''
+        Mapping from tile uri to its list of trimeshes, a TileCache in lazy mode
+        '''
         return self._loaded_models
     
 
@@ -186,6 +324,11 @@ class TilesLoader:
         return tuple(self._tiles)
     
 
+    @property
+    def root_dir(self):
+        return self._root_dir
+    
+
     @property
     def origin_rotation(self):
         return self._origin_rotation
@@ -223,17 +366,83 @@ class TilesLoader:
         return meshes
     
 
+    def _set_origin(self, rotation, translation):
+        '''
+        Set the local frame of the scene and cache the transformations between it and the world
+        '''
+        self._origin_rotation = rotation
+        self._origin_translation = translation
+        self._world_to_local = np.linalg.inv(translation) @ np.linalg.inv(rotation)
+        self._local_to_world = np.linalg.inv(self._world_to_local)
+
+
     def cartesian_to_tf(self, coords: list):
         if len(coords) != 3:
             raise ValueError(f"Expected 3 coordinates, got {coords}")
         pos = cartesian_to_wsg84(*coords)
         coors_tf = np.eye(4)
         coors_tf[:3, 3] = pos
-        coords_tf = np.linalg.inv(self.origin_translation) @ np.linalg.inv(self.origin_rotation) @ coors_tf @ self.origin_rotation
+        coords_tf = self._world_to_local @ coors_tf @ self.origin_rotation
         return coords_tf
     
 
     def tf_to_cartesian(self, tf):
-        pos = np.linalg.inv(np.linalg.inv(self.origin_translation) @ np.linalg.inv(self.origin_rotation)) @ tf
+        pos = self._local_to_world @ tf
         return wsg84_to_cartesian(pos[0, 3], pos[1, 3], pos[2, 3])
-    
\ No newline at end of file
+    
+
+    def cartesian_to_local(self, coords):
+        '''
+        Vectorized cartesian_to_tf, returns positions only
+        @param coords: (n, 3) array of lat, lon (degrees) and alt
+        @return: (n, 3) array of positions in the local frame of the scene
+        '''
+        points = cartesian_to_wsg84_array(coords)
+        return points @ self._world_to_local[:3, :3].T + self._world_to_local[:3, 3]
+    
+
+    def local_to_cartesian(self, points):
+        '''
+        Vectorized tf_to_cartesian, takes positions only
+        @param points: (n, 3) array of positions in the local frame of the scene
+        @return: (n, 3) array of lat, lon (degrees) and alt
+        '''
+        points = np.asarray(points, dtype=np.float64).reshape(-1, 3)
+        return wsg84_to_cartesian_array(points @ self._local_to_world[:3, :3].T + self._local_to_world[:3, 3])
+    
+
+
+def load_tile(task):
+    '''
+    Load the meshes of a tile and move them to the local frame of the scene
+    Errors are returned instead of raised, so that a broken tile does not stop the other workers.
+    Any exception is caught, since the glb reader, DracoPy and pyassimp each raise their own errors
+    @param task: tuple of the path to the model, the 4x4 transformation of the tile and whether to load textures
+    @return: tuple of (list of trimeshes, None) or (None, error traceback)
+    '''
+    path, transform, textures = task
+    try:
+        trimeshes = TilesLoader.load_model(path, textures)
+    except Exception:
+        return None, traceback.format_exc()
+    # single transformation instead of transform_mtx followed by the tile transformation
+    transform = transform @ np.array(transform_mtx)
+    for mesh in trimeshes:
+        mesh.apply_transform(transform)
+    return trimeshes, None
+
+
+def load_tiles(tasks, workers=1):
+    '''
+    Load (path, transform, textures) tasks, optionally in a process pool
+    @param tasks: list of (path, transform, textures) tuples
+    @param workers: number of worker processes, 1 loads the tiles in the current process
+    @return: generator of (list of trimeshes, error traceback) tuples in the order of tasks, one of them is None
+    '''
+    if workers <= 1:
+        for task in tqdm.tqdm(tasks, desc="Loading .glb models", unit="tile", leave=True):
+            yield load_tile(task)
+        return
+    with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as executor:
+        yield from tqdm.tqdm(executor.map(load_tile, tasks),
+                             total=len(tasks), desc=f"Loading .glb models ({workers} workers)", unit="tile", leave=True)
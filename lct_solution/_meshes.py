@@ -3,36 +3,59 @@ import trimesh as tm
 from dataclasses import dataclass
 import tqdm
 import logging
-from scipy.spatial import Delaunay
+from scipy.spatial import (Delaunay,
+                           cKDTree)
 from ._datatypes import EmptyPolygon
+from ._raycast import RayBatch
 import traceback
-from sklearn.cluster import DBSCAN
+
+
+# default distance between the points rings are densified to before casting, in meters
+INTERPOLATION_STEP = 3
+
+
+def ring_positions(tileset, ring):
+    '''
+    Convert geojson coordinates to positions in the local frame of the scene, on the ground (z = 0)
+    The altitude of a coordinate is only used for the conversion if it is below 100 meters,
+    otherwise the minimum height of the scene is used
+    @param tileset: TilesLoader
+    @param ring: list of [lon, lat] or [lon, lat, alt] coordinates
+    @return: (n, 3) array
+    '''
+    if len(ring) == 0:
+        return np.zeros((0, 3))
+    try:
+        coords = np.asarray(ring, dtype=np.float64).reshape(len(ring), -1)
+    except ValueError:
+        # ring mixing 2d and 3d coordinates, inf stands for a missing altitude
+        coords = np.array([[c[0], c[1], c[2] if len(c) == 3 else np.inf] for c in ring], dtype=np.float64)
+    heights = np.full(len(coords), tileset.min_height, dtype=np.float64)
+    if coords.shape[1] == 3:
+        heights = np.where(coords[:, 2] < 100, coords[:, 2], heights)
+    positions = tileset.cartesian_to_local(np.column_stack([coords[:, 1], coords[:, 0], heights]))
+    positions[:, 2] = 0
+    return positions
 
 
 class Point:
+    '''
+    Single point in the local frame of the scene
+    The position may be a view into the positions of a PolygonSegment
+    '''
+    __slots__ = ('_tileset', '_cartesian', '_position')
+
     def __init__(self, tileset, cartesian):
-        self._logger = logging.getLogger("primitive.point")
-        height = tileset.min_height
-        if len(cartesian) == 3:
-            if cartesian[2] < 100:
-                height = cartesian[2]
         self._tileset = tileset
         self._cartesian = cartesian
-        self._tf = self._tileset.cartesian_to_tf([cartesian[1], cartesian[0], height])
-        self._tf[:3, 3][2] = 0
-        # if len(cartesian) == 2:
-        #     self._tf[:3, 3][2] = 0
-        # elif len(cartesian) == 3:
-        #     self._tf[:3, 3][2] = cartesian[2]
-        # else:
-        #     raise ValueError(f"Wrong point format: {cartesian}")
+        self._position = ring_positions(tileset, [cartesian])[0]
         
 
     def to_trimesh(self, color=None):
         if color is None:
             color = [255, 0, 255, 255]
         mesh = tm.creation.axis(origin_size=1)
-        mesh.apply_transform(self._tf)
+        mesh.apply_transform(self.tf)
         mesh.visual.face_colors = color
         return mesh
     
@@ -41,13 +64,35 @@ class Point:
     def from_tf(cls, tileset, tf):
         if tf.shape != (4, 4):
             raise ValueError(f"Wrong shape of transformation matrix: {tf.shape}")
-        point = cls(tileset, [0, 0, 0])
-        point._tf = tf
+        return cls.from_position(tileset, np.array(tf[:3, 3], dtype=np.float64))
+    
+
+    @classmethod
+    def from_position(cls, tileset, position):
+        '''
+        Point at a position in the local frame of the scene, the position is not copied
+        '''
+        point = cls.__new__(cls)
+        point._tileset = tileset
+        point._cartesian = None
+        point._position = position
         return point
     
 
+    @property
+    def position(self):
+        return self._position
+    
+
+    @property
+    def tf(self):
+        tf = np.eye(4)
+        tf[:3, 3] = self._position
+        return tf
+    
+
     def _update_cartesian(self):
-        self._cartesian = self._tileset.tf_to_cartesian(self._tf)
+        self._cartesian = self._tileset.tf_to_cartesian(self.tf)
 
 
     def as_geojson(self):
@@ -64,86 +109,157 @@ def perpendicular_distance(point, line_start, line_end):
     return np.linalg.norm(np.cross(line_end-line_start, line_start-point)) / np.linalg.norm(line_end-line_start)
 
 
+def rdp_mask(points, epsilon):
+    '''
+    Points kept by the Ramer-Douglas-Peucker algorithm, without recursion
+    All the spans waiting to be split are handled together: the distances of their inner points are computed
+    at once, as perpendicular_distance does, and every span whose farthest point is further than epsilon
+    is split at it. The first farthest point is taken on ties, like the recursive version
+    @param points: (n, d) array of points, a closed ring may start and end at the same point
+    @param epsilon: tolerance, maximum distance from a point to the line between the ends of its span
+    @return: (n,) boolean array, True for the kept points
+    '''
+    points = np.asarray(points, dtype=np.float64)
+    points = points.reshape(len(points), -1)
+    keep = np.zeros(len(points), dtype=bool)
+    if len(points) == 0:
+        return keep
+    keep[[0, -1]] = True
+    starts = np.array([0])
+    ends = np.array([len(points) - 1])
+    while len(starts):
+        counts = ends - starts - 1
+        starts, ends, counts = starts[counts > 0], ends[counts > 0], counts[counts > 0]
+        if len(starts) == 0:
+            break
+        span = np.repeat(np.arange(len(starts)), counts)
+        inner = np.repeat(starts + 1, counts) + np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+        line_start = points[starts[span]]
+        line = points[ends[span]] - line_start
+        length = np.linalg.norm(line, axis=1)
+        offset = line_start - points[inner]
+        if points.shape[1] == 2:
+            cross = np.abs(line[:, 0] * offset[:, 1] - line[:, 1] * offset[:, 0])
+        else:
+            cross = np.linalg.norm(np.cross(line, offset), axis=1)
+        degenerate = np.all(line == 0, axis=1)
+        distances = np.where(degenerate, np.linalg.norm(offset, axis=1), cross / np.where(degenerate, 1, length))
+        first = np.cumsum(counts) - counts
+        farthest = np.maximum.reduceat(distances, first)
+        # index of the first point of each span at its farthest distance
+        at_farthest = np.flatnonzero(distances == farthest[span])
+        split = np.full(len(starts), len(points))
+        np.minimum.at(split, span[at_farthest], inner[at_farthest])
+        split_spans = farthest > epsilon
+        split = split[split_spans]
+        keep[split] = True
+        starts, ends = np.concatenate([starts[split_spans], split]), np.concatenate([split, ends[split_spans]])
+    return keep
+
+
 class PolygonSegment:
-    def __init__(self, tileset, points, apply_rdp=False):
+    '''
+    Ring of a polygon, kept as an (n, 3) array of positions in the local frame of the scene
+    '''
+    def __init__(self, tileset, points, apply_rdp=False, rays=None, step=INTERPOLATION_STEP, *, tolerance=None):
+        '''
+        @param tileset: TilesLoader
+        @param points: list of geojson coordinates
+        @param apply_rdp: deprecated and ignored, kept so positional arguments keep their meaning, use tolerance
+        @param tolerance: if set, the ring is simplified with rdp_mask after its height is recovered,
+            points closer than this many meters to the simplified ring are dropped
+        @param rays: RayBatch to add the rays of the ring to. If set, the height is only recovered by finish,
+            after the batch is cast, otherwise it is recovered right away
+        @param step: distance between the points the ring is densified to before casting, in meters
+        '''
         self._logger = logging.getLogger("primitive.polygon_segment")
         self._tileset = tileset
-        self._points = [Point(tileset, point) for point in points]
-        self._interpolate()
-        if apply_rdp:
-            origin_num = len(self._points)
-            new_tfs = []
-            for point in self._points:
-                tf = np.eye(4)
-                tf[:3, 3] = point
-                new_tfs.append(tf)
-            self._points = [Point.from_tf(tileset, tf) for tf in new_tfs]
-            # self._logger.debug(f"Reduced points from {origin_num} to {len(self._points)}")
-        self._find_real_height()
-        if len(self._points) < 4:
+        self._tolerance = tolerance
+        self._positions = ring_positions(tileset, points)
+        self._interpolate(step)
+        self._rays = rays
+        self._ring = rays.add(self._positions) if rays is not None else None
+        if rays is None:
+            self.finish()
+
+
+    def finish(self):
+        '''
+        Recover the height of the ring from the hits of its rays
+        @raise EmptyPolygon: if too few points were recovered
+        '''
+        rays = self._rays
+        self._rays = None
+        self._find_real_height(rays=rays, ring=self._ring)
+        if len(self._positions) < 4:
             raise EmptyPolygon("Polygon has less than 4 points")
+        if self._tolerance is not None:
+            self._simplify(self._tolerance)
+
+
+    @property
+    def positions(self):
+        '''
+        (n, 3) array of the positions of the ring in the local frame of the scene
+        '''
+        return self._positions
+
+
+    @property
+    def points(self):
+        '''
+        Points of the ring, as views into positions
+        '''
+        return [Point.from_position(self._tileset, position) for position in self._positions]
 
 
     @staticmethod
     def rdp(points, epsilon):
         """
-        Recursively simplify points using the Ramer-Douglas-Peucker algorithm
+        Simplify points using the Ramer-Douglas-Peucker algorithm, see rdp_mask
         @param points: list of points
         @param epsilon: tolerance, maximum distance from a point to the line between the start and end points
         """
-        def find_farthest_point(points, start, end):
-            max_distance = 0
-            index = start
-            for i in range(start + 1, end):
-                distance = perpendicular_distance(points[i], points[start], points[end])
-                if distance > max_distance:
-                    max_distance = distance
-                    index = i
-            return max_distance, index
-        
+        return [points[i] for i in np.flatnonzero(rdp_mask(points, epsilon))]
 
-        def rdp_recursive(points, start, end, epsilon):
-            max_distance, index = find_farthest_point(points, start, end)
-            if max_distance > epsilon:
-                results1 = rdp_recursive(points, start, index, epsilon)
-                results2 = rdp_recursive(points, index, end, epsilon)
-                return results1[:-1] + results2
-            else:
-                return [points[start], points[end]]
 
-        return rdp_recursive(points, 0, len(points) - 1, epsilon)
+    def _simplify(self, tolerance):
+        '''
+        Drop the points of the ring closer than tolerance to the simplified ring
+        The ring is kept as is if fewer than 4 points would be left
+        @param tolerance: tolerance of rdp_mask in meters
+        '''
+        keep = rdp_mask(self._positions, tolerance)
+        if np.count_nonzero(keep) >= 4:
+            self._positions = self._positions[keep]
 
 
-    def _interpolate(self, step=3):
+    def _interpolate(self, step=INTERPOLATION_STEP):
         '''
-        Interpolate points in the polygon
+        Interpolate points in the polygon, all edges of the ring at once
         @param step: distance between points in meters
         '''
-        new_points = []
-        for i in range(len(self._points)):
-            p1 = self._points[i]
-            p2 = self._points[(i + 1) % len(self._points)]
-            dist = np.linalg.norm(p1._tf[:2, 3] - p2._tf[:2, 3])
-            if dist < step:
-                new_points.append(p1)
-                continue
-            num_points = int(dist / step)
-            for j in range(num_points):
-                tf = np.eye(4)
-                tf[:3, 3] = p1._tf[:3, 3] + (p2._tf[:3, 3] - p1._tf[:3, 3]) * j / num_points
-                new_points.append(Point.from_tf(self._tileset, tf))
-
-        self._points = new_points
+        if step <= 0:
+            raise ValueError(f"interpolation step must be positive, got {step}")
+        p1 = self._positions
+        p2 = np.roll(self._positions, -1, axis=0)
+        dist = np.linalg.norm(p1[:, :2] - p2[:, :2], axis=1)
+        # segments shorter than step keep their first point only
+        num_points = np.where(dist < step, 1, (dist / step).astype(np.int64))
+        segment = np.repeat(np.arange(len(p1)), num_points)
+        # index of each new point within its segment
+        j = np.arange(len(segment)) - np.repeat(np.cumsum(num_points) - num_points, num_points)
+        self._positions = p1[segment] + (p2[segment] - p1[segment]) * j[:, None] / num_points[segment, None]
             
 
     def to_trimesh(self, color=None):
-        if len(self._points) < 4:
+        if len(self._positions) < 4:
             return None, None
         if color is None:
             color = [255, 0, 255, 80]
-        points = [point._tf[:3, 3] for point in self._points]
+        points = self._positions
         try:
-            tri = Delaunay([point[:2] for point in points])
+            tri = Delaunay(points[:, :2])
         except Exception as e:
             self._logger.exception(f"error triangulating polygon: {e}. Points: {points}")
             return None, None
@@ -153,56 +269,24 @@ class PolygonSegment:
         return mesh
         
 
-    def _find_real_height(self, direction=None):
-        def _check_polygon_in_tile(tile, points):
-            tile_tf = np.eye(4)
-            tile_tf[:3, 3] = tile.box[:3]
-            tile_tf = np.linalg.inv(self._tileset.origin_translation) @ np.linalg.inv(self._tileset.origin_rotation)  @ tile_tf @ self._tileset.origin_rotation
-            tile_center = tile_tf[:3, 3][:2]
-            for point in points:
-                xyz = point._tf[:3, 3]
-                #  check if the point is too far from the tile center in 2D
-                if np.linalg.norm(tile_center - xyz[:2]) < 1.2 * tile.box[3]:
-                    return True
-            return False
-        
+    def _find_real_height(self, direction=None, rays=None, ring=None):
+        '''
+        @param direction: direction of the rays, defaults to up
+        @param rays: cast RayBatch holding the rays of the ring, its rings are clustered together.
+            The ring is cast here if not given
+        @param ring: index of the ring in rays
+        '''
+        if rays is None:
+            rays = RayBatch(self._tileset, direction)
+            ring = rays.add(self._positions)
+            rays.cast()
 
-        def check_if_point_is_unique(point, points):
-            for p in points:
-                if np.linalg.norm(p[:2] - point[:2]) < 0.001:
-                    # save only the lowest point
-                    if point[2] < p[2]:
-                        p[2] = point[2]
-                    return
-            else:
-                points.append(point)
-
-
-        if direction is None:
-            direction = [0, 0, 1]
-
-        meshes_to_check = []
-        for tile in self._tileset.tiles:
-            if _check_polygon_in_tile(tile, self._points):
-                meshes_to_check.extend(self._tileset.models[tile.uri])
-
-        itersected_points = []
-        for mesh in meshes_to_check:
-            intersector = tm.ray.ray_pyembree.RayMeshIntersector(mesh)
-            # get points and directions
-            points = [point._tf[:3, 3] for point in self._points]
-            directions = [direction] * len(points)
-            locations, index_ray, index_tri = intersector.intersects_location(points, directions)
-            points_set = []
-            for i, location in enumerate(locations):
-                if location is not None:
-                    check_if_point_is_unique(location, points_set)
-            itersected_points.extend(points_set)
+        # hits of every mesh near the ring, a ray crossing a mesh several times at the same place is kept once
+        itersected_points = rays.points(ring)
 
         if len(itersected_points) < 5:
-            self._points = []
+            self._positions = np.zeros((0, 3))
             return
-        new_points = []
         # # apply db scan to filter out outliers
         # itersected_points = np.array(itersected_points)
         # # eps = 3 meters, min_samples = 3
@@ -218,11 +302,8 @@ class PolygonSegment:
         #         max_count = count
         #         max_label = label
         # apply dbscan only for z axis
-        itersected_points = np.array(itersected_points)
-        labels = np.zeros(len(itersected_points))
-        # eps is meters, min_samples is number of points in the cluster
-        db = DBSCAN(eps=5, min_samples=2).fit(itersected_points[:, 2].reshape(-1, 1))
-        labels = db.labels_
+        # eps is meters, min_samples is number of points in the cluster, same labels as DBSCAN
+        labels = rays.height_labels(ring, eps=5, min_samples=2)
         unique_labels = np.unique(labels)
         labels_mean = np.zeros(len(unique_labels))
         for i, label in enumerate(unique_labels):
@@ -231,46 +312,59 @@ class PolygonSegment:
         mean_label = np.argmin(labels_mean)
         # compute mean height only for the most common label
         if len(itersected_points[labels == mean_label]) < 4:
-            self._points = []
+            self._positions = np.zeros((0, 3))
             return
         mean_height = labels_mean[mean_label]
         # code below is used to find the nearest point from raycasted points to the intersected points
-        for point in self._points:
-            nearst_idx = np.argmin([np.linalg.norm(x[:2] - point._tf[:3, 3][:2]) for x in itersected_points])
-            if nearst_idx is None:
-                continue
-            if np.linalg.norm(point._tf[:3, 3][:2] - itersected_points[nearst_idx][:2]) < 0.5:
-                tf = np.eye(4)
-                tf[:3, 3] = itersected_points[nearst_idx]
-                if labels[nearst_idx] != mean_height:
-                    tf[:3, 3][2] = mean_height
-                new_points.append(Point.from_tf(self._tileset, tf))
-            else:
-                tf = np.eye(4)
-                tf[:3, 3] = point._tf[:3, 3]
-                tf[:3, 3][2] = mean_height
-                new_points.append(Point.from_tf(self._tileset, tf))
+        distances, nearest = cKDTree(itersected_points[:, :2]).query(self._positions[:, :2])
+        close = distances < 0.5
+        new_points = self._positions.copy()
+        new_points[close] = itersected_points[nearest[close]]
+        new_points[:, 2] = np.where(close & (labels[nearest] == mean_height), new_points[:, 2], mean_height)
         if len(new_points) < 4:
-            self._points = []
+            self._positions = np.zeros((0, 3))
             return
-        self._points = new_points
+        self._positions = new_points
 
 
     def as_geojson(self):
-        return [point.as_geojson()['coordinates'] for point in self._points]
+        coords = self._tileset.local_to_cartesian(self._positions)
+        # lat, lon, alt to geojson lon, lat, alt
+        return coords[:, [1, 0, 2]].tolist()
 
 
 class Polygon:
-    def __init__(self, tileset, segments):
+    def __init__(self, tileset, segments, rays=None, step=INTERPOLATION_STEP, tolerance=None):
+        '''
+        @param tileset: TilesLoader
+        @param segments: list of rings of geojson coordinates
+        @param rays: RayBatch shared with other polygons, finish must be called after it is cast.
+            If not set, the rings of the polygon are cast together right away
+        @param step: distance between the interpolated points of the rings in meters, see PolygonSegment
+        @param tolerance: simplification tolerance of the rings in meters, see PolygonSegment
+        '''
         self._logger = logging.getLogger("primitive.polygon")
         self._tileset = tileset
-        self._segments = []
-        for segment in segments:
+        batch = rays if rays is not None else RayBatch(tileset)
+        self._segments = [PolygonSegment(tileset, segment, tolerance=tolerance, rays=batch, step=step) for segment in segments]
+        if rays is None:
+            batch.cast()
+            self.finish()
+
+
+    def finish(self):
+        '''
+        Recover the height of the rings, rings with too few points are dropped
+        @raise EmptyPolygon: if no ring is left
+        '''
+        segments = []
+        for segment in self._segments:
             try:
-                polygon_segment = PolygonSegment(tileset, segment)
+                segment.finish()
             except EmptyPolygon as e:
                 continue
-            self._segments.append(polygon_segment)
+            segments.append(segment)
+        self._segments = segments
         if not self._segments:
             raise EmptyPolygon("Polygon has no segments")
         
@@ -296,17 +390,37 @@ class Polygon:
 
 
 class MultiPolygon:
-    def __init__(self, tileset, polygons):
+    def __init__(self, tileset, polygons, rays=None, step=INTERPOLATION_STEP, tolerance=None):
+        '''
+        @param tileset: TilesLoader
+        @param polygons: list of polygons of geojson coordinates
+        @param rays: RayBatch shared with other polygons, finish must be called after it is cast.
+            If not set, the rings of all polygons are cast together right away
+        @param step: distance between the interpolated points of the rings in meters, see PolygonSegment
+        @param tolerance: simplification tolerance of the rings in meters, see PolygonSegment
+        '''
         self._logger = logging.getLogger("primitive.multi_polygon")
         self._tileset = tileset
-        # self._polygons = [Polygon(tileset, polygon) for polygon in polygons]
-        self._polygons = []
-        for polygon in polygons:
+        batch = rays if rays is not None else RayBatch(tileset)
+        self._polygons = [Polygon(tileset, polygon, rays=batch, step=step, tolerance=tolerance) for polygon in polygons]
+        if rays is None:
+            batch.cast()
+            self.finish()
+
+
+    def finish(self):
+        '''
+        Recover the height of the polygons, empty polygons are dropped
+        @raise EmptyPolygon: if no polygon is left
+        '''
+        polygons = []
+        for polygon in self._polygons:
             try:
-                polygon = Polygon(tileset, polygon)
+                polygon.finish()
             except EmptyPolygon as e:
                 continue
-            self._polygons.append(polygon)
+            polygons.append(polygon)
+        self._polygons = polygons
         if not self._polygons:
             raise EmptyPolygon("MultiPolygon has no polygons")
 
@@ -331,16 +445,23 @@ class MultiPolygon:
 
 
 class Primitive:
-    def __init__(self, tileset, feature):
+    def __init__(self, tileset, feature, rays=None, step=INTERPOLATION_STEP, tolerance=None):
+        '''
+        @param tileset: TilesLoader
+        @param feature: geojson feature
+        @param rays: RayBatch shared with other features, finish must be called after it is cast
+        @param step: distance between the interpolated points of the rings in meters, see PolygonSegment
+        @param tolerance: simplification tolerance of the rings in meters, see PolygonSegment
+        '''
         self._logger = logging.getLogger("primitive")
         self._tileset = tileset
         self._properties = feature['properties']
         self._category = feature['properties']['class']
         try:
             if feature['geometry']['type'] == 'Polygon':
-                primitive = Polygon(tileset, feature['geometry']['coordinates'])
+                primitive = Polygon(tileset, feature['geometry']['coordinates'], rays=rays, step=step, tolerance=tolerance)
             elif feature['geometry']['type'] == 'MultiPolygon':
-                primitive = MultiPolygon(tileset, feature['geometry']['coordinates'])
+                primitive = MultiPolygon(tileset, feature['geometry']['coordinates'], rays=rays, step=step, tolerance=tolerance)
             elif feature['geometry']['type'] == 'Point':
                 primitive = Point(tileset, feature['geometry']['coordinates'])
             else:
@@ -348,6 +469,17 @@ class Primitive:
         except EmptyPolygon as e:
             raise
         self._primitive = primitive
+        self._deferred = rays is not None and not isinstance(primitive, Point)
+
+
+    def finish(self):
+        '''
+        Recover the height of the feature after its RayBatch is cast
+        @raise EmptyPolygon: if nothing of the feature is left
+        '''
+        if self._deferred:
+            self._deferred = False
+            self._primitive.finish()
 
 
     def to_trimesh(self, color=None):
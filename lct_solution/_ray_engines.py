@@ -0,0 +1,255 @@
+import abc
+import numpy as np
+import trimesh as tm
+
+
+class RayEngine(abc.ABC):
+    '''
+    Ray intersector of a single mesh
+    Every backend returns all the hits of every ray, like trimesh's intersects_location with multiple_hits,
+    ordered by their rank along the ray and then by ray: the nearest hit of every ray first, then the second ones...
+    Like trimesh, at most max_hits hits are kept per ray
+    '''
+    name = None
+    max_hits = 100
+
+    @abc.abstractmethod
+    def __init__(self, mesh) -> None:
+        '''
+        @param mesh: trimesh.Trimesh
+        '''
+
+
+    @classmethod
+    def available(cls) -> bool:
+        '''
+        Whether the dependencies of the backend can be imported
+        '''
+        return True
+
+
+    @abc.abstractmethod
+    def intersects_location(self, origins, directions):
+        '''
+        Intersect the mesh with rays
+        @param origins: (n, 3) array of ray origins
+        @param directions: (n, 3) array of ray directions
+        @return: tuple of (m, 3) array of hit locations, (m,) array of ray indices and (m,) array of triangle indices
+        '''
+
+
+def _rank_order(index_ray, t, max_hits):
+    '''
+    Order of hits by their rank along their ray and then by ray
+    @param index_ray: (m,) array of ray indices of the hits
+    @param t: (m,) array of distances of the hits along their rays
+    @param max_hits: hits of a ray beyond this rank are dropped
+    @return: indices of the kept hits, in order
+    '''
+    by_ray = np.lexsort((t, index_ray))
+    starts = np.searchsorted(index_ray[by_ray], index_ray[by_ray], side='left')
+    rank = np.empty(len(by_ray), dtype=np.int64)
+    rank[by_ray] = np.arange(len(by_ray)) - starts
+    order = np.lexsort((index_ray, rank))
+    return order[rank[order] < max_hits]
+
+
+class EmbreeEngine(RayEngine):
+    '''
+    Intel Embree through trimesh.ray.ray_pyembree, needs the embreex (or pyembree) wheels
+    '''
+    name = 'embree'
+
+    def __init__(self, mesh) -> None:
+        self._intersector = tm.ray.ray_pyembree.RayMeshIntersector(mesh)
+
+
+    @classmethod
+    def available(cls) -> bool:
+        return tm.ray.has_embree
+
+
+    def intersects_location(self, origins, directions):
+        # trimesh already reports the hits layer by layer, with its own limit of hits per ray
+        return self._intersector.intersects_location(origins, directions)
+
+
+class Open3DEngine(RayEngine):
+    '''
+    Open3D's RaycastingScene, which is Embree bundled with open3d
+    The scene is single precision, so hits far from the origin of the local frame lose accuracy
+    '''
+    name = 'open3d'
+
+    def __init__(self, mesh) -> None:
+        import open3d as o3d
+        self._o3d = o3d
+        self._scene = o3d.t.geometry.RaycastingScene()
+        self._scene.add_triangles(o3d.core.Tensor(np.asarray(mesh.vertices, dtype=np.float32)),
+                                  o3d.core.Tensor(np.asarray(mesh.faces, dtype=np.uint32)))
+
+
+    @classmethod
+    def available(cls) -> bool:
+        try:
+            import open3d as o3d
+        except ImportError:
+            return False
+        return hasattr(o3d.t.geometry.RaycastingScene, 'list_intersections')
+
+
+    def intersects_location(self, origins, directions):
+        origins = np.asarray(origins, dtype=np.float64).reshape(-1, 3)
+        directions = np.asarray(directions, dtype=np.float64).reshape(-1, 3)
+        if len(origins) == 0:
+            return np.zeros((0, 3)), np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+        rays = np.hstack([origins, directions]).astype(np.float32)
+        result = self._scene.list_intersections(self._o3d.core.Tensor(rays))
+        index_ray = result['ray_ids'].numpy().astype(np.int64)
+        t = result['t_hit'].numpy().astype(np.float64)
+        index_tri = result['primitive_ids'].numpy().astype(np.int64)
+        order = _rank_order(index_ray, t, self.max_hits)
+        index_ray, t, index_tri = index_ray[order], t[order], index_tri[order]
+        locations = origins[index_ray] + directions[index_ray] * t[:, None]
+        return locations, index_ray, index_tri
+
+
+class NumpyEngine(RayEngine):
+    '''
+    Bounding volume hierarchy in pure NumPy, the fallback when no other backend is installed
+    The tree is built with median splits on the longest axis of the triangle centroids. All rays traverse it
+    together: the pairs of rays and nodes whose boxes they cross are expanded level by level, and the pairs
+    reaching a leaf are tested against its triangles with the Moller-Trumbore algorithm
+    '''
+    name = 'numpy'
+    leaf_size = 8
+    edge_tolerance = 1e-6
+
+    def __init__(self, mesh) -> None:
+        self._triangles = np.asarray(mesh.triangles, dtype=np.float64).reshape(-1, 3, 3)
+        self._build()
+
+
+    def _build(self):
+        triangles = self._triangles
+        centroids = triangles.mean(axis=1)
+        tri_min = triangles.min(axis=1)
+        tri_max = triangles.max(axis=1)
+        order = np.arange(len(triangles))
+        bounds_min, bounds_max, left, start, count = [], [], [], [], []
+        stack = [(0, len(triangles), 0)]
+        # root node, children are appended in pairs so the right child of a node is left + 1
+        for values in (bounds_min, bounds_max, left, start, count):
+            values.append(None)
+        while stack:
+            begin, end, node = stack.pop()
+            indices = order[begin:end]
+            if len(indices):
+                bounds_min[node] = tri_min[indices].min(axis=0)
+                bounds_max[node] = tri_max[indices].max(axis=0)
+            else:
+                bounds_min[node] = np.full(3, np.inf)
+                bounds_max[node] = np.full(3, -np.inf)
+            start[node], count[node], left[node] = begin, end - begin, -1
+            if end - begin <= self.leaf_size:
+                continue
+            extent = centroids[indices].max(axis=0) - centroids[indices].min(axis=0)
+            axis = int(np.argmax(extent))
+            middle = (end - begin) // 2
+            order[begin:end] = indices[np.argpartition(centroids[indices, axis], middle)]
+            left[node] = len(left)
+            for values in (bounds_min, bounds_max, left, start, count):
+                values.extend((None, None))
+            stack.append((begin, begin + middle, left[node]))
+            stack.append((begin + middle, end, left[node] + 1))
+        self._order = order
+        self._bounds_min = np.array(bounds_min).reshape(-1, 3)
+        self._bounds_max = np.array(bounds_max).reshape(-1, 3)
+        self._left = np.array(left, dtype=np.int64)
+        self._start = np.array(start, dtype=np.int64)
+        self._count = np.array(count, dtype=np.int64)
+
+
+    def intersects_location(self, origins, directions):
+        origins = np.asarray(origins, dtype=np.float64).reshape(-1, 3)
+        directions = np.asarray(directions, dtype=np.float64).reshape(-1, 3)
+        # components of the directions parallel to an axis are nudged so the slab test needs no special case
+        safe = np.where(np.abs(directions) < 1e-12, np.where(directions < 0, -1e-12, 1e-12), directions)
+        inverse = 1.0 / safe
+        found_rays, found_tris, found_t = [], [], []
+        rays = np.arange(len(origins))
+        nodes = np.zeros(len(origins), dtype=np.int64)
+        while len(rays):
+            low = (self._bounds_min[nodes] - origins[rays]) * inverse[rays]
+            high = (self._bounds_max[nodes] - origins[rays]) * inverse[rays]
+            near = np.minimum(low, high).max(axis=1)
+            far = np.maximum(low, high).min(axis=1)
+            crossed = far >= np.maximum(near, 0)
+            rays, nodes = rays[crossed], nodes[crossed]
+            inner = self._left[nodes] >= 0
+            leaf_rays, leaf_nodes = rays[~inner], nodes[~inner]
+            if len(leaf_rays):
+                counts = self._count[leaf_nodes]
+                pair_rays = np.repeat(leaf_rays, counts)
+                offsets = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+                pair_tris = self._order[np.repeat(self._start[leaf_nodes], counts) + offsets]
+                hit, t = self._moller_trumbore(origins[pair_rays], directions[pair_rays], pair_tris)
+                found_rays.append(pair_rays[hit])
+                found_tris.append(pair_tris[hit])
+                found_t.append(t[hit])
+            rays = np.repeat(rays[inner], 2)
+            nodes = np.repeat(self._left[nodes[inner]], 2)
+            nodes[1::2] += 1
+        if not found_rays:
+            return np.zeros((0, 3)), np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+        index_ray = np.concatenate(found_rays)
+        index_tri = np.concatenate(found_tris)
+        t = np.concatenate(found_t)
+        order = _rank_order(index_ray, t, self.max_hits)
+        index_ray, t, index_tri = index_ray[order], t[order], index_tri[order]
+        locations = origins[index_ray] + directions[index_ray] * t[:, None]
+        return locations, index_ray, index_tri
+
+
+    def _moller_trumbore(self, origins, directions, tris):
+        '''
+        Intersect pairs of rays and triangles, both faces of the triangles are hit
+        @return: tuple of (n,) boolean array of hits and (n,) array of distances along the rays
+        '''
+        v0, v1, v2 = self._triangles[tris, 0], self._triangles[tris, 1], self._triangles[tris, 2]
+        edge1 = v1 - v0
+        edge2 = v2 - v0
+        p = np.cross(directions, edge2)
+        det = np.einsum('ij,ij->i', edge1, p)
+        valid = np.abs(det) > 1e-12
+        inv_det = np.divide(1.0, det, out=np.zeros_like(det), where=valid)
+        s = origins - v0
+        u = np.einsum('ij,ij->i', s, p) * inv_det
+        q = np.cross(s, edge1)
+        v = np.einsum('ij,ij->i', directions, q) * inv_det
+        t = np.einsum('ij,ij->i', edge2, q) * inv_det
+        # a little slack on the barycentric coordinates, so rays through an edge on the border of a mesh
+        # are not lost to rounding, as embree does
+        hit = valid & (u >= -self.edge_tolerance) & (v >= -self.edge_tolerance) & (u + v <= 1 + self.edge_tolerance) & (t >= 0)
+        return hit, t
+
+
+RAY_ENGINES = {engine.name: engine for engine in (EmbreeEngine, Open3DEngine, NumpyEngine)}
+
+
+def get_ray_engine(name='auto'):
+    '''
+    Ray engine by name
+    @param name: one of RAY_ENGINES, or 'auto' for the first available of embree, open3d and numpy
+    @return: subclass of RayEngine
+    '''
+    if name == 'auto':
+        for engine in RAY_ENGINES.values():
+            if engine.available():
+                return engine
+    if name not in RAY_ENGINES:
+        raise ValueError(f"unknown ray engine {name}, expected one of {['auto', *RAY_ENGINES]}")
+    engine = RAY_ENGINES[name]
+    if not engine.available():
+        raise ImportError(f"ray engine {name} is not available")
+    return engine
@@ -0,0 +1,120 @@
+import logging
+import numpy as np
+import tqdm
+from ._clustering import cluster_heights_batch
+from ._spatial import unique_lowest_points
+
+
+class RayBatch:
+    '''
+    Rays cast from the points of many polygon rings at once
+    Rings are added first, then every mesh is intersected a single time with the rays of all the rings
+    near its tile, and the hits are handed back to each ring. The heights of the hits of all the rings
+    are clustered together too, see height_labels
+    '''
+    def __init__(self, tileset, direction=None) -> None:
+        '''
+        @param tileset: TilesLoader
+        @param direction: direction of the rays, defaults to up
+        '''
+        self._logger = logging.getLogger("primitive.ray_batch")
+        self._tileset = tileset
+        self._direction = np.array(direction if direction is not None else [0, 0, 1], dtype=np.float64)
+        self._origins = []
+        self._uris = []
+        self._hits = None
+        self._points = {}
+        self._labels = {}
+
+
+    def add(self, positions) -> int:
+        '''
+        Add the rays of a ring
+        @param positions: (n, 3) array of ray origins in the local frame of the scene
+        @return: index of the ring, see hits
+        '''
+        positions = np.asarray(positions, dtype=np.float64).reshape(-1, 3)
+        tiles = self._tileset.tiles_near_points(positions[:, :2])
+        self._origins.append(positions)
+        # a tile listed twice is checked twice, as a ring cast on its own would
+        self._uris.append([tile.uri for tile in tiles])
+        self._hits = None
+        self._points = {}
+        self._labels = {}
+        return len(self._origins) - 1
+
+
+    def __len__(self):
+        return len(self._origins)
+
+
+    def cast(self, progress=False):
+        '''
+        Intersect every mesh near the added rings with their rays
+        @param progress: show a progress bar over the tiles
+        '''
+        rings_by_uri = {}
+        for ring, uris in enumerate(self._uris):
+            for uri in dict.fromkeys(uris):
+                rings_by_uri.setdefault(uri, []).append(ring)
+        self._hits = {}
+        self._points = {}
+        self._labels = {}
+        for uri, rings in tqdm.tqdm(rings_by_uri.items(), desc="Casting rays", unit="tile", disable=not progress):
+            origins = np.concatenate([self._origins[ring] for ring in rings])
+            offsets = np.cumsum([0] + [len(self._origins[ring]) for ring in rings])
+            directions = np.broadcast_to(self._direction, origins.shape)
+            hits = []
+            for intersector in self._tileset.intersectors(uri):
+                locations, index_ray, _index_tri = intersector.intersects_location(origins, directions)
+                # ring of each hit, a stable sort groups the hits by ring and keeps their order within a ring
+                owner = np.searchsorted(offsets, index_ray, side='right') - 1
+                order = np.argsort(owner, kind='stable')
+                bounds = np.searchsorted(owner[order], np.arange(len(rings) + 1))
+                locations = locations[order]
+                hits.append({ring: locations[bounds[i]:bounds[i + 1]] for i, ring in enumerate(rings)})
+            self._hits[uri] = hits
+        self._logger.debug(f"cast {sum(map(len, self._origins))} rays of {len(self)} rings against {len(rings_by_uri)} tiles")
+
+
+    def hits(self, ring):
+        '''
+        Hits of the rays of a ring
+        @param ring: index of the ring returned by add
+        @return: list of (m, 3) arrays of hit locations, one per mesh checked for the ring
+        '''
+        if self._hits is None:
+            raise RuntimeError("cast must be called before hits")
+        return [mesh_hits[ring] for uri in self._uris[ring] for mesh_hits in self._hits[uri]]
+
+
+    def points(self, ring):
+        '''
+        Hits of the rays of a ring on all the meshes checked for it, a ray crossing a mesh several times
+        at the same place is kept once, see unique_lowest_points
+        @param ring: index of the ring returned by add
+        @return: (m, 3) array of hit locations
+        '''
+        if ring not in self._points:
+            points = [unique_lowest_points(locations) for locations in self.hits(ring)]
+            self._points[ring] = np.concatenate(points) if points else np.zeros((0, 3))
+        return self._points[ring]
+
+
+    def height_labels(self, ring, eps=5, min_samples=2):
+        '''
+        Clusters of the heights of the points of a ring, labelled like DBSCAN(eps, min_samples) on their z values
+        The first call clusters the points of all the rings at once with cluster_heights_batch, using the rings as segments
+        @param ring: index of the ring returned by add
+        @param eps: see cluster_heights_batch
+        @param min_samples: see cluster_heights_batch
+        @return: (m,) int array of labels of points(ring), -1 for noise
+        '''
+        key = (eps, min_samples)
+        if key not in self._labels:
+            points = [self.points(i) for i in range(len(self))]
+            counts = [len(ring_points) for ring_points in points]
+            heights = np.concatenate([ring_points[:, 2] for ring_points in points]) if points else np.zeros(0)
+            labels = cluster_heights_batch(heights, np.repeat(np.arange(len(points)), counts), eps, min_samples)
+            self._labels[key] = np.split(labels, np.cumsum(counts)[:-1])
+        return self._labels[key][ring]
@@ -48,11 +48,18 @@ def split_images(tiles: TilesLoader,
     for x in tqdm.tqdm(range(count[0]), desc="Generating images in x"):
         for y in tqdm.tqdm(range(count[1]), desc="Generating images in y", leave=False):
             scene = pyrender.Scene()
-            for mesh in tiles._loaded_models.values():
-                mesh = pyrender.Mesh.from_trimesh(mesh, smooth=False)
-                scene.add(mesh)
             camera_tf = np.eye(4)
             camera_tf[:3, 3] = [camera_step / 2 + x * camera_step, camera_step / 2 + y * camera_step, camera_dst]
+            # only the tiles under the camera are rendered, so in lazy mode only they are loaded.
+            # the half size covers xmag and ymag of the orthographic camera below
+            view_half_size = max(1.0, camera_step / 2)
+            visible_tiles = tiles.tiles_in_rect(camera_tf[:2, 3] - view_half_size, camera_tf[:2, 3] + view_half_size)
+            for uri in dict.fromkeys(tile.uri for tile in visible_tiles):
+                trimeshes = tiles.models.get(uri)
+                if not trimeshes:
+                    continue
+                mesh = pyrender.Mesh.from_trimesh(trimeshes, smooth=False)
+                scene.add(mesh)
             # camera_tf = np.dot(tiles.origin_rotation, camera_tf)
             camera_axis_frame = tm.creation.axis(origin_size=5, transform=camera_tf)
             scene.add(pyrender.Mesh.from_trimesh(camera_axis_frame, smooth=False))
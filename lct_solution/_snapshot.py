@@ -0,0 +1,215 @@
+import hashlib
+import json
+import logging
+import os
+import pathlib
+import traceback
+import typing
+import numpy as np
+import trimesh as tm
+from .glb import load_glb
+from .glb.extract_textures import gltf_image_to_pillow
+from .glb.to_trimesh import primitive_image
+
+
+# bump when the layout of the snapshot or the way tiles are loaded changes
+SNAPSHOT_VERSION = 2
+
+
+def snapshot_key(planar_path, tile_paths) -> str:
+    '''
+    Key of a snapshot, changes when the planar json or any of the tile files change
+    The planar json is hashed, tile files are identified by their size and modification time
+    @param planar_path: path of the planar json
+    @param tile_paths: paths of the tile files
+    @return: hex digest
+    '''
+    digest = hashlib.sha256()
+    with open(planar_path, 'rb') as f:
+        digest.update(f.read())
+    for path in sorted(set(map(str, tile_paths))):
+        try:
+            stat = os.stat(path)
+            digest.update(f"{path}\0{stat.st_size}\0{stat.st_mtime_ns}\0".encode())
+        except OSError:
+            digest.update(f"{path}\0missing\0".encode())
+    return digest.hexdigest()
+
+
+class SceneSnapshot:
+    '''
+    Preprocessed scene of a TilesLoader kept in a directory: the local frame of the scene and the vertices,
+    faces and texture coordinates of every tile already moved to it. The tiles themselves are covered by
+    the key, which includes the hash of the planar json
+    Arrays are stored as .npy files and opened with np.memmap, so only the pages of the tiles that are
+    actually used are read. Textures are not stored: they are decoded from the source glb on load
+    '''
+    def __init__(self, path, meta) -> None:
+        self._logger = logging.getLogger("tiles_loader.snapshot")
+        self._path = pathlib.Path(path)
+        self._meta = meta
+        self._meshes = meta['meshes']
+        prefix = meta['key'][:16]
+        # copy-on-write, a consumer modifying a mesh in place never touches the file
+        self._vertices = np.load(self._path / f"{prefix}.vertices.npy", mmap_mode='c')
+        self._faces = np.load(self._path / f"{prefix}.faces.npy", mmap_mode='c')
+        self._uv = np.load(self._path / f"{prefix}.uv.npy", mmap_mode='c') if meta['textures'] else None
+
+
+    @classmethod
+    def open(cls, path, key, textures=True) -> typing.Optional['SceneSnapshot']:
+        '''
+        Open the snapshot in a directory
+        @param path: directory of the snapshot
+        @param key: expected key, see snapshot_key
+        @param textures: whether texture coordinates are needed
+        @return: SceneSnapshot, or None if there is no snapshot, it is stale, or it lacks texture coordinates
+        '''
+        try:
+            with open(pathlib.Path(path) / 'meta.json') as f:
+                meta = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if meta.get('version') != SNAPSHOT_VERSION or meta.get('key') != key:
+            return None
+        if textures and not meta['textures']:
+            return None
+        try:
+            return cls(path, meta)
+        except (OSError, ValueError):
+            return None
+
+
+    @staticmethod
+    def save(path, key, loader, textures=True) -> bool:
+        '''
+        Save the loaded scene of a TilesLoader
+        Arrays are written under names derived from the key and meta.json is replaced last,
+        so a process reading the previous snapshot is not affected
+        @param path: directory of the snapshot
+        @param key: key of the snapshot, see snapshot_key
+        @param loader: TilesLoader with all tiles loaded
+        @param textures: whether the tiles were loaded with textures
+        @return: True if the snapshot was saved
+        '''
+        logger = logging.getLogger("tiles_loader.snapshot")
+        path = pathlib.Path(path)
+        models = loader.models
+        if textures and any(pathlib.PurePath(uri).suffix != '.glb' for uri in models):
+            logger.warning("not saving a snapshot: textures can only be restored for .glb tiles")
+            return False
+        meshes = {}
+        vertex_count = face_count = 0
+        for uri, trimeshes in models.items():
+            images = [None] * len(trimeshes)
+            if textures:
+                gltf = load_glb(loader.root_dir / uri)
+                images = [primitive_image(gltf, primitive)
+                          for mesh in gltf.model.meshes or [] for primitive in mesh.primitives]
+            meshes[uri] = []
+            for mesh, image in zip(trimeshes, images):
+                if getattr(mesh.visual, 'uv', None) is None:
+                    image = None
+                meshes[uri].append([vertex_count, len(mesh.vertices), face_count, len(mesh.faces), image])
+                vertex_count += len(mesh.vertices)
+                face_count += len(mesh.faces)
+        path.mkdir(parents=True, exist_ok=True)
+        prefix = key[:16]
+        arrays = {'vertices': (np.float64, 3), 'faces': (np.int64, 3)}
+        if textures:
+            arrays['uv'] = (np.float64, 2)
+        for name, (dtype, width) in arrays.items():
+            tmp_path = path / f"{prefix}.{name}.{os.getpid()}.tmp.npy"
+            try:
+                count = face_count if name == 'faces' else vertex_count
+                array = np.lib.format.open_memmap(tmp_path, mode='w+', dtype=dtype, shape=(count, width))
+                for uri, trimeshes in models.items():
+                    for mesh, (v0, vn, f0, fn, image) in zip(trimeshes, meshes[uri]):
+                        if name == 'vertices':
+                            array[v0:v0 + vn] = mesh.vertices
+                        elif name == 'faces':
+                            array[f0:f0 + fn] = mesh.faces
+                        elif image is not None:
+                            array[v0:v0 + vn] = mesh.visual.uv
+                array.flush()
+                del array
+                os.replace(tmp_path, path / f"{prefix}.{name}.npy")
+            finally:
+                if tmp_path.exists():
+                    tmp_path.unlink()
+        meta = {'version': SNAPSHOT_VERSION,
+                'key': key,
+                'textures': textures,
+                'origin_rotation': np.asarray(loader.origin_rotation).tolist(),
+                'origin_translation': np.asarray(loader.origin_translation).tolist(),
+                'min_height': float(loader.min_height),
+                'max_point': np.asarray(loader.max_point).tolist(),
+                'meshes': meshes}
+        tmp_path = path / f"meta.json.{os.getpid()}.tmp"
+        try:
+            with open(tmp_path, 'w') as f:
+                json.dump(meta, f, separators=(',', ':'))
+            os.replace(tmp_path, path / 'meta.json')
+        finally:
+            if tmp_path.exists():
+                tmp_path.unlink()
+        # arrays of previous snapshots
+        for stale in path.glob('*.npy'):
+            if not stale.name.startswith(prefix):
+                stale.unlink()
+        logger.info(f"saved snapshot {path}: {len(meshes)} tiles, {vertex_count} vertices, {face_count} faces")
+        return True
+
+
+    def load(self, root_dir, uri, textures=True):
+        '''
+        Restore the meshes of a tile, in the local frame of the scene
+        @param root_dir: root directory of the tiles, textures are decoded from the glb files in it
+        @param uri: uri of the tile
+        @param textures: whether to restore textures
+        @return: tuple of (list of trimeshes, None) or (None, error traceback), like load_tile
+        '''
+        if uri not in self._meshes:
+            return None, f"{uri} is not in the snapshot {self._path}, it failed to load when the snapshot was saved\n"
+        try:
+            gltf = None
+            images = {}
+            trimeshes = []
+            for v0, vn, f0, fn, image in self._meshes[uri]:
+                visual = None
+                if textures and image is not None:
+                    if gltf is None:
+                        gltf = load_glb(pathlib.Path(root_dir) / uri)
+                    if image not in images:
+                        images[image] = gltf_image_to_pillow(gltf, gltf.model.images[image])
+                    material = tm.visual.texture.SimpleMaterial(image=images[image])
+                    visual = tm.visual.TextureVisuals(uv=self._uv[v0:v0 + vn], image=images[image], material=material)
+                # faces were already fixed when the tile was loaded
+                trimeshes.append(tm.Trimesh(vertices=self._vertices[v0:v0 + vn],
+                                            faces=self._faces[f0:f0 + fn],
+                                            visual=visual,
+                                            process=False))
+        except (OSError, ValueError):
+            return None, traceback.format_exc()
+        return trimeshes, None
+
+
+    @property
+    def origin_rotation(self):
+        return np.array(self._meta['origin_rotation'])
+
+
+    @property
+    def origin_translation(self):
+        return np.array(self._meta['origin_translation'])
+
+
+    @property
+    def min_height(self):
+        return self._meta['min_height']
+
+
+    @property
+    def max_point(self):
+        return np.array(self._meta['max_point'])
+
@@ -0,0 +1,153 @@
+import collections
+import numpy as np
+from scipy.sparse import coo_matrix
+from scipy.sparse.csgraph import connected_components
+
+
+class TileGrid:
+    '''
+    Uniform grid over the circular footprints of tiles in the xy plane of the local frame
+    Every tile is registered in each cell its footprint's bounding square overlaps, so a query only
+    looks at the tiles of the cells it touches and then checks them exactly
+    '''
+    def __init__(self, centers, radii, cell_size=None) -> None:
+        '''
+        @param centers: (n, 2) array, centers of the tiles
+        @param radii: (n,) array, radii of the footprints
+        @param cell_size: edge length of a cell, defaults to the median footprint diameter
+        '''
+        self._centers = np.asarray(centers, dtype=np.float64).reshape(-1, 2)
+        self._radii = np.asarray(radii, dtype=np.float64).reshape(-1)
+        if cell_size is None:
+            cell_size = 2 * np.median(self._radii) if len(self._radii) else 1.0
+        self._cell_size = cell_size if cell_size > 0 else 1.0
+        self._cells = collections.defaultdict(list)
+        low = self._cell(self._centers - self._radii[:, None])
+        high = self._cell(self._centers + self._radii[:, None])
+        for i in range(len(self._centers)):
+            for x in range(low[i, 0], high[i, 0] + 1):
+                for y in range(low[i, 1], high[i, 1] + 1):
+                    self._cells[(x, y)].append(i)
+
+
+    def _cell(self, xy):
+        return np.floor(np.asarray(xy, dtype=np.float64) / self._cell_size).astype(np.int64)
+
+
+    def _candidates(self, cells):
+        candidates = set()
+        for cell in cells:
+            candidates.update(self._cells.get(cell, ()))
+        return np.array(sorted(candidates), dtype=np.int64)
+
+
+    def query_rect(self, min_xy, max_xy):
+        '''
+        Tiles whose footprint's bounding square overlaps a rectangle
+        @param min_xy: minimum x and y of the rectangle
+        @param max_xy: maximum x and y of the rectangle
+        @return: sorted array of tile indices
+        '''
+        (low_x, low_y), (high_x, high_y) = self._cell(min_xy), self._cell(max_xy)
+        if (high_x - low_x + 1) * (high_y - low_y + 1) > len(self._cells):
+            cells = [cell for cell in self._cells if low_x <= cell[0] <= high_x and low_y <= cell[1] <= high_y]
+        else:
+            cells = [(x, y) for x in range(low_x, high_x + 1) for y in range(low_y, high_y + 1)]
+        candidates = self._candidates(cells)
+        if len(candidates) == 0:
+            return candidates
+        centers = self._centers[candidates]
+        radii = self._radii[candidates, None]
+        mask = np.all((centers + radii >= min_xy) & (centers - radii <= max_xy), axis=1)
+        return candidates[mask]
+
+
+    def query_points(self, points):
+        '''
+        Tiles whose footprint contains at least one of the points
+        @param points: (m, 2) array of x and y coordinates
+        @return: sorted array of tile indices
+        '''
+        points = np.asarray(points, dtype=np.float64).reshape(-1, 2)
+        cells = map(tuple, np.unique(self._cell(points), axis=0).tolist())
+        candidates = self._candidates(cells)
+        if len(candidates) == 0:
+            return candidates
+        distances = np.linalg.norm(self._centers[candidates, None, :] - points[None, :, :], axis=2)
+        mask = np.any(distances <= self._radii[candidates, None], axis=1)
+        return candidates[mask]
+
+
+def close_pairs(points, radius):
+    '''
+    Pairs of points closer than radius in the xy plane, found with a hash grid of cells of size radius:
+    the points of a pair are always in the same or in adjacent cells
+    @param points: (n, 2) or (n, 3) array, only x and y are used
+    @param radius: distance below which two points are paired, strictly
+    @return: (m, 2) array of indices i < j, sorted
+    '''
+    if len(points) < 2:
+        return np.zeros((0, 2), dtype=np.int64)
+    xy = np.asarray(points, dtype=np.float64).reshape(len(points), -1)[:, :2]
+    cells = np.floor((xy - xy.min(axis=0)) / radius).astype(np.int64) + 1
+    width = cells[:, 1].max() + 2
+    keys = cells[:, 0] * width + cells[:, 1]
+    order = np.argsort(keys, kind='stable')
+    sorted_keys = keys[order]
+    pairs = []
+    # each pair of adjacent cells is visited once
+    for dx, dy in ((0, 0), (0, 1), (1, -1), (1, 0), (1, 1)):
+        targets = keys + dx * width + dy
+        low = np.searchsorted(sorted_keys, targets, side='left')
+        counts = np.searchsorted(sorted_keys, targets, side='right') - low
+        first = np.repeat(np.arange(len(xy)), counts)
+        second = order[np.repeat(low, counts) + np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)]
+        close = np.linalg.norm(xy[first] - xy[second], axis=1) < radius
+        first, second = first[close], second[close]
+        if (dx, dy) == (0, 0):
+            first, second = first[first < second], second[first < second]
+        pairs.append(np.column_stack([np.minimum(first, second), np.maximum(first, second)]))
+    pairs = np.concatenate(pairs)
+    return pairs[np.lexsort((pairs[:, 1], pairs[:, 0]))]
+
+
+def unique_lowest_points(points, tolerance=0.001):
+    '''
+    Merge points closer than tolerance in the xy plane into the first of them, which gets their lowest height
+    Points are taken in order and a point close to several kept points is merged into the earliest one,
+    so chains of close points give the same result as comparing each point with all the kept ones
+    @param points: (n, 3) array
+    @param tolerance: distance in the xy plane below which points are merged
+    @return: (m, 3) array of the kept points, in order
+    '''
+    points = np.array(points, dtype=np.float64).reshape(-1, 3)
+    count = len(points)
+    # index of the kept point each point is merged into
+    keep = np.arange(count)
+    pairs = close_pairs(points, tolerance)
+    if len(pairs):
+        graph = coo_matrix((np.ones(len(pairs)), (pairs[:, 0], pairs[:, 1])), shape=(count, count))
+        components, component = connected_components(graph, directed=False)
+        sizes = np.bincount(component, minlength=components)
+        edges = np.bincount(component[pairs[:, 0]], minlength=components)
+        first = np.full(components, count)
+        np.minimum.at(first, component, np.arange(count))
+        # points of a component that are all close to each other are merged into its first point
+        keep = first[component]
+        chained = edges[component] != sizes[component] * (sizes[component] - 1) // 2
+        if chained.any():
+            earlier = {}
+            for i, j in pairs[chained[pairs[:, 0]]].tolist():
+                earlier.setdefault(j, []).append(i)
+            kept = set()
+            for j in np.flatnonzero(chained).tolist():
+                targets = [i for i in earlier.get(j, ()) if i in kept]
+                keep[j] = min(targets) if targets else j
+                if not targets:
+                    kept.add(j)
+    lowest = points[:, 2].copy()
+    np.minimum.at(lowest, keep, points[:, 2])
+    kept = keep == np.arange(count)
+    unique = points[kept]
+    unique[:, 2] = lowest[kept]
+    return unique
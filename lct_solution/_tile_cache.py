@@ -0,0 +1,113 @@
+import collections
+import collections.abc
+import logging
+import typing
+
+
+def trimeshes_nbytes(trimeshes) -> int:
+    '''
+    Memory used by the vertices, faces and textures of a list of trimeshes
+    @param trimeshes: list of trimesh.Trimesh
+    @return: size in bytes
+    '''
+    nbytes = 0
+    for mesh in trimeshes:
+        nbytes += mesh.vertices.nbytes + mesh.faces.nbytes
+        material = getattr(mesh.visual, 'material', None)
+        image = getattr(material, 'image', None)
+        if image is not None:
+            nbytes += image.width * image.height * len(image.getbands())
+    return nbytes
+
+
+class TileCache(collections.abc.Mapping):
+    '''
+    Read-only mapping from tile uri to its list of trimeshes, which loads tiles on first access
+    Loaded tiles are kept in least recently used order and evicted once their total size exceeds max_bytes,
+    the most recently used tile is always kept
+    '''
+    def __init__(self, uris, load, max_bytes) -> None:
+        '''
+        @param uris: uris of the tiles, in the order of iteration
+        @param load: function loading a tile, returns a tuple of (list of trimeshes, None) or (None, error traceback)
+        @param max_bytes: memory budget of the loaded tiles in bytes, see trimeshes_nbytes
+        '''
+        self._logger = logging.getLogger("tiles_loader.cache")
+        self._uris = list(dict.fromkeys(uris))
+        self._known = set(self._uris)
+        self._load = load
+        self._max_bytes = max_bytes
+        self._loaded = collections.OrderedDict()
+        self._nbytes = {}
+        self._total_nbytes = 0
+        self._failed = set()
+        self.hits = 0
+        self.misses = 0
+
+
+    def __getitem__(self, uri) -> typing.List:
+        if uri in self._loaded:
+            self.hits += 1
+            self._loaded.move_to_end(uri)
+            return self._loaded[uri]
+        if uri not in self._known or uri in self._failed:
+            raise KeyError(uri)
+        self.misses += 1
+        trimeshes, error = self._load(uri)
+        if error is not None:
+            self._logger.error(f"error loading tile {uri}:\n{error}")
+            self._failed.add(uri)
+            raise KeyError(uri)
+        self._loaded[uri] = trimeshes
+        self._nbytes[uri] = trimeshes_nbytes(trimeshes)
+        self._total_nbytes += self._nbytes[uri]
+        self._evict()
+        return trimeshes
+
+
+    def _evict(self):
+        while len(self._loaded) > 1 and self._total_nbytes > self._max_bytes:
+            uri, _trimeshes = self._loaded.popitem(last=False)
+            self._total_nbytes -= self._nbytes.pop(uri)
+
+
+    def __contains__(self, uri):
+        return uri in self._known and uri not in self._failed
+
+
+    def __iter__(self):
+        return (uri for uri in self._uris if uri not in self._failed)
+
+
+    def __len__(self):
+        return len(self._known) - len(self._failed)
+
+
+    @property
+    def max_bytes(self):
+        '''
+        Memory budget of the loaded tiles in bytes, lowering it evicts tiles right away
+        '''
+        return self._max_bytes
+
+
+    @max_bytes.setter
+    def max_bytes(self, value):
+        self._max_bytes = value
+        self._evict()
+
+
+    @property
+    def nbytes(self):
+        '''
+        Size of the currently loaded tiles in bytes
+        '''
+        return self._total_nbytes
+
+
+    @property
+    def resident(self):
+        '''
+        Uris of the currently loaded tiles, from the least to the most recently used
+        '''
+        return tuple(self._loaded)
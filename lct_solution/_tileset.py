@@ -0,0 +1,273 @@
+import concurrent.futures
+import hashlib
+import json
+import logging
+import os
+import pathlib
+import posixpath
+import typing
+import numpy as np
+from ._datatypes import Tile
+
+
+# bump when the layout of the index file changes
+INDEX_VERSION = 1
+
+
+def default_index_path(root_dir, root_tileset_filename) -> pathlib.Path:
+    '''
+    Location of the persisted index of a tileset, inside the user cache directory
+    The file name is derived from the absolute path of the root tileset json
+    @param root_dir: root directory of the tileset
+    @param root_tileset_filename: filename of the tileset, relative to root_dir
+    @return: path of the index file
+    '''
+    cache_dir = pathlib.Path(os.environ.get('XDG_CACHE_HOME', pathlib.Path.home() / '.cache'))
+    tileset_path = (pathlib.Path(root_dir) / root_tileset_filename).resolve()
+    key = hashlib.sha256(str(tileset_path).encode()).hexdigest()[:16]
+    return cache_dir / 'lct_solution' / 'tilesets' / f'{tileset_path.stem}.{key}.json'
+
+
+def sphere_from_box(box):
+    '''
+    Bounding sphere of an oriented bounding box
+    @param box: 12 floats, center and three half axes
+    @return: 4 floats, center and radius
+    '''
+    box = np.asarray(box, dtype=np.float64)
+    radius = np.linalg.norm(box[3:12])
+    return np.concatenate([box[:3], [radius]])
+
+
+def box_from_sphere(sphere):
+    '''
+    Axis aligned bounding box of a bounding sphere
+    @param sphere: 4 floats, center and radius
+    @return: 12 floats, center and three half axes
+    '''
+    sphere = np.asarray(sphere, dtype=np.float64)
+    return np.concatenate([sphere[:3], (np.eye(3) * sphere[3]).reshape(-1)])
+
+
+def _parse_tileset(root_dir, uri):
+    '''
+    Parse a single tileset json
+    Runs in a worker process, so only plain python values are returned
+    @param root_dir: root directory of the tileset
+    @param uri: path of the tileset json, relative to root_dir
+    @return: tuple of (size, mtime_ns) of the file and the list of items in depth-first order.
+        Items are ('tile', [uri, sphere, box, geometric_error, depth]) for leaf tiles
+        and ('tileset', uri, depth) for external tilesets, uris are relative to root_dir
+    '''
+    path = os.path.join(root_dir, uri)
+    stat = os.stat(path)
+    with open(path) as f:
+        data = json.load(f)
+    base_dir = posixpath.dirname(uri)
+    items = []
+    # explicit stack instead of recursion, tileset trees can be deep
+    stack = [(data['root'], 0)]
+    while stack:
+        node, depth = stack.pop()
+        children = node.get('children')
+        content = node.get('content')
+        if content is not None:
+            content_uri = posixpath.normpath(posixpath.join(base_dir, content['uri']))
+            if content_uri.endswith('.json'):
+                items.append(('tileset', content_uri, depth + 1))
+            elif not children:
+                bounding_volume = node['boundingVolume']
+                items.append(('tile', [content_uri,
+                                       bounding_volume.get('sphere'),
+                                       bounding_volume.get('box'),
+                                       node.get('geometricError'),
+                                       depth]))
+        if children:
+            stack.extend((child, depth + 1) for child in reversed(children))
+    return (stat.st_size, stat.st_mtime_ns), items
+
+
+class TilesetIndex:
+    '''
+    Leaf tiles of a 3D tileset, including the tiles of all external tilesets it references
+    Every tileset json is parsed once, external tilesets in parallel, and the result is
+    persisted so that later runs only stat the json files instead of parsing them again
+    '''
+    def __init__(self, root_dir, root_tileset_filename) -> None:
+        self._logger = logging.getLogger("tileset_index")
+        self._root_dir = pathlib.Path(root_dir)
+        self._root_tileset_filename = str(root_tileset_filename)
+        self._sources = {}
+        self._tiles = []
+
+
+    @classmethod
+    def load(cls, root_dir, root_tileset_filename, index_path=None, workers=None) -> 'TilesetIndex':
+        '''
+        Load the persisted index of a tileset, building and saving it if it is missing or stale
+        @param root_dir: root directory of the tileset
+        @param root_tileset_filename: filename of the tileset, should be a json file at the root of the tileset
+        @param index_path: path of the index file, defaults to default_index_path
+        @param workers: number of processes parsing tileset jsons, defaults to the number of cpus
+        @return: TilesetIndex
+        '''
+        index = cls(root_dir, root_tileset_filename)
+        if index_path is None:
+            index_path = default_index_path(root_dir, root_tileset_filename)
+        index_path = pathlib.Path(index_path)
+        if index._read(index_path) and index.is_fresh():
+            index._logger.info(f"loaded tileset index {index_path}: {len(index._tiles)} tiles")
+            return index
+        index.build(workers)
+        try:
+            index.save(index_path)
+        except OSError:
+            index._logger.warning(f"could not save tileset index to {index_path}", exc_info=True)
+        return index
+
+
+    def build(self, workers=None):
+        '''
+        Parse the root tileset json and every external tileset it references
+        @param workers: number of processes parsing tileset jsons, defaults to the number of cpus
+        '''
+        if workers is None:
+            workers = os.cpu_count() or 1
+        parsed = {}
+        root_dir = str(self._root_dir)
+        root_uri = posixpath.normpath(self._root_tileset_filename)
+        if workers <= 1:
+            pending = [root_uri]
+            while pending:
+                uri = pending.pop()
+                parsed[uri] = _parse_tileset(root_dir, uri)
+                pending.extend(self._new_tilesets(parsed[uri][1], parsed, pending))
+        else:
+            with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as executor:
+                futures = {executor.submit(_parse_tileset, root_dir, root_uri): root_uri}
+                # external tilesets are submitted as soon as the tileset referencing them is parsed
+                while futures:
+                    done, _ = concurrent.futures.wait(futures, return_when=concurrent.futures.FIRST_COMPLETED)
+                    for future in done:
+                        uri = futures.pop(future)
+                        parsed[uri] = future.result()
+                        for child_uri in self._new_tilesets(parsed[uri][1], parsed, futures.values()):
+                            futures[executor.submit(_parse_tileset, root_dir, child_uri)] = child_uri
+        self._sources = {uri: list(stat) for uri, (stat, _items) in parsed.items()}
+        self._tiles = self._collect(root_uri, parsed)
+        self._logger.info(f"indexed {len(self._sources)} tileset jsons: {len(self._tiles)} tiles")
+
+
+    @staticmethod
+    def _new_tilesets(items, parsed, pending):
+        pending = set(pending)
+        for item in items:
+            if item[0] == 'tileset' and item[1] not in parsed and item[1] not in pending:
+                pending.add(item[1])
+                yield item[1]
+
+
+    def _collect(self, root_uri, parsed):
+        '''
+        Expand external tilesets in place, in depth-first order, so the order of the tiles does not
+        depend on which worker finished first
+        '''
+        tiles = []
+        stack = [(iter(parsed[root_uri][1]), 0, (root_uri,))]
+        while stack:
+            items, base_depth, ancestors = stack[-1]
+            item = next(items, None)
+            if item is None:
+                stack.pop()
+                continue
+            if item[0] == 'tileset':
+                uri = item[1]
+                if uri in ancestors:
+                    self._logger.warning(f"skipping cyclic reference to {uri}")
+                    continue
+                stack.append((iter(parsed[uri][1]), base_depth + item[2], ancestors + (uri,)))
+                continue
+            tile_uri, sphere, box, geometric_error, depth = item[1]
+            if sphere is None and box is None:
+                self._logger.warning(f"skipping {tile_uri}: only sphere and box bounding volumes are supported")
+                continue
+            tiles.append([tile_uri, sphere, box, geometric_error, base_depth + depth])
+        return tiles
+
+
+    def is_fresh(self):
+        '''
+        Check that none of the indexed tileset jsons changed since the index was built
+        '''
+        if not self._sources:
+            return False
+        for uri, (size, mtime_ns) in self._sources.items():
+            try:
+                stat = os.stat(self._root_dir / uri)
+            except OSError:
+                return False
+            if stat.st_size != size or stat.st_mtime_ns != mtime_ns:
+                return False
+        return True
+
+
+    def _read(self, index_path):
+        try:
+            with open(index_path) as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return False
+        if data.get('version') != INDEX_VERSION or data.get('tileset') != self._root_tileset_filename:
+            return False
+        self._sources = data['sources']
+        self._tiles = data['tiles']
+        return True
+
+
+    def save(self, index_path):
+        '''
+        Write the index to a json file, atomically replacing an existing one
+        @param index_path: path of the index file
+        '''
+        index_path = pathlib.Path(index_path)
+        index_path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = index_path.with_name(f"{index_path.name}.{os.getpid()}.tmp")
+        try:
+            with open(tmp_path, 'w') as f:
+                json.dump({'version': INDEX_VERSION,
+                           'tileset': self._root_tileset_filename,
+                           'sources': self._sources,
+                           'tiles': self._tiles}, f, separators=(',', ':'))
+            os.replace(tmp_path, index_path)
+        finally:
+            if tmp_path.exists():
+                tmp_path.unlink()
+
+
+    @property
+    def root_dir(self):
+        return self._root_dir
+
+
+    @property
+    def tileset_count(self):
+        '''
+        Number of tileset jsons, including the root tileset
+        '''
+        return len(self._sources)
+
+
+    @property
+    def tiles(self) -> typing.List[Tile]:
+        '''
+        Leaf tiles in depth-first order, uris are relative to root_dir
+        Tiles which only have a bounding sphere get the axis aligned box of the sphere and vice versa
+        '''
+        tiles = []
+        for uri, sphere, box, geometric_error, depth in self._tiles:
+            tiles.append(Tile(uri,
+                              np.array(box) if box is not None else box_from_sphere(sphere),
+                              geometric_error,
+                              sphere=np.array(sphere) if sphere is not None else sphere_from_box(box),
+                              depth=depth))
+        return tiles
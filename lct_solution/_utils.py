@@ -3,9 +3,14 @@ import open3d as o3d
 import trimesh as tm
 import typing
 import logging
+import concurrent.futures
+import multiprocessing
 from ._datatypes import (Tile,
                          EmptyPolygon)
-from ._meshes import Primitive
+from ._meshes import (Primitive,
+                      INTERPOLATION_STEP)
+from ._raycast import RayBatch
+from ._tile_cache import TileCache
 import tqdm
 
 
@@ -59,13 +64,34 @@ def compute_origin(tiles: typing.List[Tile]) -> np.ndarray:
     return rot_matrix
 
 
-def process_geojson(geo_data, tileset, category_colors:dict):
-    features = []
-    for feature in tqdm.tqdm(geo_data['features'], desc="Processing features on geojson"):
-        if feature['properties']['class'] not in category_colors.keys():
+def _process_features(tileset, features, category_steps, category_tolerances, progress=True):
+    '''
+    Recover the height of features in the current process, the rays of all of them are cast together
+    @param tileset: TilesLoader
+    @param features: list of geojson features to process
+    @param category_steps: see process_geojson
+    @param category_tolerances: see process_geojson
+    @param progress: show progress bars
+    @return: list of Primitive, in the order of the features
+    '''
+    rays = RayBatch(tileset)
+    primitives = []
+    for feature in tqdm.tqdm(features, desc="Processing features on geojson", disable=not progress):
+        try:
+            step = category_steps.get(feature['properties']['class'], INTERPOLATION_STEP)
+            tolerance = category_tolerances.get(feature['properties']['class'])
+            primitive = Primitive(tileset, feature, rays, step, tolerance)
+        except EmptyPolygon as e:
+            continue
+        except Exception as e:
+            logging.exception(f"error processing feature: {e}")
             continue
+        primitives.append(primitive)
+    rays.cast(progress=progress)
+    features = []
+    for primitive in primitives:
         try:
-            primitive = Primitive(tileset, feature)
+            primitive.finish()
         except EmptyPolygon as e:
             continue
         except Exception as e:
@@ -73,3 +99,53 @@ def process_geojson(geo_data, tileset, category_colors:dict):
             continue
         features.append(primitive)
     return features
+
+
+def _process_chunk(task):
+    tileset, features, category_steps, category_tolerances, cache_bytes = task
+    if cache_bytes is not None:
+        # the worker has its own copy of the lazy cache, it only gets its share of the budget
+        tileset.models.max_bytes = cache_bytes
+    return _process_features(tileset, features, category_steps, category_tolerances, progress=False)
+
+
+def process_geojson(geo_data, tileset, category_colors:dict, category_steps:dict=None, category_tolerances:dict=None, workers=1):
+    '''
+    Recover the height of the features of a geojson
+    The rays of all features are collected first and cast together, see RayBatch
+    @param geo_data: geojson dict
+    @param tileset: TilesLoader
+    @param category_colors: dict of the classes to process
+    @param category_steps: distance in meters between the points the rings of each class are densified to,
+        classes missing from it use INTERPOLATION_STEP
+    @param category_tolerances: simplification tolerance in meters of the rings of each class, applied after
+        their height is recovered, see rdp_mask. Classes missing from it are not simplified
+    @param workers: number of processes. With more than 1, the features are split into chunks processed by
+        forked workers, which share the loaded tiles copy-on-write instead of loading them again: the tileset
+        is passed to them by reference, see TilesLoader.__reduce__. Each chunk casts its rays together.
+        With a lazy TileCache, only the tiles loaded before the fork are shared: every worker loads the other
+        tiles it needs into its own copy of the cache, so the budget of the cache is split between the workers
+    @return: list of Primitive, in the order of the features
+    '''
+    category_steps = category_steps or {}
+    category_tolerances = category_tolerances or {}
+    features = [feature for feature in geo_data['features'] if feature['properties']['class'] in category_colors.keys()]
+    if workers > 1 and 'fork' not in multiprocessing.get_all_start_methods():
+        logging.warning("processing features in a single process, the workers need the fork start method")
+        workers = 1
+    if workers <= 1 or len(features) < 2:
+        return _process_features(tileset, features, category_steps, category_tolerances)
+    # a few chunks per worker balance the load, larger chunks share more of their casting
+    chunk_size = -(-len(features) // (workers * 4))
+    cache_bytes = None
+    if isinstance(tileset.models, TileCache):
+        cache_bytes = tileset.models.max_bytes // workers
+        logging.info(f"lazy tile cache: each worker loads its own tiles, within {cache_bytes / 2**20:.0f} MB")
+    tasks = [(tileset, features[i:i + chunk_size], category_steps, category_tolerances, cache_bytes)
+             for i in range(0, len(features), chunk_size)]
+    primitives = []
+    with concurrent.futures.ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('fork')) as executor:
+        for chunk in tqdm.tqdm(executor.map(_process_chunk, tasks), total=len(tasks),
+                               desc=f"Processing features on geojson ({workers} workers)", unit="chunk"):
+            primitives.extend(chunk)
+    return primitives
@@ -16,6 +16,12 @@ from .decompress import (
 
 from .segment import GLBSegment, PrimitiveSegment
 
+from .b3dm import B3DM
+
+from .reader import load_glb, read_glb
+
+from .to_trimesh import glb_to_trimeshes
+
 
 __all__: list[str] = [
     "glb_to_pillow",
@@ -26,4 +32,8 @@ __all__: list[str] = [
     "PrimitiveDecompress",
     "MeshData",
     "BufferAccessor",
+    "B3DM",
+    "load_glb",
+    "read_glb",
+    "glb_to_trimeshes",
 ]
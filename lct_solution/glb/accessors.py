@@ -0,0 +1,284 @@
+"""decodes glTF accessors into numpy arrays"""
+from typing import Optional
+
+import numpy as np
+from gltflib import Accessor, BufferView, ComponentType, Sparse
+from gltflib.gltf import GLTF
+
+from .extract_textures import get_buffer_data
+
+COMPONENT_DTYPES: dict[int, np.dtype] = {
+    ComponentType.BYTE.value: np.dtype("<i1"),
+    ComponentType.UNSIGNED_BYTE.value: np.dtype("<u1"),
+    ComponentType.SHORT.value: np.dtype("<i2"),
+    ComponentType.UNSIGNED_SHORT.value: np.dtype("<u2"),
+    ComponentType.UNSIGNED_INT.value: np.dtype("<u4"),
+    ComponentType.FLOAT.value: np.dtype("<f4"),
+}
+"""little-endian numpy dtype of each glTF component type"""
+
+TYPE_SIZES: dict[str, int] = {
+    "SCALAR": 1,
+    "VEC2": 2,
+    "VEC3": 3,
+    "VEC4": 4,
+    "MAT2": 4,
+    "MAT3": 9,
+    "MAT4": 16,
+}
+"""number of components of each glTF accessor type"""
+
+
+def component_dtype(component_type: int) -> np.dtype:
+    """get the numpy dtype of a glTF component type
+
+    parameters
+    ----------
+    component_type: int
+        glTF component type (e.g. ComponentType.FLOAT.value)
+
+    returns
+    -------
+    np.dtype
+        little-endian numpy dtype
+
+    raises
+    ------
+    ValueError
+        if the component type is unknown
+
+    """
+    dtype: Optional[np.dtype] = COMPONENT_DTYPES.get(int(component_type))
+    if dtype is None:
+        raise ValueError(f"Unknown component type: {component_type}")
+    return dtype
+
+
+def has_data(accessor: Optional[Accessor]) -> bool:
+    """checks if an accessor stores data in the glb
+
+    accessors of Draco compressed primitives have neither a buffer view nor
+    sparse storage
+
+    parameters
+    ----------
+    accessor: gltflib.Accessor or None
+        accessor to check
+
+    returns
+    -------
+    bool
+        True if the accessor has a buffer view or sparse storage
+
+    """
+    return accessor is not None and (
+        accessor.bufferView is not None or accessor.sparse is not None
+    )
+
+
+def bufferview_data(gltf: GLTF, buffer_view_index: int) -> memoryview:
+    """get the bytes of a buffer view without copying them
+
+    parameters
+    ----------
+    gltf: gltflib.GLTF
+        gltf object which contains the buffer view
+    buffer_view_index: int
+        index of the buffer view in the glTF
+
+    returns
+    -------
+    memoryview
+        bytes of the buffer view
+
+    """
+    buffer_views: Optional[list[BufferView]] = gltf.model.bufferViews
+    if buffer_views is None or buffer_view_index >= len(buffer_views):
+        raise ValueError("Buffer view index out of range")
+    buffer_view: BufferView = buffer_views[buffer_view_index]
+    if gltf.model.buffers is None:
+        raise ValueError("No buffers found")
+    data = memoryview(
+        get_buffer_data(gltf, gltf.model.buffers[buffer_view.buffer])
+    )
+    start: int = buffer_view.byteOffset or 0
+    return data[start : start + buffer_view.byteLength]
+
+
+def read_accessor(
+    gltf: GLTF, accessor: Accessor, normalize: bool = True
+) -> np.ndarray:
+    """decodes an accessor into a numpy array
+
+    the component type and type of the accessor select the dtype and shape.
+    tightly packed and interleaved (byteStride) buffer views are returned as
+    views into the buffer without copying. sparse accessors are applied on a
+    copy, and accessors without a buffer view are zero initialized as
+    required by the glTF specification
+
+    parameters
+    ----------
+    gltf: gltflib.GLTF
+        gltf object which contains the accessor
+    accessor: gltflib.Accessor
+        accessor to decode
+    normalize: bool
+        whether to convert normalized integer accessors to float32 in the
+        range [0, 1] or [-1, 1]. defaults to True
+
+    returns
+    -------
+    np.ndarray
+        array of shape (count,) for SCALAR accessors and (count, components)
+        for every other type
+
+    raises
+    ------
+    ValueError
+        if the accessor type is unknown, matrices need column padding, or
+        the accessor exceeds its buffer view
+
+    examples
+    --------
+    >>> gltf = load_glb("model.glb")
+    >>> points = read_accessor(gltf, gltf.model.accessors[0])
+    >>> points.shape
+    (1024, 3)
+
+    """
+    dtype: np.dtype = component_dtype(accessor.componentType)
+    size: Optional[int] = TYPE_SIZES.get(accessor.type)
+    if size is None:
+        raise ValueError(f"Unknown accessor type: {accessor.type}")
+    if accessor.type in ("MAT2", "MAT3") and dtype.itemsize < 4:
+        raise ValueError(
+            f"{accessor.type} accessors of {dtype} need column padding, "
+            "which is not supported"
+        )
+    if accessor.bufferView is None or accessor.count == 0:
+        array: np.ndarray = np.zeros((accessor.count, size), dtype=dtype)
+    else:
+        buffer_views: list[BufferView] = gltf.model.bufferViews or []
+        array = _strided_view(
+            bufferview_data(gltf, accessor.bufferView),
+            accessor.byteOffset or 0,
+            buffer_views[accessor.bufferView].byteStride,
+            accessor.count,
+            size,
+            dtype,
+        )
+    if accessor.sparse is not None:
+        array = _apply_sparse(gltf, array, accessor.sparse)
+    if normalize and accessor.normalized:
+        array = normalize_array(array)
+    if accessor.type == "SCALAR":
+        return array[:, 0]
+    return array
+
+
+def normalize_array(array: np.ndarray) -> np.ndarray:
+    """converts a normalized integer array to float32
+
+    unsigned integers are mapped to [0, 1] and signed integers to [-1, 1] as
+    defined by the glTF specification. float arrays are returned unchanged
+
+    parameters
+    ----------
+    array: np.ndarray
+        normalized integer array
+
+    returns
+    -------
+    np.ndarray
+        float32 array
+
+    """
+    if array.dtype.kind == "f":
+        return array
+    scaled = array.astype(np.float32) / np.iinfo(array.dtype).max
+    if array.dtype.kind == "i":
+        np.maximum(scaled, -1.0, out=scaled)
+    return scaled
+
+
+def _strided_view(
+    data: memoryview,
+    offset: int,
+    stride: Optional[int],
+    count: int,
+    size: int,
+    dtype: np.dtype,
+) -> np.ndarray:
+    """creates a (count, size) view of elements in a buffer view
+
+    parameters
+    ----------
+    data: memoryview
+        bytes of the buffer view
+    offset: int
+        byte offset of the first element in the buffer view
+    stride: int or None
+        byte distance between the starts of two elements. None means the
+        elements are tightly packed
+    count: int
+        number of elements
+    size: int
+        number of components in each element
+    dtype: np.dtype
+        dtype of each component
+
+    returns
+    -------
+    np.ndarray
+        view into the buffer view, not a copy
+
+    """
+    element_size: int = dtype.itemsize * size
+    stride = stride or element_size
+    if offset + stride * (count - 1) + element_size > len(data):
+        raise ValueError("Accessor exceeds its buffer view")
+    return np.ndarray(
+        shape=(count, size),
+        dtype=dtype,
+        buffer=data,
+        offset=offset,
+        strides=(stride, dtype.itemsize),
+    )
+
+
+def _apply_sparse(
+    gltf: GLTF, array: np.ndarray, sparse: Sparse
+) -> np.ndarray:
+    """applies the sparse substitution of an accessor
+
+    parameters
+    ----------
+    gltf: gltflib.GLTF
+        gltf object which contains the accessor
+    array: np.ndarray
+        (count, size) array of the dense accessor values
+    sparse: gltflib.Sparse
+        sparse storage of the accessor
+
+    returns
+    -------
+    np.ndarray
+        copy of the array with the sparse values substituted
+
+    """
+    array = array.copy()
+    size: int = array.shape[1]
+    indices = np.frombuffer(
+        bufferview_data(gltf, sparse.indices.bufferView),
+        dtype=component_dtype(sparse.indices.componentType),
+        count=sparse.count,
+        offset=sparse.indices.byteOffset or 0,
+    )
+    values = np.frombuffer(
+        bufferview_data(gltf, sparse.values.bufferView),
+        dtype=array.dtype,
+        count=sparse.count * size,
+        offset=sparse.values.byteOffset or 0,
+    ).reshape(-1, size)
+    array[indices] = values
+    return array
@@ -0,0 +1,219 @@
+"""reads batched 3D model (b3dm) tiles and extracts the embedded glb"""
+import argparse
+import json
+import struct
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Any, Union
+
+B3DM_MAGIC = b"b3dm"
+"""magic bytes at the start of every b3dm file"""
+
+_HEADER_FORMAT = "<4s6I"
+"""magic, version, byteLength, featureTableJSONByteLength,
+featureTableBinaryByteLength, batchTableJSONByteLength,
+batchTableBinaryByteLength"""
+
+_LEGACY_THRESHOLD = 570425344
+"""values this large in the header lengths are the start of the glb or of
+the json of a legacy header (see the 3D Tiles b3dm specification)"""
+
+
+@dataclass
+class B3DM:
+    """dataclass storing the parsed content of a b3dm tile
+
+    parameters
+    ----------
+    version: int
+        version of the b3dm format
+    feature_table: dict[str, Any]
+        feature table json (e.g. BATCH_LENGTH, RTC_CENTER)
+    feature_table_binary: bytes
+        binary body of the feature table
+    batch_table: dict[str, Any]
+        batch table json
+    batch_table_binary: bytes
+        binary body of the batch table
+    glb: bytes
+        embedded binary glTF
+
+    examples
+    --------
+    >>> b3dm = B3DM.load(Path("tile.b3dm"))
+    >>> glb = GLBDecompress(b3dm.glb)
+
+    """
+
+    version: int
+    """version of the b3dm format"""
+
+    feature_table: dict[str, Any] = field(default_factory=dict)
+    """feature table json (e.g. BATCH_LENGTH, RTC_CENTER)"""
+
+    feature_table_binary: bytes = b""
+    """binary body of the feature table"""
+
+    batch_table: dict[str, Any] = field(default_factory=dict)
+    """batch table json"""
+
+    batch_table_binary: bytes = b""
+    """binary body of the batch table"""
+
+    glb: bytes = b""
+    """embedded binary glTF"""
+
+    @classmethod
+    def load(cls, path: Union[str, Path]) -> "B3DM":
+        """reads and parses a b3dm file
+
+        parameters
+        ----------
+        path: str or pathlib.Path
+            path to the b3dm file
+
+        returns
+        -------
+        B3DM
+            parsed b3dm tile
+
+        """
+        with open(path, "rb") as file:
+            return cls.from_bytes(file.read())
+
+    @classmethod
+    def from_bytes(cls, data: bytes) -> "B3DM":
+        """parses the content of a b3dm file
+
+        supports the current 28-byte header as well as both legacy header
+        layouts, which omit the feature table lengths
+
+        parameters
+        ----------
+        data: bytes
+            content of the b3dm file
+
+        returns
+        -------
+        B3DM
+            parsed b3dm tile
+
+        raises
+        ------
+        ValueError
+            if the data is not a b3dm file or is truncated
+
+        """
+        header_size: int = struct.calcsize(_HEADER_FORMAT)
+        if len(data) < header_size:
+            raise ValueError("Data is too short to be a b3dm file")
+        (
+            magic,
+            version,
+            byte_length,
+            feature_json_length,
+            feature_binary_length,
+            batch_json_length,
+            batch_binary_length,
+        ) = struct.unpack_from(_HEADER_FORMAT, data)
+        if magic != B3DM_MAGIC:
+            raise ValueError(f"Invalid b3dm magic: {magic!r}")
+        if byte_length > len(data):
+            raise ValueError(
+                f"b3dm is truncated: expected {byte_length} bytes, "
+                f"got {len(data)}"
+            )
+        if batch_json_length >= _LEGACY_THRESHOLD:
+            # legacy header: batchLength, batchTableByteLength
+            header_size -= 8
+            batch_json_length = feature_binary_length
+            batch_binary_length = 0
+            feature_json_length = feature_binary_length = 0
+        elif batch_binary_length >= _LEGACY_THRESHOLD:
+            # legacy header: batchTableJsonByteLength,
+            # batchTableBinaryByteLength, batchLength
+            header_size -= 4
+            batch_json_length = feature_json_length
+            batch_binary_length = feature_binary_length
+            feature_json_length = feature_binary_length = 0
+
+        offset: int = header_size
+        sections: list[bytes] = []
+        for length in (
+            feature_json_length,
+            feature_binary_length,
+            batch_json_length,
+            batch_binary_length,
+        ):
+            sections.append(data[offset : offset + length])
+            offset += length
+        glb: bytes = data[offset:byte_length]
+        if glb[:4] != b"glTF":
+            raise ValueError("b3dm does not contain an embedded glb")
+        return cls(
+            version=version,
+            feature_table=_parse_json(sections[0]),
+            feature_table_binary=sections[1],
+            batch_table=_parse_json(sections[2]),
+            batch_table_binary=sections[3],
+            glb=glb,
+        )
+
+    def export_glb(self, path: Path) -> None:
+        """writes the embedded glb to the specified path
+
+        parameters
+        ----------
+        path: pathlib.Path
+            path to write the glb to
+
+        """
+        Path.mkdir(path.parent, parents=True, exist_ok=True)
+        path.write_bytes(self.glb)
+
+
+def _parse_json(data: bytes) -> dict[str, Any]:
+    """parses a space padded json section of a b3dm
+
+    parameters
+    ----------
+    data: bytes
+        json section, may be empty
+
+    returns
+    -------
+    dict[str, Any]
+        parsed json, empty if the section is empty
+
+    """
+    text: str = data.decode("utf-8").rstrip(" \x00")
+    if not text:
+        return {}
+    return json.loads(text)
+
+
+def main(b3dm_path: Path, output_dir: Path) -> None:
+    """main"""
+    B3DM.load(b3dm_path).export_glb(
+        output_dir / b3dm_path.with_suffix(".glb").name
+    )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Extract glb from b3dm")
+    parser.add_argument(
+        "-f",
+        "--file",
+        type=str,
+        help="b3dm file to extract",
+        default="tile.b3dm",
+    )
+    parser.add_argument(
+        "-o",
+        "--output-dir",
+        type=str,
+        help="Output directory",
+        default="output",
+    )
+    args: argparse.Namespace = parser.parse_args()
+    main(Path(args.file), Path(args.output_dir))
@@ -1,11 +1,10 @@
 """segment glb with draco compression"""
 import argparse
 import io
-import struct
 from dataclasses import dataclass
 from pathlib import Path
 
-from typing import Optional, Union
+from typing import Any, Optional, Union
 
 import DracoPy
 import numpy as np
@@ -17,16 +16,25 @@ from gltflib import (
     BufferTarget,
     BufferView,
     ComponentType,
+    Node,
     Primitive,
     Material,
     Image,
     Texture,
+    GLTFModel,
 )
 from gltflib.gltf import GLTF
 from gltflib.gltf_resource import GLTFResource, GLBResource, FileResource
 from PIL import Image as PIL_Image
 from tqdm import tqdm
 
+from .accessors import bufferview_data, has_data, read_accessor
+from .reader import load_glb, read_glb
+
+
+DRACO_ATTRIBUTE_TYPES: dict[str, int] = {"POSITION": 0, "TEXCOORD_0": 3}
+"""Draco attribute type of each glTF attribute read from Draco data"""
+
 
 @dataclass
 class MeshData:
@@ -79,9 +87,383 @@ class MeshData:
         )
 
 
+def append_bytes(
+    data: bytearray,
+    chunk: Union[bytes, memoryview],
+    target: Optional[int] = None,
+) -> BufferView:
+    """appends bytes to the end of a buffer and returns the buffer view
+    describing them
+
+    the buffer is padded with zeros afterwards so that the next chunk starts
+    on a 4-byte boundary as required by the glTF specification
+
+    parameters
+    ----------
+    data: bytearray
+        buffer to append the bytes to, modified in place
+    chunk: bytes or memoryview
+        bytes to append
+    target: int or None
+        buffer view target (e.g. BufferTarget.ARRAY_BUFFER.value).
+        defaults to None
+
+    returns
+    -------
+    gltflib.BufferView
+        buffer view referencing the appended bytes in buffer 0
+
+    """
+    bufferview = BufferView(
+        buffer=0,
+        byteOffset=len(data),
+        byteLength=len(chunk),
+        target=target,
+    )
+    data.extend(chunk)
+    data.extend(b"\x00" * (-len(data) % 4))
+    return bufferview
+
+
+def append_array(
+    data: bytearray, array: np.ndarray, target: Optional[int] = None
+) -> BufferView:
+    """appends the raw bytes of an array to the end of a buffer and returns
+    the buffer view describing them
+
+    the array is written in a single copy in C order, so it should already
+    have the little-endian dtype expected by the accessor (e.g. "<f4")
+
+    parameters
+    ----------
+    data: bytearray
+        buffer to append the array to, modified in place
+    array: np.ndarray
+        array to append
+    target: int or None
+        buffer view target (e.g. BufferTarget.ARRAY_BUFFER.value).
+        defaults to None
+
+    returns
+    -------
+    gltflib.BufferView
+        buffer view referencing the appended array in buffer 0
+
+    """
+    return append_bytes(data, np.ascontiguousarray(array).tobytes(), target)
+
+
+def index_array(faces: np.ndarray) -> tuple[np.ndarray, ComponentType]:
+    """converts face indices to the smallest glTF index component type
+
+    the glTF specification reserves the largest value of each component type
+    for primitive restart, so an index type is only used if every index is
+    smaller than that value
+
+    parameters
+    ----------
+    faces: np.ndarray
+        array containing the vertex indices of each face
+
+    returns
+    -------
+    tuple[np.ndarray, gltflib.ComponentType]
+        flat little-endian index array and its component type
+
+    raises
+    ------
+    ValueError
+        if the indices do not fit into UNSIGNED_INT
+
+    """
+    indices: np.ndarray = np.asarray(faces).reshape(-1)
+    max_index: int = int(indices.max()) if indices.size > 0 else 0
+    for dtype, component_type in (
+        ("<u1", ComponentType.UNSIGNED_BYTE),
+        ("<u2", ComponentType.UNSIGNED_SHORT),
+        ("<u4", ComponentType.UNSIGNED_INT),
+    ):
+        if max_index < np.iinfo(dtype).max:
+            return indices.astype(dtype), component_type
+    raise ValueError("Face indices do not fit into UNSIGNED_INT")
+
+
+def quantize_tex_coord(tex_coord: np.ndarray) -> Optional[np.ndarray]:
+    """quantizes texture coordinates to normalized unsigned shorts
+
+    parameters
+    ----------
+    tex_coord: np.ndarray
+        (n, 2) array of texture coordinates
+
+    returns
+    -------
+    np.ndarray or None
+        (n, 2) "<u2" array, or None if a coordinate is outside of [0, 1]
+        and can not be represented as a normalized value
+
+    """
+    if tex_coord.size > 0 and (tex_coord.min() < 0 or tex_coord.max() > 1):
+        return None
+    return np.rint(tex_coord * np.iinfo(np.uint16).max).astype("<u2")
+
+
+@dataclass
+class Quantization:
+    """dataclass storing the dequantization transform of the positions of a
+    mesh exported with KHR_mesh_quantization
+
+    positions are stored as SHORT values q, which are mapped back to
+    `offset + q * scale` by the matrix of the node referencing the mesh
+
+    parameters
+    ----------
+    offset: np.ndarray
+        center of the bounding box of the mesh
+    scale: np.ndarray
+        size of one quantization step along each axis
+
+    attributes
+    ----------
+    offset: np.ndarray
+        center of the bounding box of the mesh
+    scale: np.ndarray
+        size of one quantization step along each axis
+
+    examples
+    --------
+    >>> quantization = Quantization.from_points([points])
+    >>> quantized = quantization.quantize(points)
+    >>> quantization.apply_to_nodes(nodes, mesh)
+
+    """
+
+    offset: np.ndarray
+    """center of the bounding box of the mesh"""
+
+    scale: np.ndarray
+    """size of one quantization step along each axis"""
+
+    @classmethod
+    def from_points(cls, points: list[np.ndarray]) -> "Quantization":
+        """creates the quantization covering the points of every primitive
+        of a mesh
+
+        parameters
+        ----------
+        points: list[np.ndarray]
+            (n, 3) arrays of points of each primitive
+
+        returns
+        -------
+        Quantization
+            quantization mapping the bounding box of the points to the
+            range of SHORT values
+
+        """
+        points = [np.asarray(p, dtype=np.float64) for p in points if p.size]
+        if not points:
+            return cls(offset=np.zeros(3), scale=np.ones(3))
+        lower: np.ndarray = np.min([p.min(axis=0) for p in points], axis=0)
+        upper: np.ndarray = np.max([p.max(axis=0) for p in points], axis=0)
+        scale: np.ndarray = (upper - lower) / (2 * np.iinfo(np.int16).max)
+        scale[scale == 0] = 1.0
+        return cls(offset=(upper + lower) / 2, scale=scale)
+
+    def quantize(self, points: np.ndarray) -> np.ndarray:
+        """quantizes points to SHORT values
+
+        parameters
+        ----------
+        points: np.ndarray
+            (n, 3) array of points
+
+        returns
+        -------
+        np.ndarray
+            (n, 3) "<i2" array of quantized points
+
+        """
+        limit: int = np.iinfo(np.int16).max
+        quantized: np.ndarray = np.rint((points - self.offset) / self.scale)
+        return np.clip(quantized, -limit, limit).astype("<i2")
+
+    @property
+    def matrix(self) -> np.ndarray:
+        """(4, 4) dequantization transform, `offset + q * scale`"""
+        matrix: np.ndarray = np.diag([*self.scale, 1.0])
+        matrix[:3, 3] = self.offset
+        return matrix
+
+    def apply_to_nodes(self, nodes: list[Node], mesh: int) -> None:
+        """moves a quantized mesh to new child nodes carrying only the
+        dequantization transform
+
+        folding the dequantization into the transform of the node
+        referencing the mesh would also apply it to the children of that
+        node. instead, each node referencing the mesh loses it and gets a
+        new child node which references the mesh with the dequantization
+        transform as its matrix
+
+        parameters
+        ----------
+        nodes: list[gltflib.Node]
+            nodes of the glTF, modified in place
+        mesh: int
+            index of the quantized mesh
+
+        """
+        # glTF matrices are stored in column-major order
+        matrix: list[float] = self.matrix.T.reshape(-1).tolist()
+        for node in list(nodes):
+            if node.mesh != mesh:
+                continue
+            node.mesh = None
+            node.children = [*(node.children or []), len(nodes)]
+            nodes.append(Node(mesh=mesh, matrix=matrix))
+
+
+def append_primitive(
+    data: bytearray,
+    accessors: list[Accessor],
+    bufferviews: list[BufferView],
+    mesh_data: MeshData,
+    quantization: Optional[Quantization] = None,
+) -> tuple[int, Attributes]:
+    """appends the indices, positions and texture coordinates of a primitive
+    to a buffer and creates their accessors and buffer views
+
+    indices use the smallest sufficient component type. with a quantization,
+    positions are written as SHORT values (KHR_mesh_quantization) and
+    texture coordinates in [0, 1] as normalized UNSIGNED_SHORT values,
+    otherwise both are written as FLOAT
+
+    parameters
+    ----------
+    data: bytearray
+        buffer to append the data to, modified in place
+    accessors: list[gltflib.Accessor]
+        accessors of the glb, modified in place
+    bufferviews: list[gltflib.BufferView]
+        buffer views of the glb, modified in place
+    mesh_data: MeshData
+        data of the primitive
+    quantization: Quantization or None
+        quantization of the mesh containing the primitive. defaults to None
+
+    returns
+    -------
+    tuple[int, gltflib.Attributes]
+        index of the indices accessor and the attributes of the primitive
+
+    """
+    points: np.ndarray = np.asarray(mesh_data.points).reshape(-1, 3)
+    tex_coord: np.ndarray = np.asarray(mesh_data.tex_coord).reshape(-1, 2)
+    indices, index_type = index_array(mesh_data.faces)
+
+    indices_accessor: int = len(accessors)
+    accessors.append(
+        Accessor(
+            bufferView=len(bufferviews),
+            byteOffset=0,
+            componentType=index_type.value,
+            count=indices.size,
+            type=AccessorType.SCALAR.value,
+        )
+    )
+    bufferviews.append(
+        append_array(data, indices, BufferTarget.ELEMENT_ARRAY_BUFFER.value)
+    )
+
+    if quantization is None:
+        positions: np.ndarray = points.astype("<f4")
+        position_type: ComponentType = ComponentType.FLOAT
+        stride: Optional[int] = None
+        vertices: np.ndarray = positions
+    else:
+        positions = quantization.quantize(points)
+        position_type = ComponentType.SHORT
+        # vertex attributes have to be aligned to 4 bytes
+        stride = 8
+        vertices = np.zeros((len(positions), 4), dtype="<i2")
+        vertices[:, :3] = positions
+    attributes = Attributes(POSITION=len(accessors))
+    accessors.append(
+        Accessor(
+            bufferView=len(bufferviews),
+            byteOffset=0,
+            componentType=position_type.value,
+            count=len(positions),
+            type=AccessorType.VEC3.value,
+            min=positions.min(axis=0).tolist() if len(positions) else None,
+            max=positions.max(axis=0).tolist() if len(positions) else None,
+        )
+    )
+    bufferview: BufferView = append_array(
+        data, vertices, BufferTarget.ARRAY_BUFFER.value
+    )
+    bufferview.byteStride = stride
+    bufferviews.append(bufferview)
+
+    uv: Optional[np.ndarray] = None
+    if quantization is not None:
+        uv = quantize_tex_coord(tex_coord)
+    attributes.TEXCOORD_0 = len(accessors)
+    accessors.append(
+        Accessor(
+            bufferView=len(bufferviews),
+            byteOffset=0,
+            componentType=(
+                ComponentType.FLOAT.value
+                if uv is None
+                else ComponentType.UNSIGNED_SHORT.value
+            ),
+            normalized=None if uv is None else True,
+            count=len(tex_coord),
+            type=AccessorType.VEC2.value,
+        )
+    )
+    bufferviews.append(
+        append_array(
+            data,
+            tex_coord.astype("<f4") if uv is None else uv,
+            BufferTarget.ARRAY_BUFFER.value,
+        )
+    )
+    return indices_accessor, attributes
+
+
+def add_extension(model: GLTFModel, extension: str) -> None:
+    """marks an extension as used and required by a glTF model
+
+    parameters
+    ----------
+    model: gltflib.GLTFModel
+        model to modify in place
+    extension: str
+        name of the extension (e.g. "KHR_mesh_quantization")
+
+    """
+    if model.extensionsUsed is None:
+        model.extensionsUsed = []
+    if model.extensionsRequired is None:
+        model.extensionsRequired = []
+    for extensions in (model.extensionsUsed, model.extensionsRequired):
+        if extension not in extensions:
+            extensions.append(extension)
+
+
 class BufferAccessor:
     """accesses buffer data contained in a glb
 
+    every accessor carries its own glTF document, so several glbs can be
+    open at once, e.g. in different threads
+
+    parameters
+    ----------
+    glb: gltflib.GLTF
+        the glTF object to access
+
     attributes
     ----------
     glb: gltflib.GLTF
@@ -89,18 +471,19 @@ class BufferAccessor:
 
     examples
     --------
-    >>> BufferAccessor.glb = GLTF.load("model.glb")
-    >>> BufferAccessor.get_accessor(0)
+    >>> accessor = BufferAccessor(load_glb("model.glb"))
+    >>> accessor.get_accessor(0)
     Accessor(...)
-    >>> BufferAccessor.retrieve_bufferview(0)
-    b"..."
-    >>> BufferAccessor.access_buffer(0)
-    b"..."
+    >>> accessor.retrieve_bufferview(0)
+    <memory at ...>
+    >>> accessor.access_buffer(0)
+    <memory at ...>
 
     """
 
-    glb: GLTF
-    """the glTF object to access"""
+    def __init__(self, glb: GLTF) -> None:
+        self.glb: GLTF = glb
+        """the glTF object to access"""
 
     def get_accessor(
         self, accessor_index: Optional[int]
@@ -150,7 +533,7 @@ class BufferAccessor:
             raise ValueError("Accessor index out of range")
         return accessors[accessor_index]
 
-    def get_buffer_data(self, buffer: Buffer) -> bytes:
+    def get_buffer_data(self, buffer: Buffer) -> Union[bytes, memoryview]:
         """retrieve the data from a buffer
 
         parameters
@@ -160,8 +543,9 @@ class BufferAccessor:
 
         returns
         -------
-        bytes
-            data of the buffer
+        bytes or memoryview
+            data of the buffer. a memoryview into the mapped file if the glb
+            was loaded with load_glb
 
         """
         resource: Union[GLBResource, GLTFResource] = (
@@ -173,10 +557,12 @@ class BufferAccessor:
             resource.load()
         return resource.data
 
-    def retrieve_bufferview(self, buffer_view_index: int) -> bytes:
+    def retrieve_bufferview(self, buffer_view_index: int) -> memoryview:
         """retrieve the data from a buffer referenced from a buffer view by
         index of the buffer view in the glTF
 
+        the returned memoryview references the buffer without copying it
+
         parameters
         ----------
         buffer_view_index: int
@@ -184,25 +570,14 @@ class BufferAccessor:
 
         returns
         -------
-        bytes
+        memoryview
             data of the buffer referenced from the buffer view
         """
-        buffer_views: Optional[list[BufferView]] = self.glb.model.bufferViews
-        if buffer_views is None:
-            raise ValueError("No buffer views found")
-        if buffer_view_index >= len(buffer_views):
-            raise ValueError("Buffer view index out of range")
-        buffer_view: BufferView = buffer_views[buffer_view_index]
-        buffers: Optional[list[Buffer]] = self.glb.model.buffers
-        if buffers is None:
-            raise ValueError("No buffers found")
-        buffer: Buffer = buffers[buffer_view.buffer]
-        data: bytes = self.get_buffer_data(buffer)
-        start: int = buffer_view.byteOffset or 0
-        end: int = start + buffer_view.byteLength
-        return data[start:end]
-
-    def access_buffer(self, accessor_index: Optional[int]) -> bytes:
+        return bufferview_data(self.glb, buffer_view_index)
+
+    def access_buffer(
+        self, accessor_index: Optional[int]
+    ) -> Union[bytes, memoryview]:
         """retrieve the data from a buffer referenced from an accessor by
         index of the accessor in the glTF
 
@@ -213,8 +588,9 @@ class BufferAccessor:
 
         returns
         -------
-        bytes
-            data of the buffer referenced from the accessor
+        bytes or memoryview
+            data of the buffer referenced from the accessor, empty bytes if
+            accessor_index is None
 
         """
         if accessor_index is None:
@@ -224,10 +600,41 @@ class BufferAccessor:
             raise ValueError("No buffer view found")
         return self.retrieve_bufferview(accessor.bufferView)
 
+    def read_accessor(
+        self, accessor: Accessor, normalize: bool = True
+    ) -> np.ndarray:
+        """decodes an accessor into a numpy array of its component type
+
+        see accessors.read_accessor for the supported layouts
+
+        parameters
+        ----------
+        accessor: gltflib.Accessor
+            accessor to decode
+        normalize: bool
+            whether to convert normalized integer accessors to float32.
+            defaults to True
+
+        returns
+        -------
+        np.ndarray
+            array of shape (count,) for SCALAR accessors and
+            (count, components) for every other type
+
+        """
+        return read_accessor(self.glb, accessor, normalize)
+
 
 class _Attributes(BufferAccessor):
     """Attributes of a primitive, containing accessors to the data
 
+    parameters
+    ----------
+    attributes: gltflib.Attributes
+        the raw attributes object containing the accessor indices
+    glb: gltflib.GLTF
+        the glTF object containing the primitive
+
     attributes
     ----------
     attributes: gltflib.Attributes
@@ -251,7 +658,9 @@ class _Attributes(BufferAccessor):
 
     """
 
-    def __init__(self, attributes: Attributes) -> None:
+    def __init__(self, attributes: Attributes, glb: GLTF) -> None:
+        super().__init__(glb)
+
         self.attributes: Attributes = attributes
         """the raw attributes object containing the accessor indices"""
 
@@ -356,9 +765,18 @@ class PrimitiveDecompress(BufferAccessor):
     ----------
     primitive: gltflib.Primitive
         primitive to load and segment
+    glb: gltflib.GLTF
+        the glTF object containing the primitive
+    draco_cache: dict[int, DracoPy.DracoMesh or None] or None
+        decoded Draco buffer views by buffer view index, shared by the
+        primitives of the same glb. defaults to a new empty cache
 
     attributes
     ----------
+    glb: gltflib.GLTF
+        the glTF object containing the primitive
+    draco_cache: dict[int, DracoPy.DracoMesh or None]
+        decoded Draco buffer views by buffer view index
     primitive: gltflib.Primitive
         primitive to load and segment
     attributes: _Attributes
@@ -373,15 +791,29 @@ class PrimitiveDecompress(BufferAccessor):
 
     examples
     --------
-    >>> primitive_decompressed = PrimitiveDecompress(primitive)
+    >>> primitive_decompressed = PrimitiveDecompress(primitive, glb)
 
     """
 
-    def __init__(self, primitive: Primitive) -> None:
+    def __init__(
+        self,
+        primitive: Primitive,
+        glb: GLTF,
+        draco_cache: Optional[dict[int, Optional[DracoPy.DracoMesh]]] = None,
+    ) -> None:
+        super().__init__(glb)
+
+        self.draco_cache: dict[int, Optional[DracoPy.DracoMesh]] = (
+            draco_cache if draco_cache is not None else {}
+        )
+        """decoded Draco buffer views by buffer view index"""
+
         self.primitive: Primitive = primitive
         """primitive to load and segment"""
 
-        self.attributes: _Attributes = _Attributes(primitive.attributes)
+        self.attributes: _Attributes = _Attributes(
+            primitive.attributes, glb
+        )
         """attributes of the primitive containing accessors to the data"""
 
         self.indices: Optional[Accessor] = self.get_accessor(primitive.indices)
@@ -432,7 +864,7 @@ class PrimitiveDecompress(BufferAccessor):
             raise ValueError("Material index out of range")
         return materials[material_index]
 
-    def get_texture_image_bytes(self) -> Optional[bytes]:
+    def get_texture_image_bytes(self) -> Optional[memoryview]:
         """retrieve the bytes data of the texture image from self.material
 
         self.material should be set before calling this method. uses
@@ -440,7 +872,7 @@ class PrimitiveDecompress(BufferAccessor):
 
         returns
         -------
-        bytes or None
+        memoryview or None
             bytes data of the texture image if found, None otherwise
 
         """
@@ -480,7 +912,7 @@ class PrimitiveDecompress(BufferAccessor):
             texture image if found, None otherwise
 
         """
-        data: Optional[bytes] = self.get_texture_image_bytes()
+        data: Optional[memoryview] = self.get_texture_image_bytes()
         if data is None:
             return None
         return PIL_Image.open(io.BytesIO(data))
@@ -525,24 +957,72 @@ class PrimitiveDecompress(BufferAccessor):
         faces: np.ndarray = np.array([])  # vec3 int
         tex: np.ndarray = np.array([])  # vec2 float
         attr: _Attributes = self.attributes
-        if attr.position and attr.position.bufferView:
-            index: int = attr.position.bufferView
-            buffer: bytes = self.access_buffer(index)
-            points = np.frombuffer(buffer, dtype=np.float32).reshape(-1, 3)
-        if self.indices and self.indices.bufferView:
-            index = self.indices.bufferView
-            buffer: bytes = self.access_buffer(index)
-            faces = np.frombuffer(buffer, dtype=np.int32).reshape(-1, 3)
-        if attr.texcoord_0 and attr.texcoord_0.bufferView:
-            index = attr.texcoord_0.bufferView
-            buffer: bytes = self.access_buffer(index)
-            tex = np.frombuffer(buffer, dtype=np.float32).reshape(-1, 2)
+        if has_data(attr.position):
+            points = self.read_accessor(attr.position).astype(
+                np.float32, copy=False
+            )
+        if has_data(self.indices):
+            faces = self.read_accessor(self.indices).reshape(-1, 3)
+        if has_data(attr.texcoord_0):
+            tex = self.read_accessor(attr.texcoord_0).astype(
+                np.float32, copy=False
+            )
         return MeshData(points, faces, tex)
 
+    @property
+    def draco_extension(self) -> Optional[dict[str, Any]]:
+        """the KHR_draco_mesh_compression extension of the primitive
+
+        returns
+        -------
+        dict[str, Any] or None
+            extension containing the `bufferView` and the Draco attribute
+            ids under `attributes` if found, None otherwise
+
+        """
+        extensions: Optional[dict[str, Any]] = self.primitive.extensions
+        if extensions is None:
+            return None
+        return extensions.get("KHR_draco_mesh_compression")
+
+    def decode_draco(
+        self, buffer_view_index: int
+    ) -> Optional[DracoPy.DracoMesh]:
+        """decodes a Draco compressed buffer view
+
+        decoded buffer views are memoized in draco_cache, which is shared by
+        every primitive of the glb, so each buffer view is decoded only once
+
+        parameters
+        ----------
+        buffer_view_index: int
+            index of the buffer view in the glTF
+
+        returns
+        -------
+        DracoPy.DracoMesh or None
+            decoded mesh if the buffer view is Draco compressed,
+            None otherwise
+
+        """
+        if buffer_view_index not in self.draco_cache:
+            data: memoryview = self.retrieve_bufferview(buffer_view_index)
+            # check if data is Draco compressed
+            self.draco_cache[buffer_view_index] = (
+                DracoPy.decode(bytes(data)) if data[:4] == b"DRAC" else None
+            )
+        return self.draco_cache[buffer_view_index]
+
     def try_finding_data(self):
         """tries to find data from Draco decompression and matches the data
         with the counts of each property from the accessors
 
+        the buffer view referenced by the KHR_draco_mesh_compression extension
+        of the primitive is decoded directly, and its attribute ids select
+        the position and texture coordinates, see draco_mesh_data. only if
+        the primitive has no such extension, every Draco compressed buffer
+        view is tried instead
+
         returns
         -------
         MeshData or None
@@ -558,43 +1038,124 @@ class PrimitiveDecompress(BufferAccessor):
             or self.attributes.texcoord_0 is None
         ):
             return None
+        extension: Optional[dict[str, Any]] = self.draco_extension
+        if extension is not None:
+            draco_attributes: dict[str, int] = extension.get("attributes", {})
+            if (
+                "POSITION" not in draco_attributes
+                or "TEXCOORD_0" not in draco_attributes
+            ):
+                return None
+            decoded = self.decode_draco(extension["bufferView"])
+            if decoded is None:
+                return None
+            data: MeshData = self.draco_mesh_data(decoded, draco_attributes)
+            if not self._matches_accessors(data):
+                return None
+            return data
         for index in range(len(self.glb.model.bufferViews)):
-            data: bytes = self.retrieve_bufferview(index)
-            # check if data is Draco compressed
-            if data[:4] != b"DRAC":
-                continue
-            decoded = DracoPy.decode(data)
+            decoded = self.decode_draco(index)
             if decoded is None:
                 continue
-            # compare decoded data with accessor counts
-            # faces to indices
-            if decoded.faces.size != self.indices.count:
-                continue
-            # points to positions
-            if decoded.points.size != self.attributes.position.count * 3:
-                continue
-            # texture coordinates to texcoord_0
-            if decoded.tex_coord.size != self.attributes.texcoord_0.count * 2:
-                continue
-            # if all checks passed, return decoded data
-            return decoded
+            if self._matches_accessors(decoded):
+                return decoded
         return None
 
+    @staticmethod
+    def draco_mesh_data(
+        decoded: DracoPy.DracoMesh, attribute_ids: dict[str, int]
+    ) -> MeshData:
+        """picks the attributes of a decoded Draco mesh by their ids
+
+        the POSITION and TEXCOORD_0 ids of the KHR_draco_mesh_compression
+        extension are looked up with get_attribute_by_unique_id. DracoPy
+        versions without it only expose their default position and texture
+        coordinates, which are used instead. so are they for ids which are
+        unknown or whose attribute has another Draco type, as written by
+        encoders that number the attributes in their own order
+
+        parameters
+        ----------
+        decoded: DracoPy.DracoMesh
+            decoded Draco data
+        attribute_ids: dict[str, int]
+            Draco attribute id by glTF attribute name
+
+        returns
+        -------
+        MeshData
+            vertices, faces and texture coordinates of the primitive
+
+        """
+        data: dict[str, np.ndarray] = {
+            "POSITION": decoded.points,
+            "TEXCOORD_0": decoded.tex_coord,
+        }
+        if hasattr(decoded, "get_attribute_by_unique_id"):
+            for name, attribute_type in DRACO_ATTRIBUTE_TYPES.items():
+                attribute: Optional[dict[str, Any]] = (
+                    decoded.get_attribute_by_unique_id(attribute_ids[name])
+                )
+                if (
+                    attribute is not None
+                    and attribute["attribute_type"] == attribute_type
+                ):
+                    data[name] = attribute["data"]
+        return MeshData(data["POSITION"], decoded.faces, data["TEXCOORD_0"])
+
+    def _matches_accessors(
+        self, decoded: Union[DracoPy.DracoMesh, MeshData]
+    ) -> bool:
+        """compares decoded Draco data with the accessor counts
+
+        parameters
+        ----------
+        decoded: DracoPy.DracoMesh or MeshData
+            decoded Draco data
+
+        returns
+        -------
+        bool
+            True if faces, points and texture coordinates match the counts of
+            the indices, position and texcoord_0 accessors, False otherwise
+
+        """
+        if self.indices is None:
+            return False
+        if self.attributes.position is None:
+            return False
+        if self.attributes.texcoord_0 is None:
+            return False
+        return all(
+            [
+                # faces to indices
+                decoded.faces.size == self.indices.count,
+                # points to positions
+                decoded.points.size == self.attributes.position.count * 3,
+                # texture coordinates to texcoord_0
+                decoded.tex_coord.size
+                == self.attributes.texcoord_0.count * 2,
+            ]
+        )
+
 
 class GLBDecompress(BufferAccessor):
     """loads a glb and loads primitives from the glb to decompress
 
-    class attribute `glb` is used to store the glTF object to access
+    the loaded glTF object is shared with each loaded PrimitiveDecompress
 
     parameters
     ----------
-    path: pathlib.Path
-        path to glb file
+    path: pathlib.Path or bytes
+        path to glb file, or the content of a glb already held in memory
+        (e.g. the glb embedded in a b3dm tile)
 
     attributes
     ----------
     glb: gltflib.GLTF
         the glTF object to access and decompress
+    draco_cache: dict[int, DracoPy.DracoMesh or None]
+        decoded Draco buffer views by buffer view index
     meshes: list[list[PrimitiveDecompress]]
         list of meshes containing lists of primitives
 
@@ -603,11 +1164,19 @@ class GLBDecompress(BufferAccessor):
     >>> glb = GLBDecompress(Path("model.glb"))
     >>> glb.load_meshes()
     >>> glb.export(Path("output/model.glb"))
+    >>> glb = GLBDecompress(B3DM.load(Path("tile.b3dm")).glb)
 
     """
 
-    def __init__(self, path: Path) -> None:
-        BufferAccessor.glb = GLTF.load(str(path))
+    def __init__(self, path: Union[Path, bytes]) -> None:
+        if isinstance(path, (bytes, bytearray, memoryview)):
+            super().__init__(read_glb(path))
+        else:
+            super().__init__(load_glb(path))
+        self.draco_cache: dict[int, Optional[DracoPy.DracoMesh]] = {}
+        """decoded Draco buffer views by buffer view index, shared by every
+        loaded primitive"""
+
         self.meshes: list[list[PrimitiveDecompress]] = []
         """list of meshes containing lists of primitives"""
 
@@ -635,19 +1204,31 @@ class GLBDecompress(BufferAccessor):
                 unit="primitive",
                 leave=False,
             ):
-                primitives.append(PrimitiveDecompress(primitive))
+                primitives.append(
+                    PrimitiveDecompress(primitive, self.glb, self.draco_cache)
+                )
             self.meshes.append(primitives)
 
-    def export(self, path: Path) -> None:
+    def export(self, path: Path, quantize: bool = False) -> None:
         """exports the decompressed glb to the specified path
 
         the path should specify the entire path including the file name and
         extension (e.g. "output/model.glb")
 
+        indices are written with the smallest component type that fits each
+        primitive. with `quantize`, positions are written as SHORT values
+        using KHR_mesh_quantization, and each mesh is moved to new child
+        nodes carrying its dequantization transform, see
+        Quantization.apply_to_nodes. texture coordinates in
+        [0, 1] are then written as normalized UNSIGNED_SHORT values
+
         parameters
         ----------
         path: pathlib.Path
             path to export the glb to
+        quantize: bool
+            whether to quantize positions and texture coordinates.
+            defaults to False
 
         """
         glb: GLTF = self.glb.clone()
@@ -657,98 +1238,20 @@ class GLBDecompress(BufferAccessor):
         accessors: list[Accessor] = []
         bufferviews: list[BufferView] = []
         for i, mesh in enumerate(self.meshes):
+            quantization: Optional[Quantization] = None
+            if quantize:
+                quantization = Quantization.from_points(
+                    [primitive.data.points for primitive in mesh]
+                )
+                quantization.apply_to_nodes(glb.model.nodes or [], i)
             for j, primitive in enumerate(mesh):
                 _primitive: Primitive = glb.model.meshes[i].primitives[j]
                 _primitive.extensions = None
-                vertex_bytearray = bytearray()
-                vertex_max: list[float] = [float("-inf")] * 3
-                vertex_min: list[float] = [float("inf")] * 3
-                face_bytearray = bytearray()
-                tex_coord_bytearray = bytearray()
-                for vertex in primitive.data.points:
-                    for k, value in enumerate(vertex):
-                        vertex_bytearray.extend(struct.pack("f", value))
-                        vertex_max[k] = max(vertex_max[k], value)
-                        vertex_min[k] = min(vertex_min[k], value)
-                for face in primitive.data.faces:
-                    for value in face:
-                        face_bytearray.extend(struct.pack("H", value))
-                # pad faces to multiple of 4 bytes
-                face_bytearray.extend(b"\x00" * (len(face_bytearray) % 4))
-                for tex_coord in primitive.data.tex_coord:
-                    for value in tex_coord:
-                        tex_coord_bytearray.extend(struct.pack("f", value))
-                vertex_bytelen: int = len(vertex_bytearray)
-                face_bytelen: int = len(face_bytearray)
-                tex_coord_bytelen: int = len(tex_coord_bytearray)
-
-                _primitive.indices = len(accessors)
-                accessors.append(
-                    # face accessor
-                    Accessor(
-                        bufferView=len(bufferviews),
-                        byteOffset=0,
-                        componentType=ComponentType.UNSIGNED_SHORT,
-                        count=len(primitive.data.faces) * 3,
-                        type=AccessorType.SCALAR.value,
-                    )
+                indices, attributes = append_primitive(
+                    data, accessors, bufferviews, primitive.data, quantization
                 )
-                bufferviews.append(
-                    # face buffer view
-                    BufferView(
-                        buffer=0,
-                        byteOffset=len(data),
-                        byteLength=face_bytelen,
-                        target=BufferTarget.ELEMENT_ARRAY_BUFFER.value,
-                    )
-                )
-                data.extend(face_bytearray)
-
-                _primitive.attributes.POSITION = len(accessors)
-                accessors.append(
-                    # vertex accessor
-                    Accessor(
-                        bufferView=len(bufferviews),
-                        byteOffset=0,
-                        componentType=ComponentType.FLOAT,
-                        count=len(primitive.data.points),
-                        type=AccessorType.VEC3.value,
-                        min=vertex_min,
-                        max=vertex_max,
-                    )
-                )
-                bufferviews.append(
-                    # vertex buffer view
-                    BufferView(
-                        buffer=0,
-                        byteOffset=len(data),
-                        byteLength=vertex_bytelen,
-                        target=BufferTarget.ARRAY_BUFFER.value,
-                    )
-                )
-                data.extend(vertex_bytearray)
-
-                _primitive.attributes.TEXCOORD_0 = len(accessors)
-                accessors.append(
-                    # tex coord accessor
-                    Accessor(
-                        bufferView=len(bufferviews),
-                        byteOffset=0,
-                        componentType=ComponentType.FLOAT,
-                        count=len(primitive.data.tex_coord),
-                        type=AccessorType.VEC2.value,
-                    )
-                )
-                bufferviews.append(
-                    # tex coord buffer view
-                    BufferView(
-                        buffer=0,
-                        byteOffset=len(data),
-                        byteLength=tex_coord_bytelen,
-                        target=BufferTarget.ARRAY_BUFFER.value,
-                    )
-                )
-                data.extend(tex_coord_bytearray)
+                _primitive.indices = indices
+                _primitive.attributes = attributes
 
         if glb.model.images:
             for image in glb.model.images:
@@ -757,16 +1260,10 @@ class GLBDecompress(BufferAccessor):
                 if image.bufferView is None:
                     continue
                 old_index: int = image.bufferView
-                bufferview: BufferView = self.glb.model.bufferViews[old_index]
                 image.bufferView = len(bufferviews)
                 bufferviews.append(
-                    BufferView(
-                        buffer=0,
-                        byteOffset=len(data),
-                        byteLength=bufferview.byteLength,
-                    )
+                    append_bytes(data, self.retrieve_bufferview(old_index))
                 )
-                data.extend(self.retrieve_bufferview(old_index))
 
         buffers: list[Buffer] = [
             Buffer(
@@ -791,16 +1288,18 @@ class GLBDecompress(BufferAccessor):
             and "KHR_draco_mesh_compression" in glb.model.extensionsRequired
         ):
             glb.model.extensionsRequired.remove("KHR_draco_mesh_compression")
+        if quantize:
+            add_extension(glb.model, "KHR_mesh_quantization")
 
         Path.mkdir(path.parent, parents=True, exist_ok=True)
         glb.export(str(path))
 
 
-def main(glb_path: Path, output_dir: Path) -> None:
+def main(glb_path: Path, output_dir: Path, quantize: bool = False) -> None:
     """main"""
     glb = GLBDecompress(glb_path)
     glb.load_meshes()
-    glb.export(output_dir / glb_path.name)
+    glb.export(output_dir / glb_path.name, quantize)
 
 
 if __name__ == "__main__":
@@ -819,5 +1318,12 @@ if __name__ == "__main__":
         help="Output directory",
         default="output",
     )
+    parser.add_argument(
+        "-q",
+        "--quantize",
+        action="store_true",
+        help="Quantize positions and texture coordinates "
+        "(KHR_mesh_quantization)",
+    )
     args: argparse.Namespace = parser.parse_args()
-    main(Path(args.file), Path(args.output_dir))
+    main(Path(args.file), Path(args.output_dir), args.quantize)
@@ -8,6 +8,8 @@ from gltflib.gltf import GLTF
 from gltflib.gltf_resource import GLBResource, GLTFResource, FileResource
 from PIL import Image
 
+from .reader import load_glb
+
 
 def gltf_image_to_pillow(
     gltf: GLTF,
@@ -35,16 +37,21 @@ def gltf_image_to_pillow(
         pillow image
 
     """
-    data: bytes = get_gltf_image_data(gltf, image)
+    data = get_gltf_image_data(gltf, image)
     img: Image.Image = Image.open(io.BytesIO(data))
     if save:
         img.save(f"{savepath}.{get_image_format(image)}")
     return img
 
 
-def get_gltf_image_data(gltf: GLTF, image: GLTF_Image) -> bytes:
+def get_gltf_image_data(
+    gltf: GLTF, image: GLTF_Image
+) -> Union[bytes, memoryview]:
     """get the bytes data from a gltf image
 
+    images stored in a buffer view are returned as a memoryview into the
+    buffer, without copying it
+
     parameters
     ----------
     gltf: gltflib.GLTF
@@ -54,7 +61,7 @@ def get_gltf_image_data(gltf: GLTF, image: GLTF_Image) -> bytes:
 
     returns
     -------
-    bytes
+    bytes or memoryview
         image data
 
     """
@@ -67,7 +74,7 @@ def get_gltf_image_data(gltf: GLTF, image: GLTF_Image) -> bytes:
             raise ValueError("Model has no buffers")
         buffer_view: BufferView = gltf.model.bufferViews[image.bufferView]
         buffer: Buffer = gltf.model.buffers[buffer_view.buffer]
-        data: bytes = get_buffer_data(gltf, buffer)
+        data = memoryview(get_buffer_data(gltf, buffer))
         start: int = buffer_view.byteOffset or 0
         end: int = start + buffer_view.byteLength
         return data[start:end]
@@ -77,7 +84,7 @@ def get_gltf_image_data(gltf: GLTF, image: GLTF_Image) -> bytes:
     return resource.data
 
 
-def get_buffer_data(gltf: GLTF, buffer: Buffer) -> bytes:
+def get_buffer_data(gltf: GLTF, buffer: Buffer) -> Union[bytes, memoryview]:
     """get the bytes data from a buffer
 
     parameters
@@ -89,7 +96,7 @@ def get_buffer_data(gltf: GLTF, buffer: Buffer) -> bytes:
 
     returns
     -------
-    bytes
+    bytes or memoryview
         buffer data
 
     """
@@ -158,7 +165,7 @@ def glb_to_pillow(
 
 def main(file: str, save: bool = False, savepath: str = ".") -> None:
     """extract textures from a gltf file"""
-    gltf: GLTF = GLTF.load(file)
+    gltf: GLTF = load_glb(file) if file.endswith(".glb") else GLTF.load(file)
     glb_to_pillow(gltf, save, savepath)
 
 
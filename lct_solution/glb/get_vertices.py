@@ -1,9 +1,13 @@
 """sort vertices by class and export submeshes. for uncompressed glTF files"""
 from collections import defaultdict
 from pathlib import Path
-from trimesh import Trimesh, load, Scene
+from gltflib.gltf import GLTF
+from trimesh import Trimesh
 from tqdm import tqdm
 
+from .reader import load_glb
+from .to_trimesh import glb_to_trimeshes
+
 
 class MeshSegment:
     """loads a trimesh and sorts vertices by class. exports submeshes by class
@@ -69,14 +73,17 @@ class MeshSegment:
 
     @staticmethod
     def load_by_path(path: Path) -> list["MeshSegment"]:
-        """loads a glb file by path and returns a list of MeshSegments
+        """loads a glb or glTF file by path and returns a list of MeshSegments
 
-        only supports loading if glb is a Scene or Trimesh
+        the data is read with the accessor decoding of glb_to_trimeshes, so
+        Draco compressed, interleaved, sparse and quantized primitives are
+        supported. one MeshSegment is returned per primitive, its vertices in
+        the frame of its mesh
 
         parameters
         ----------
         path: pathlib.Path
-            path to glb file
+            path to glb or glTF file
 
         returns
         -------
@@ -84,16 +91,14 @@ class MeshSegment:
             list of MeshSegments
 
         """
-        glb = load(path)
-        if isinstance(glb, Scene):
-            return [
-                MeshSegment(mesh, i)
-                for i, mesh in enumerate(glb.geometry.values())
-            ]
-        if isinstance(glb, Trimesh):
-            return [MeshSegment(glb)]
-
-        raise ValueError("Unsupported GLB type")
+        path = Path(path)
+        gltf: GLTF = (
+            load_glb(path) if path.suffix == ".glb" else GLTF.load(str(path))
+        )
+        return [
+            MeshSegment(mesh, i)
+            for i, mesh in enumerate(glb_to_trimeshes(gltf, textures=False))
+        ]
 
     def load_submeshes(self) -> None:
         """loads submeshes and saves them to the _submeshes attribute
@@ -0,0 +1,103 @@
+"""reads binary glTF (glb) files without copying their binary chunks"""
+import mmap
+import struct
+from pathlib import Path
+from typing import Optional, Union
+
+from gltflib import GLTFModel
+from gltflib.gltf import GLTF
+from gltflib.gltf_resource import GLBResource, GLTFResource
+
+GLB_MAGIC = b"glTF"
+"""magic bytes at the start of every glb file"""
+
+GLB_JSON_CHUNK_TYPE = 0x4E4F534A
+"""chunk type of the JSON chunk ("JSON")"""
+
+_HEADER_FORMAT = "<4sII"
+"""magic, version, length"""
+
+_CHUNK_HEADER_FORMAT = "<II"
+"""chunkLength, chunkType"""
+
+
+def load_glb(path: Union[str, Path]) -> GLTF:
+    """loads a glb file by memory-mapping it
+
+    the JSON chunk is parsed once, while the binary chunks are kept as
+    memoryviews into the mapped file. pages of the file are only read when
+    a buffer view is actually accessed, and slicing the buffer data does not
+    copy it
+
+    parameters
+    ----------
+    path: str or pathlib.Path
+        path to the glb file
+
+    returns
+    -------
+    gltflib.GLTF
+        glTF object whose glb resources reference the mapped file
+
+    examples
+    --------
+    >>> glb = load_glb(Path("model.glb"))
+    >>> data = glb.get_glb_resource().data  # memoryview, no copy
+
+    """
+    with open(path, "rb") as file:
+        # the mapping stays valid after the file is closed
+        mapped = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+    return read_glb(memoryview(mapped))
+
+
+def read_glb(data: Union[bytes, bytearray, memoryview]) -> GLTF:
+    """parses a glb held in memory without copying its binary chunks
+
+    parameters
+    ----------
+    data: bytes, bytearray or memoryview
+        content of the glb file
+
+    returns
+    -------
+    gltflib.GLTF
+        glTF object whose glb resources are memoryviews into `data`
+
+    raises
+    ------
+    ValueError
+        if the data is not a glb version 2 file or has no JSON chunk
+
+    """
+    view = memoryview(data)
+    header_size: int = struct.calcsize(_HEADER_FORMAT)
+    if len(view) < header_size:
+        raise ValueError("Data is too short to be a glb file")
+    magic, version, length = struct.unpack_from(_HEADER_FORMAT, view)
+    if magic != GLB_MAGIC:
+        raise ValueError(f"Invalid glb magic: {magic!r}")
+    if version != 2:
+        raise ValueError(f"Unsupported glb version: {version}")
+    if length > len(view):
+        raise ValueError(
+            f"glb is truncated: expected {length} bytes, got {len(view)}"
+        )
+    chunk_header_size: int = struct.calcsize(_CHUNK_HEADER_FORMAT)
+    model: Optional[GLTFModel] = None
+    resources: list[GLTFResource] = []
+    offset: int = header_size
+    while offset + chunk_header_size <= length:
+        chunk_length, chunk_type = struct.unpack_from(
+            _CHUNK_HEADER_FORMAT, view, offset
+        )
+        offset += chunk_header_size
+        body: memoryview = view[offset : offset + chunk_length]
+        if chunk_type == GLB_JSON_CHUNK_TYPE:
+            model = GLTFModel.from_json(str(body, "utf-8"))
+        else:
+            resources.append(GLBResource(body, chunk_type))
+        offset += chunk_length
+    if model is None:
+        raise ValueError("glb has no JSON chunk")
+    return GLTF(model=model, resources=resources)
@@ -1,10 +1,12 @@
 """segment glb with draco compression"""
+import copy
 import struct
 from collections import defaultdict
 from pathlib import Path
 
 from typing import Optional
 
+import DracoPy
 import numpy as np
 from gltflib import (
     Accessor,
@@ -14,6 +16,7 @@ from gltflib import (
     BufferTarget,
     BufferView,
     ComponentType,
+    Node,
     Primitive,
     Image,
 )
@@ -22,17 +25,33 @@ from gltflib.gltf import GLTF
 from gltflib.gltf_resource import GLBResource
 from tqdm import tqdm
 
-from .decompress import PrimitiveDecompress, GLBDecompress, MeshData
+from .decompress import (
+    PrimitiveDecompress,
+    GLBDecompress,
+    MeshData,
+    Quantization,
+    add_extension,
+    append_bytes,
+    append_primitive,
+)
 
 
 class SubPrimitive:
     """a subset of a primitive
 
-    class attributes `points` and `tex_coord` are used to store the data of the
-    parent primitive.
+    parameters
+    ----------
+    points: np.ndarray
+        points of the parent primitive
+    tex_coord: np.ndarray
+        texture coordinates of the parent primitive
 
     attributes
     ----------
+    points: np.ndarray
+        points of the parent primitive
+    tex_coord: np.ndarray
+        texture coordinates of the parent primitive
     vertices: list[np.ndarray]
         list of coordinates of each vertex
     faces: list[np.ndarray]
@@ -44,13 +63,13 @@ class SubPrimitive:
 
     examples
     --------
-    >>> SubPrimitive.points = np.array([
+    >>> points = np.array([
         [0, 0, 0], [0, 0, 1], [0, 1, 0], [0, 1, 1], [1, 0, 0]
         ])
-    >>> SubPrimitive.tex_coord = np.array([
+    >>> tex_coord = np.array([
         [0, 0], [1, 0], [0, 1], [1, 1], [0.5, 0.5]
         ])
-    >>> subprimitive = SubPrimitive()
+    >>> subprimitive = SubPrimitive(points, tex_coord)
     >>> subprimitive.add_face(np.array([0, 2, 4]))
     >>> subprimitive.to_dict()
     {
@@ -67,13 +86,13 @@ class SubPrimitive:
 
     """
 
-    points: np.ndarray
-    """points of the parent primitive"""
+    def __init__(self, points: np.ndarray, tex_coord: np.ndarray) -> None:
+        self.points: np.ndarray = points
+        """points of the parent primitive"""
 
-    tex_coord: np.ndarray
-    """texture coordinates of the parent primitive"""
+        self.tex_coord: np.ndarray = tex_coord
+        """texture coordinates of the parent primitive"""
 
-    def __init__(self) -> None:
         self.vertices: list[np.ndarray] = []
         """list of coordinates of each vertex"""
 
@@ -148,9 +167,18 @@ class PrimitiveSegment(PrimitiveDecompress):
     ----------
     primitive: gltflib.Primitive
         primitive to load and segment
+    glb: gltflib.GLTF
+        the glTF object containing the primitive
+    draco_cache: dict[int, DracoPy.DracoMesh or None] or None
+        decoded Draco buffer views by buffer view index, shared by the
+        primitives of the same glb. defaults to a new empty cache
 
     attributes
     ----------
+    glb: gltflib.GLTF
+        the glTF object containing the primitive
+    draco_cache: dict[int, DracoPy.DracoMesh or None]
+        decoded Draco buffer views by buffer view index
     primitive: gltflib.Primitive
         primitive to load and segment
     attributes: _Attributes
@@ -169,14 +197,19 @@ class PrimitiveSegment(PrimitiveDecompress):
 
     examples
     --------
-    >>> primitive_seg = PrimitiveSegment(primitive)
+    >>> primitive_seg = PrimitiveSegment(primitive, glb)
     >>> primitive_seg.vertices_to_class = list_of_classes
     >>> primitive_seg.export_subprimitives(Path("output"))
 
     """
 
-    def __init__(self, primitive: Primitive) -> None:
-        super().__init__(primitive)
+    def __init__(
+        self,
+        primitive: Primitive,
+        glb: GLTF,
+        draco_cache: Optional[dict[int, Optional[DracoPy.DracoMesh]]] = None,
+    ) -> None:
+        super().__init__(primitive, glb, draco_cache)
 
         self.vertices_to_class: list[int] = [-1] * self.data.points.shape[0]
         """list of classes for each vertex"""
@@ -233,9 +266,11 @@ class PrimitiveSegment(PrimitiveDecompress):
             or self.data.tex_coord.size == 0
         ):
             raise ValueError("No data found")
-        SubPrimitive.points = self.data.points
-        SubPrimitive.tex_coord = self.data.tex_coord
-        submeshes = defaultdict(SubPrimitive)
+        points: np.ndarray = self.data.points
+        tex_coord: np.ndarray = self.data.tex_coord
+        submeshes: defaultdict[int, SubPrimitive] = defaultdict(
+            lambda: SubPrimitive(points, tex_coord)
+        )
         for face in tqdm(
             self.data.faces,
             desc="Loading faces",
@@ -247,7 +282,7 @@ class PrimitiveSegment(PrimitiveDecompress):
                 submeshes[class_id].add_face(face)
         return submeshes
 
-    def export_subprimitives(self, path: Path) -> None:
+    def export_subprimitives(self, path: Path, quantize: bool = False) -> None:
         """exports subprimitives by class to the given path
 
         exported subprimitives are saved as glb files with the following naming
@@ -257,6 +292,9 @@ class PrimitiveSegment(PrimitiveDecompress):
         ----------
         path: pathlib.Path
             path to export subprimitives to
+        quantize: bool
+            whether to quantize positions and texture coordinates.
+            defaults to False
 
         """
         Path.mkdir(path, parents=True, exist_ok=True)
@@ -264,157 +302,92 @@ class PrimitiveSegment(PrimitiveDecompress):
             self.subprimitives.items(), desc="Exporting", unit="subprimitive"
         ):
             self.export_subprimitive(
-                subprimitive, path / f"class_{class_id}.glb"
+                subprimitive, path / f"class_{class_id}.glb", quantize
             )
 
     def export_subprimitive(
-        self, subprimitive: SubPrimitive, path: Path
+        self, subprimitive: SubPrimitive, path: Path, quantize: bool = False
     ) -> None:
         """exports subprimitive to the given path
 
         path should specify the entire path including the file name and
         extension (e.g. "output/subprimitive.glb")
 
+        indices are written with the smallest component type that fits the
+        subprimitive. with `quantize`, positions and texture coordinates are
+        quantized as in GLBDecompress.export
+
         parameters
         ----------
         subprimitive: SubPrimitive
             subprimitive to export
         path: pathlib.Path
             path to export subprimitive to
+        quantize: bool
+            whether to quantize positions and texture coordinates.
+            defaults to False
 
         """
-        vertex_bytearray = bytearray()
-        vertex_max: list[float] = [float("-inf")] * 3
-        vertex_min: list[float] = [float("inf")] * 3
-        face_bytearray = bytearray()
-        tex_coord_bytearray = bytearray()
-        # image_bytearray: bytes = self.get_texture_image_bytes() or b""
-        for vertex in subprimitive.vertices:
-            for i, value in enumerate(vertex):
-                vertex_bytearray.extend(struct.pack("f", value))
-                vertex_max[i] = max(vertex_max[i], value)
-                vertex_min[i] = min(vertex_min[i], value)
-        for face in subprimitive.faces:
-            for value in face:
-                face_bytearray.extend(struct.pack("H", value))
-        for tex_coord in subprimitive.uv_coords:
-            for value in tex_coord:
-                tex_coord_bytearray.extend(struct.pack("f", value))
-        vertex_bytelen: int = len(vertex_bytearray)
-        face_bytelen: int = len(face_bytearray)
-        tex_coord_bytelen: int = len(tex_coord_bytearray)
-        # image_bytelen: int = len(image_bytearray) if image_bytearray else 0
+        mesh_data: MeshData = subprimitive.to_mesh_data()
+        data = bytearray()
+        accessors: list[Accessor] = []
+        bufferviews: list[BufferView] = []
+        nodes: Optional[list[Node]] = self.glb.model.nodes
+        quantization: Optional[Quantization] = None
+        if quantize:
+            quantization = Quantization.from_points([mesh_data.points])
+            # the nodes are shared with the source glb
+            nodes = copy.deepcopy(nodes)
+            quantization.apply_to_nodes(nodes or [], 0)
+        indices, attributes = append_primitive(
+            data, accessors, bufferviews, mesh_data, quantization
+        )
         model = GLTFModel(
-            accessors=[
-                # position
-                Accessor(
-                    bufferView=0,
-                    byteOffset=0,
-                    componentType=ComponentType.FLOAT.value,
-                    count=len(subprimitive.vertices),
-                    type=AccessorType.VEC3.value,
-                    max=vertex_max,
-                    min=vertex_min,
-                ),
-                # faces
-                Accessor(
-                    bufferView=1,
-                    byteOffset=0,
-                    componentType=ComponentType.UNSIGNED_SHORT.value,
-                    count=len(subprimitive.faces) * 3,
-                    type=AccessorType.SCALAR.value,
-                ),
-                # tex coords
-                Accessor(
-                    bufferView=2,
-                    byteOffset=0,
-                    componentType=ComponentType.FLOAT.value,
-                    count=len(subprimitive.uv_coords),
-                    type=AccessorType.VEC2.value,
-                ),
-            ],
+            accessors=accessors,
             asset=Asset(version="2.0"),
-            extensionsUsed=self.glb.model.extensionsUsed,
+            extensionsUsed=(
+                list(self.glb.model.extensionsUsed)
+                if self.glb.model.extensionsUsed is not None
+                else None
+            ),
             scenes=self.glb.model.scenes,
-            nodes=self.glb.model.nodes,
+            nodes=nodes,
             meshes=[
                 Mesh(
                     primitives=[
                         Primitive(
-                            attributes=Attributes(POSITION=0, TEXCOORD_0=2),
-                            indices=1,
+                            attributes=attributes,
+                            indices=indices,
                             material=0,
                         )
                     ]
                 )
             ],
-            bufferViews=[
-                BufferView(
-                    buffer=0,
-                    byteOffset=0,
-                    byteLength=vertex_bytelen,
-                    target=BufferTarget.ARRAY_BUFFER.value,
-                ),
-                BufferView(
-                    buffer=0,
-                    byteOffset=vertex_bytelen,
-                    byteLength=face_bytelen,
-                    target=BufferTarget.ELEMENT_ARRAY_BUFFER.value,
-                ),
-                BufferView(
-                    buffer=0,
-                    byteOffset=vertex_bytelen + face_bytelen,
-                    byteLength=tex_coord_bytelen,
-                    target=BufferTarget.ARRAY_BUFFER.value,
-                ),
-            ],
+            bufferViews=bufferviews,
             materials=[self.material] if self.material else None,
             samplers=self.glb.model.samplers,
             textures=self.glb.model.textures,
         )
-        image_bytearray: bytes = bytearray()
         for image in self.glb.model.images or []:
             bufferview: Optional[int] = image.bufferView
             if bufferview is None:
                 continue
-            image_bytes = self.retrieve_bufferview(bufferview)
             if model.images is None:
                 model.images = []
             model.images.append(
                 Image(
                     mimeType=image.mimeType,
-                    bufferView=len(model.bufferViews or []),
+                    bufferView=len(bufferviews),
                 )
             )
-            if model.bufferViews is None:
-                model.bufferViews = []
-            model.bufferViews.append(
-                BufferView(
-                    buffer=0,
-                    byteOffset=vertex_bytelen
-                    + face_bytelen
-                    + tex_coord_bytelen
-                    + len(image_bytearray),
-                    byteLength=len(image_bytes),
-                )
+            bufferviews.append(
+                append_bytes(data, self.retrieve_bufferview(bufferview))
             )
-            image_bytearray.extend(image_bytes)
-
-        model.buffers = [
-            Buffer(
-                byteLength=vertex_bytelen
-                + face_bytelen
-                + tex_coord_bytelen
-                + len(image_bytearray),
-            )
-        ]
+        if quantize:
+            add_extension(model, "KHR_mesh_quantization")
 
-        resource = GLBResource(
-            data=vertex_bytearray
-            + face_bytearray
-            + tex_coord_bytearray
-            + image_bytearray,
-        )
+        model.buffers = [Buffer(byteLength=len(data))]
+        resource = GLBResource(data=data)
 
         GLTF(model=model, resources=[resource]).export(str(path))
 
@@ -423,7 +396,7 @@ class GLBSegment(GLBDecompress):
     """loads a glb and loads primitives of each mesh. exports a glb with
     metadata from each PrimitiveSegment
 
-    class attribute `glb` is used to store the glTF object to access
+    the loaded glTF object is shared with each loaded PrimitiveSegment
 
     parameters
     ----------
@@ -475,7 +448,9 @@ class GLBSegment(GLBDecompress):
                 unit="primitive",
                 leave=False,
             ):
-                primitives.append(PrimitiveSegment(primitive))
+                primitives.append(
+                    PrimitiveSegment(primitive, self.glb, self.draco_cache)
+                )
             self.meshes.append(primitives)
 
     def export(self, path: Path) -> None:
@@ -501,6 +476,9 @@ class GLBSegment(GLBDecompress):
             self.glb.model.accessors = []
         if self.glb.model.extensionsUsed is None:
             self.glb.model.extensionsUsed = []
+        resource: GLBResource = self.glb.get_glb_resource()
+        # the loaded data may be a read-only view into the mapped file
+        resource.data = bytearray(resource.data)
         for mesh in tqdm(
             self.meshes,
             desc="Exporting mesh",
@@ -543,19 +521,21 @@ class GLBSegment(GLBDecompress):
                 self.glb.model.bufferViews.append(
                     BufferView(
                         buffer=0,
-                        byteOffset=len(self.glb.get_glb_resource().data),
+                        byteOffset=len(resource.data),
                         byteLength=feature_bytelen,
                         byteStride=4,
                         target=BufferTarget.ARRAY_BUFFER.value,
                     )
                 )
                 self.glb.model.buffers[0].byteLength += feature_bytelen
-                self.glb.glb_resources[0].data += feature_bytearray
+                resource.data += feature_bytearray
         self.glb.model.extensionsUsed.append("EXT_mesh_features")
         Path.mkdir(path.parent, parents=True, exist_ok=True)
         self.glb.export(str(path))
 
-    def export_submeshes(self, output_dir: Path) -> None:
+    def export_submeshes(
+        self, output_dir: Path, quantize: bool = False
+    ) -> None:
         """exports submeshes by class to the given path
 
         exported submeshes are saved as glb files with the following naming
@@ -565,6 +545,9 @@ class GLBSegment(GLBDecompress):
         ----------
         output_dir: pathlib.Path
             path to export submeshes to
+        quantize: bool
+            whether to quantize positions and texture coordinates.
+            defaults to False
 
         """
         for i, mesh in enumerate(self.meshes):
@@ -576,4 +559,6 @@ class GLBSegment(GLBDecompress):
                     leave=False,
                 )
             ):
-                primitive_seg.export_subprimitives(output_dir / f"mesh{i}/{j}")
+                primitive_seg.export_subprimitives(
+                    output_dir / f"mesh{i}/{j}", quantize
+                )
@@ -0,0 +1,297 @@
+"""converts the primitives of a glb into trimeshes in a single pass"""
+from pathlib import Path
+from typing import Optional, Union
+
+import DracoPy
+import numpy as np
+from gltflib import ComponentType, Node, Primitive
+from gltflib.gltf import GLTF
+from PIL import Image as PIL_Image
+from trimesh import Trimesh
+from trimesh.visual import TextureVisuals
+from trimesh.visual.texture import SimpleMaterial
+
+from .accessors import has_data
+from .decompress import BufferAccessor, PrimitiveDecompress
+from .extract_textures import gltf_image_to_pillow
+from .reader import load_glb
+
+
+def _rotation_matrix(quaternion: list[float]) -> np.ndarray:
+    """converts a glTF rotation quaternion to a rotation matrix
+
+    parameters
+    ----------
+    quaternion: list[float]
+        unit quaternion in (x, y, z, w) order
+
+    returns
+    -------
+    np.ndarray
+        (3, 3) rotation matrix
+
+    """
+    x, y, z, w = quaternion
+    return np.array(
+        [
+            [1 - 2 * (y**2 + z**2), 2 * (x * y - z * w), 2 * (x * z + y * w)],
+            [2 * (x * y + z * w), 1 - 2 * (x**2 + z**2), 2 * (y * z - x * w)],
+            [2 * (x * z - y * w), 2 * (y * z + x * w), 1 - 2 * (x**2 + y**2)],
+        ]
+    )
+
+
+def node_matrix(node: Node) -> np.ndarray:
+    """local transform of a node
+
+    parameters
+    ----------
+    node: gltflib.Node
+        node to get the transform of
+
+    returns
+    -------
+    np.ndarray
+        (4, 4) transformation matrix
+
+    """
+    if node.matrix is not None:
+        # glTF matrices are stored in column-major order
+        return np.reshape(node.matrix, (4, 4)).T.astype(np.float64)
+    matrix: np.ndarray = np.eye(4)
+    matrix[:3, :3] = _rotation_matrix(
+        node.rotation or [0.0, 0.0, 0.0, 1.0]
+    ) * np.asarray(node.scale or [1.0, 1.0, 1.0])
+    matrix[:3, 3] = node.translation or [0.0, 0.0, 0.0]
+    return matrix
+
+
+def mesh_matrices(gltf: GLTF) -> dict[int, np.ndarray]:
+    """world transform of each mesh referenced by a node
+
+    the node hierarchy is walked from the nodes of the default scene, or
+    from every root node if the glTF has no scenes. a mesh referenced by
+    several nodes gets the transform of the first one
+
+    parameters
+    ----------
+    gltf: gltflib.GLTF
+        gltf object to get the transforms from
+
+    returns
+    -------
+    dict[int, np.ndarray]
+        (4, 4) world transform by mesh index
+
+    """
+    nodes: list[Node] = gltf.model.nodes or []
+    scenes = gltf.model.scenes or []
+    if scenes:
+        roots: list[int] = scenes[gltf.model.scene or 0].nodes or []
+    else:
+        children: set[int] = {
+            child for node in nodes for child in node.children or []
+        }
+        roots = [i for i in range(len(nodes)) if i not in children]
+    matrices: dict[int, np.ndarray] = {}
+    # explicit stack instead of recursion, in depth-first order
+    stack: list[tuple[int, np.ndarray]] = [
+        (root, np.eye(4)) for root in reversed(roots)
+    ]
+    while stack:
+        index, parent = stack.pop()
+        node: Node = nodes[index]
+        matrix: np.ndarray = parent @ node_matrix(node)
+        if node.mesh is not None:
+            matrices.setdefault(node.mesh, matrix)
+        stack.extend(
+            (child, matrix) for child in reversed(node.children or [])
+        )
+    return matrices
+
+
+def primitive_image(gltf: GLTF, primitive: Primitive) -> Optional[int]:
+    """index of the base color texture image of a primitive
+
+    parameters
+    ----------
+    gltf: gltflib.GLTF
+        gltf object which contains the primitive
+    primitive: gltflib.Primitive
+        primitive to get the image of
+
+    returns
+    -------
+    int or None
+        index of the image in the glTF if the material of the primitive has
+        a base color texture, None otherwise
+
+    """
+    materials = gltf.model.materials or []
+    if primitive.material is None or primitive.material >= len(materials):
+        return None
+    pbr = materials[primitive.material].pbrMetallicRoughness
+    if pbr is None or pbr.baseColorTexture is None:
+        return None
+    textures = gltf.model.textures or []
+    if pbr.baseColorTexture.index >= len(textures):
+        return None
+    source: Optional[int] = textures[pbr.baseColorTexture.index].source
+    if source is None or source >= len(gltf.model.images or []):
+        return None
+    return source
+
+
+def mesh_nodes(gltf: GLTF) -> dict[int, Node]:
+    """first node referencing each mesh
+
+    parameters
+    ----------
+    gltf: gltflib.GLTF
+        gltf object to get the nodes from
+
+    returns
+    -------
+    dict[int, gltflib.Node]
+        node by mesh index, in the order of the nodes of the glTF
+
+    """
+    nodes: dict[int, Node] = {}
+    for node in gltf.model.nodes or []:
+        if node.mesh is not None:
+            nodes.setdefault(node.mesh, node)
+    return nodes
+
+
+def primitive_geometry(
+    gltf: GLTF, primitive: Primitive
+) -> Optional[tuple[np.ndarray, np.ndarray]]:
+    """positions and faces of a primitive read from its accessors
+
+    texture coordinates are not needed, so primitives without TEXCOORD_0
+    are read as well. a primitive without indices is a list of triangles
+
+    parameters
+    ----------
+    gltf: gltflib.GLTF
+        gltf object which contains the primitive
+    primitive: gltflib.Primitive
+        primitive to read
+
+    returns
+    -------
+    tuple[np.ndarray, np.ndarray] or None
+        (n, 3) float32 positions and (m, 3) faces, None if the geometry is
+        Draco compressed and has to be read through PrimitiveDecompress
+
+    """
+    accessors: BufferAccessor = BufferAccessor(gltf)
+    position = accessors.get_accessor(primitive.attributes.POSITION)
+    indices = accessors.get_accessor(primitive.indices)
+    if not has_data(position) or (
+        indices is not None and not has_data(indices)
+    ):
+        return None
+    points: np.ndarray = accessors.read_accessor(position).astype(
+        np.float32, copy=False
+    )
+    if indices is None:
+        faces: np.ndarray = np.arange(len(points) // 3 * 3).reshape(-1, 3)
+    else:
+        faces = accessors.read_accessor(indices).reshape(-1, 3)
+    return points, faces
+
+
+def glb_to_trimeshes(
+    glb: Union[Path, GLTF], textures: bool = True
+) -> list[Trimesh]:
+    """loads the primitives of a glb as trimeshes
+
+    positions, indices and texture coordinates are read once from the
+    accessors, or through the Draco decoding of PrimitiveDecompress, so
+    Draco compressed, interleaved, sparse and quantized primitives are
+    supported. each image is decoded once, even if several primitives use
+    it. primitives without texture coordinates, and every primitive if
+    textures is False, are read as geometry only.
+
+    vertices are kept in the frame of their mesh, like pyassimp returns
+    them, since TilesLoader applies the tile transform on top. node
+    transforms are ignored, except the matrix of the node referencing a
+    KHR_mesh_quantization mesh, which dequantizes its positions. one trimesh
+    is returned per primitive, in the order of the meshes and their
+    primitives
+
+    parameters
+    ----------
+    glb: pathlib.Path or gltflib.GLTF
+        path to the glb file, or the gltf object already loaded
+    textures: bool
+        whether to decode the base color texture of each primitive. if
+        False, only vertices and faces are kept and normals are not fixed.
+        defaults to True
+
+    returns
+    -------
+    list[trimesh.Trimesh]
+        trimeshes of the primitives
+
+    examples
+    --------
+    >>> trimeshes = glb_to_trimeshes(Path("model.glb"), textures=False)
+
+    """
+    gltf: GLTF = glb if isinstance(glb, GLTF) else load_glb(glb)
+    nodes: dict[int, Node] = mesh_nodes(gltf)
+    accessors: BufferAccessor = BufferAccessor(gltf)
+    draco_cache: dict[int, Optional[DracoPy.DracoMesh]] = {}
+    images: dict[int, PIL_Image.Image] = {}
+    trimeshes: list[Trimesh] = []
+    for i, mesh in enumerate(gltf.model.meshes or []):
+        for _primitive in mesh.primitives:
+            image_index: Optional[int] = None
+            if textures and _primitive.attributes.TEXCOORD_0 is not None:
+                image_index = primitive_image(gltf, _primitive)
+            geometry = None
+            if image_index is None:
+                geometry = primitive_geometry(gltf, _primitive)
+            if geometry is None:
+                primitive = PrimitiveDecompress(
+                    _primitive, gltf, draco_cache
+                )
+                geometry = primitive.data.points, primitive.data.faces
+            vertices, faces = geometry
+            position = accessors.get_accessor(_primitive.attributes.POSITION)
+            if (
+                i in nodes
+                and position is not None
+                and position.componentType != ComponentType.FLOAT.value
+            ):
+                # quantized positions, the node matrix dequantizes them
+                matrix: np.ndarray = node_matrix(nodes[i])
+                vertices = vertices @ matrix[:3, :3].T + matrix[:3, 3]
+            if image_index is None:
+                trimesh = Trimesh(vertices=vertices, faces=faces)
+                if textures:
+                    trimesh.fix_normals()
+                trimeshes.append(trimesh)
+                continue
+            if image_index not in images:
+                images[image_index] = gltf_image_to_pillow(
+                    gltf, gltf.model.images[image_index]
+                )
+            image: PIL_Image.Image = images[image_index]
+            # glTF texture coordinates start at the top of the image,
+            # trimesh expects them to start at the bottom
+            uv: np.ndarray = np.array(
+                primitive.data.tex_coord, dtype=np.float64
+            )
+            uv[:, 1] = 1.0 - uv[:, 1]
+            visual: TextureVisuals = TextureVisuals(
+                uv=uv,
+                image=image,
+                material=SimpleMaterial(image=image),
+            )
+            trimesh = Trimesh(vertices=vertices, faces=faces, visual=visual)
+            trimesh.fix_normals()
+            trimeshes.append(trimesh)
+    return trimeshes
@@ -146,25 +146,13 @@ def polygon_to_3d(polygon, height):
 
 import re
 import math
+import os
+import numpy as np
 
 def get_lat_lon(coords):
-    x,y,z = coords
-    a = 6378137.0 # Радиус Земли
-    e = 8.1819190842622e-2 # Эксцентриситет
-
-    # Вычисления
-    b = math.sqrt(a**2 * (1-e**2))
-    ep = math.sqrt((a**2 - b**2) / b**2)
-    p = math.sqrt(x**2 + y**2)
-    th = math.atan2(a*z, b*p)
-    lon = math.atan2(y, x)
-    lat = math.atan2((z + ep**2 * b * math.sin(th)**3), (p - e**2 * a * math.cos(th)**3))
-    n = a / math.sqrt(1 - e**2 * math.sin(lat)**2)
-    alt = p / math.cos(lat) - n
-
-    # Конвертация в градусы
-    lat = lat * (180.0/math.pi)
-    lon = lon * (180.0/math.pi)
+    from lct_solution import wsg84_to_cartesian
+
+    lat, lon, _alt = wsg84_to_cartesian(*coords)
     return lat, lon
 
 
@@ -180,38 +168,23 @@ def b3dm_get_coords(path):
         return get_lat_lon(left_corner), get_lat_lon(right_corner)
 
 
-def tileset_get_coords(path):
-    import json
+def tileset_get_coords(path, index_path=None):
+    from lct_solution import TilesetIndex, wsg84_to_cartesian_array
 
-    with open(path) as f:
-        d = json.load(f)
-        childrens = d['root']["children"]
+    root_dir, filename = os.path.split(path)
+    index = TilesetIndex.load(root_dir, filename, index_path)
     min_lat = 1e10
     min_lon = 1e10
-    ecef_min_lat = None
-    ecef_max_lat = None
-    ecef_min_lon = None
-    ecef_max_lon = None
     err_cnst_rad = 0.0011
     max_lat = 0
     max_lon = 0
     min_z = 0
     max_z = 0
-    for child in childrens:
-        child = child['boundingVolume']['sphere']
-        lat, lon = get_lat_lon(child[:3])
-        if (lat < min_lat):
-            min_lat = lat
-            ecef_min_lat = child
-        if (lon < min_lon):
-            min_lon = lon
-            ecef_min_lon = child
-        if (lat > max_lat):
-            max_lat = lat
-            ecef_max_lat = child
-        if (lon > max_lon):
-            max_lon = lon
-            ecef_max_lon = child
+    # all tiles at once instead of get_lat_lon per tile
+    lat_lon = wsg84_to_cartesian_array([tile.sphere[:3] for tile in index.tiles])[:, :2]
+    if len(lat_lon):
+        min_lat, min_lon = lat_lon.min(axis=0)
+        max_lat, max_lon = np.maximum(lat_lon.max(axis=0), 0)
 
     return (min_lat - err_cnst_rad, min_lon - err_cnst_rad), (max_lat + err_cnst_rad, max_lon + err_cnst_rad)
 
@@ -299,6 +272,7 @@ def main():
     argparser = argparse.ArgumentParser(description='Create initial geojson')
     argparser.add_argument('--tileset_json', type=str, help='Tileset json file')
     argparser.add_argument('--tileset_b3dm', type=str, help='Tileset b3dm file')
+    argparser.add_argument('--index', type=str, help='Tileset index file, by default it is kept in the user cache directory', default=None)
     argparser.add_argument('--output', type=str, help='Output path', default="output/initial.geojson")
 
     args = argparser.parse_args()
@@ -313,7 +287,7 @@ def main():
 
     if input_json_filename is not None:
         logger.info("Getting coordinates from tileset...")
-        left_corner, right_corner = tileset_get_coords(input_json_filename)
+        left_corner, right_corner = tileset_get_coords(input_json_filename, args.index)
 
     if input_b3dm_filename is not None:
         logger.info("Getting coordinates from b3dm...")
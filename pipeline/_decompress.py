@@ -1,11 +1,14 @@
 #!/usr/bin/env python3
 
-from lct_solution import GLBDecompress
+from lct_solution import (GLBDecompress,
+    B3DM,
+    TilesetIndex)
 import json
 import logging
 import os
-import subprocess
 import concurrent.futures
+import hashlib
+import traceback
 from pathlib import Path
 import argparse
 import sys
@@ -13,109 +16,142 @@ import tqdm
 
 
 class Tileset:
-    def __init__(self, data_path, filename="tileset.json") -> None:
+    def __init__(self, data_path, filename="tileset.json", index_path=None, workers=None) -> None:
         self._logger = logging.getLogger("entrypoint.decompress.Tileset")
         self.data_path = data_path
         self.file_path = data_path + '/' + filename
-        self.leaf_jsons = Tileset.get_leaf_jsons(self.file_path)
-        self._logger.info(f"child tilesets to process: {len(self.leaf_jsons)}")
-        self.leaf_files = Tileset.get_leaf_files(self.leaf_jsons)
+        index = TilesetIndex.load(data_path, filename, index_path, workers)
+        self._logger.info(f"child tilesets to process: {index.tileset_count}")
+        self.leaf_files = [[os.path.join(data_path, tile.uri), tile.sphere.tolist()] for tile in index.tiles]
         self._logger.info(f"fetched leaf tiles: {len(self.leaf_files)}")
 
 
-    def get_path_from_name(name):
-        parts = name.split('/')[:-1]
-        return '/'.join(parts) + '/'
-
-
-    def get_jsons(input_path):
-        current_path = Tileset.get_path_from_name(input_path)
-
-        with open(input_path, 'r') as file:
-            data = json.load(file)
-
-        all_jsons = []
-        def process_json(data):
-            if isinstance(data, str):
-                if ".json" in data:
-                    all_jsons.append(current_path + '/' + data)
-            elif isinstance(data, list):
-                return [process_json(item) for item in data]
-            elif isinstance(data, dict):
-                return {key: process_json(value) for key, value in data.items()}
-            return data
-        
-        process_json(data)
-        return all_jsons
-    
-
-    def get_leaf_jsons(data):
-        levels = [[data]]
-        while len(levels[-1]) > 0:
-            new_layer = []
-            for i in levels[-1]:
-                new_layer += Tileset.get_jsons(i)
-            levels.append(new_layer)
-        return levels[-2]
-
-
-    def get_leaf_files(leaf_jsons):
-        models = []
-        for json_path in leaf_jsons:
-            def get_child(a):
-                if 'content' in a and 'children' not in a:   
-                    uri = Tileset.get_path_from_name(json_path) + a['content']['uri']
-                    bounding_volume = a['boundingVolume']['sphere']
-                    tile = [uri, bounding_volume]
-                    models.append(tile)
-                if 'children' in a:
-                    for i in a['children']:
-                        get_child(i)
-            with open(json_path, 'r') as file:
-                data = json.load(file)
-            get_child(data['root'])
-        return models
-
-
-def create_glb(original_path, new_path):
-    original_path = original_path
-    new_path = new_path
-    command = f'npx 3d-tiles-tools b3dmToGlb -i {original_path} -o {new_path}'
-    return command
-
-
-def b3dmToGlb(b3dm_paths, result_path):
-    logger = logging.getLogger("entrypoint.decompress.b3dmToGlb")
-    result_paths = []
-    commands = []
-    for b3dm in b3dm_paths:
-        file_name = b3dm.split('/')[-1]
-        new_item_path = result_path + '/' + file_name[:-4] + "glb"
-        # check if file already exists
-        if os.path.exists(new_item_path):
-            logger.debug(f"skipping {new_item_path} as it already exists")
-            result_paths.append(new_item_path)
-            continue
-        commands.append({
-            "cmd": create_glb(b3dm, new_item_path),
-            "input": b3dm,
-            "output": new_item_path
-        })
-    num_cores = os.cpu_count() - 2
-    logger.info(f"processing {len(commands)} .b3dm's using {num_cores} cores, already processed: {len(result_paths)}")
-    
-    def run_command(command):
-        process = subprocess.Popen(command['cmd'], shell=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-        process.communicate()
-        if process.returncode != 0:
-            logger.error(f"Failed to process {command['input']}")
-            return None
-        return command['output']
-
-    with concurrent.futures.ThreadPoolExecutor(max_workers=num_cores) as executor:
-        results = list(tqdm.tqdm(executor.map(run_command, commands), total=len(commands), desc="b3dm -> glb"))
-        result_paths += results
-    return result_paths
+# bump when the content of decompressed glb files changes,
+# so that tiles cached by an older version are processed again
+CACHE_VERSION = 3
+
+
+def file_sha256(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as file:
+        for chunk in iter(lambda: file.read(1 << 20), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class DecompressManifest:
+    """
+    Records which b3dm files were decompressed, keyed by their content hash, CACHE_VERSION and the quantize option.
+    A tile is reused only if its source content, the cache version, the option and the output file are unchanged.
+    """
+    def __init__(self, path) -> None:
+        self._logger = logging.getLogger("entrypoint.decompress.DecompressManifest")
+        self.path = path
+        self._entries = {}
+        if os.path.exists(path):
+            try:
+                with open(path, 'r') as file:
+                    self._entries = json.load(file)['entries']
+            except (json.JSONDecodeError, KeyError) as e:
+                self._logger.warning(f"ignoring unreadable manifest {path}: {e}")
+
+
+    def is_fresh(self, b3dm_path, output_path, quantize=False):
+        entry = self._entries.get(b3dm_path)
+        if entry is None or entry['version'] != CACHE_VERSION or entry['output'] != output_path:
+            return False
+        if entry.get('quantize', False) != quantize:
+            return False
+        if not os.path.exists(output_path) or os.path.getsize(output_path) != entry['output_size']:
+            return False
+        try:
+            stat = os.stat(b3dm_path)
+            if stat.st_size == entry['size'] and stat.st_mtime_ns == entry['mtime_ns']:
+                return True
+            # the file was touched, compare the content
+            if file_sha256(b3dm_path) != entry['sha256']:
+                return False
+        except OSError:
+            # e.g. the source was deleted, decompress_task reports the failure like for any other file
+            return False
+        entry['size'] = stat.st_size
+        entry['mtime_ns'] = stat.st_mtime_ns
+        return True
+
+
+    def update(self, b3dm_path, output_path, sha256, quantize=False):
+        stat = os.stat(b3dm_path)
+        self._entries[b3dm_path] = {
+            'sha256': sha256,
+            'size': stat.st_size,
+            'mtime_ns': stat.st_mtime_ns,
+            'version': CACHE_VERSION,
+            'quantize': quantize,
+            'output': output_path,
+            'output_size': os.path.getsize(output_path)
+        }
+
+
+    def save(self):
+        write_atomic(self.path, json.dumps({'version': CACHE_VERSION, 'entries': self._entries}).encode())
+
+
+def write_atomic(path, data):
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    try:
+        with open(tmp_path, 'wb') as file:
+            file.write(data)
+        os.replace(tmp_path, path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+
+def decompress_b3dm(b3dm_path, output_path, quantize=False):
+    """
+    Decompress a b3dm tile into an uncompressed glb
+    The glb is exported to a temporary file first and renamed, so a killed run never leaves a truncated output
+    @param quantize: write quantized positions and texture coordinates, see GLBDecompress.export
+    @return: sha256 of the b3dm content
+    """
+    with open(b3dm_path, 'rb') as file:
+        data = file.read()
+    sha256 = hashlib.sha256(data).hexdigest()
+    glb = GLBDecompress(B3DM.from_bytes(data).glb)
+    glb.load_meshes()
+    # keep the .glb extension, gltflib infers the format from it
+    tmp_path = Path(output_path).with_suffix(f".{os.getpid()}.tmp.glb")
+    try:
+        glb.export(tmp_path, quantize=quantize)
+        os.replace(tmp_path, output_path)
+    finally:
+        if tmp_path.exists():
+            tmp_path.unlink()
+    return sha256
+
+
+def decompress_task(task):
+    b3dm_path, output_path, quantize = task
+    try:
+        return decompress_b3dm(b3dm_path, output_path, quantize), None
+    except Exception:
+        return None, traceback.format_exc()
+
+
+def decompress_all(tasks, workers=1):
+    """
+    Decompress (b3dm_path, output_path, quantize) tasks, optionally in a process pool
+    @param tasks: list of (b3dm_path, output_path, quantize) tuples
+    @param workers: number of worker processes, 1 decompresses in the current process
+    @return: generator of (sha256, error traceback) tuples in the order of tasks, one of them is None
+    """
+    if workers <= 1:
+        for task in tqdm.tqdm(tasks, desc="Decompressing"):
+            yield decompress_task(task)
+        return
+    with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as executor:
+        yield from tqdm.tqdm(executor.map(decompress_task, tasks, chunksize=4),
+                             total=len(tasks), desc=f"Decompressing ({workers} workers)")
 
 
 def main():
@@ -124,42 +160,56 @@ def main():
     argparser.add_argument('--root_dir', type=str, help='Input path', required=True)
     argparser.add_argument('--tileset', type=str, help='Tileset json file', required=True)
     argparser.add_argument('--output', type=str, help='Output path', default="output/decompressed")
+    argparser.add_argument('--workers', type=int, help='Number of processes for indexing and decompression', default=1)
+    argparser.add_argument('--index', type=str, help='Tileset index file, by default it is kept in the user cache directory', default=None)
+    argparser.add_argument('--quantize', action='store_true', help='Write quantized positions and texture coordinates (KHR_mesh_quantization)')
 
     args = argparser.parse_args()
     output_folder = args.output
 
-    ts = Tileset(args.root_dir, args.tileset)
+    ts = Tileset(args.root_dir, args.tileset, args.index, args.workers)
     
     os.makedirs(output_folder, exist_ok=True)
-    os.makedirs('/root/.cache/compressed_glb', exist_ok=True)
     os.makedirs(output_folder + '/decompressed_glb', exist_ok=True)
 
     b3dm_paths = [i[0] for i in ts.leaf_files]
     logger.info(f"b3dm paths: {len(b3dm_paths)}")
-    compressed_paths = b3dmToGlb(b3dm_paths, '/root/.cache/compressed_glb')
-    decompressed_paths = []
+    manifest = DecompressManifest(output_folder + '/decompressed_manifest.json')
+    decompressed = []
     to_decompress = []
-    for compressed_glb in compressed_paths:
-        filename = Path(compressed_glb).name
-        if os.path.exists(output_folder + '/decompressed_glb/' + filename):
-            logger.debug(f"skipping {filename} as it already exists")
-            decompressed_paths.append(output_folder + '/decompressed_glb/' + filename)
-            continue
-        to_decompress.append(compressed_glb)
-    logger.info(f"decompressing {len(to_decompress)} of {len(compressed_paths)}, already done: {len(decompressed_paths)}")
-
-    for compressed_glb in tqdm.tqdm(to_decompress, desc="Decompressing"):
-        glb = GLBDecompress(Path(compressed_glb))
-        glb.load_meshes()
-        glb.export(Path(output_folder + '/decompressed_glb/' + compressed_glb.split('/')[-1]))
-        decompressed_paths.append(output_folder + '/decompressed_glb/' + compressed_glb.split('/')[-1])
-    
+    for b3dm, leaf_file in zip(b3dm_paths, ts.leaf_files):
+        filename = Path(b3dm).with_suffix('.glb').name
+        output_path = output_folder + '/decompressed_glb/' + filename
+        if manifest.is_fresh(b3dm, output_path, args.quantize):
+            logger.debug(f"skipping {filename} as it is up to date")
+        else:
+            to_decompress.append((b3dm, output_path, args.quantize))
+        decompressed.append((output_path, leaf_file))
+    logger.info(f"decompressing {len(to_decompress)} of {len(b3dm_paths)}, up to date: {len(b3dm_paths) - len(to_decompress)}")
+
+    failed = set()
+    try:
+        results = decompress_all(to_decompress, args.workers)
+        # results are consumed as they arrive, so an interrupted run keeps its progress
+        for (b3dm, output_path, _quantize), (sha256, error) in zip(to_decompress, results):
+            if error is not None:
+                logger.error(f"Failed to process {b3dm}:\n{error}")
+                failed.add(output_path)
+                continue
+            manifest.update(b3dm, output_path, sha256, args.quantize)
+    finally:
+        manifest.save()
+    if failed:
+        logger.warning(f"failed to decompress {len(failed)} of {len(to_decompress)} files")
+    decompressed = [item for item in decompressed if item[0] not in failed]
+    decompressed_paths = [item[0] for item in decompressed]
+
     logger.info(f"decompressed {len(decompressed_paths)} files")
     logger.info(f"writting planar json")
     final_json = {'data' : []}
-    for i in range(len(decompressed_paths)):
-        path = decompressed_paths[i][len(output_folder)+1:]
-        sphere_coords = ts.leaf_files[i][1]
+    for decompressed_path, leaf_file in decompressed:
+        path = decompressed_path[len(output_folder)+1:]
+        sphere_coords = leaf_file[1]
         box_coords = sphere_coords + [0.0, 0.0, 0.0, sphere_coords[3], 0.0, 0.0, 0.0, sphere_coords[3]]
         final_json['data'].append({
             'content' : {
@@ -170,8 +220,8 @@ def main():
                             "sphere" : sphere_coords
                         }
         })
-    with open(output_folder + '/' + 'decompressed.json', 'w') as fp:
-        json.dump(final_json, fp, indent=4, ensure_ascii=False)
+    write_atomic(output_folder + '/' + 'decompressed.json',
+                 json.dumps(final_json, indent=4, ensure_ascii=False).encode())
     logger.info(f"done")
 
 
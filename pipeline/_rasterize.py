@@ -25,6 +25,9 @@ def main():
     argparser.add_argument('--root_dir', type=str, help='Input path for decompressed glb files', required=True)
     argparser.add_argument('--planar', type=str, help='Planar json file', required=True)
     argparser.add_argument('--output', type=str, help='Output path', default="output")
+    argparser.add_argument('--workers', type=int, help='Number of processes loading tiles', default=1)
+    argparser.add_argument('--cache_mb', type=int, help='Load tiles on demand and keep at most this many megabytes of them in memory', default=None)
+    argparser.add_argument('--snapshot', type=str, help='Directory of the preprocessed scene snapshot, created on the first run and reused while the planar json and tiles are unchanged', default=None)
 
     args = argparser.parse_args()
     output_folder = Path(args.output) / "rasterized"
@@ -33,7 +36,8 @@ def main():
     os.makedirs(output_folder, exist_ok=True)
     
     logger.info(f"loading tiles from {root_dir} using planar json {args.planar}")
-    tiles = lct.TilesLoader.from_planar(root_dir, args.planar)
+    cache_bytes = args.cache_mb * 2**20 if args.cache_mb is not None else None
+    tiles = lct.TilesLoader.from_planar(root_dir, args.planar, args.workers, cache_bytes, snapshot_dir=args.snapshot)
     logger.info(f"loaded {len(tiles.models)} tiles")
     # rasterize returns a generator of images
     for i, (rgb, _depth, transform) in enumerate(lct.split_images(tiles, 
@@ -40,6 +40,28 @@ category_colors = {
     "historic": [128, 128, 128, 200]
 }
 
+# distance in meters between the points the rings of each class are densified to before ray casting:
+# thin barriers and footways need dense samples, large parks and water bodies do not
+category_steps = {
+    "park": 5,
+    "footway": 2,
+    "barrier": 1,
+    "road": 3,
+    "water": 5,
+    "historic": 3
+}
+
+# tolerance in meters of the simplification of the rings of each class once their height is recovered,
+# the interpolated points on straight edges are dropped
+category_tolerances = {
+    "park": 1.0,
+    "footway": 0.3,
+    "barrier": 0.2,
+    "road": 0.5,
+    "water": 1.0,
+    "historic": 0.5
+}
+
 def main():
     logger = logging.getLogger("entrypoint.tfgeojson")
     argparser = argparse.ArgumentParser(description='Transform geojson 2D to 3D')
@@ -47,6 +69,10 @@ def main():
     argparser.add_argument('--planar', type=str, help='Planar json file', required=True)
     argparser.add_argument('--input', type=str, help='2D geojson file', required=True)
     argparser.add_argument('--output', type=str, help='Output path', default="output")
+    argparser.add_argument('--workers', type=int, help='Number of processes loading tiles and processing features', default=1)
+    argparser.add_argument('--cache_mb', type=int, help='Load tiles on demand and keep at most this many megabytes of them in memory', default=None)
+    argparser.add_argument('--snapshot', type=str, help='Directory of the preprocessed scene snapshot, created on the first run and reused while the planar json and tiles are unchanged', default=None)
+    argparser.add_argument('--ray_engine', type=str, help='Backend intersecting the rays with the meshes, auto picks the first available of embree, open3d and numpy', choices=['auto', *lct.RAY_ENGINES], default='auto')
 
     args = argparser.parse_args()
     output_folder = Path(args.output)
@@ -59,10 +85,14 @@ def main():
         geojson = json.load(f)
 
     logger.info(f"loading tiles from {root_dir} using planar json {input_geojson_filename}")
-    tiles = lct.TilesLoader.from_planar(root_dir, args.planar)
+    cache_bytes = args.cache_mb * 2**20 if args.cache_mb is not None else None
+    # ray casting only needs the geometry
+    tiles = lct.TilesLoader.from_planar(root_dir, args.planar, args.workers, cache_bytes, textures=False, snapshot_dir=args.snapshot)
     logger.info(f"loaded {len(tiles.models)} tiles")
+    tiles.ray_engine = args.ray_engine
+    logger.info(f"ray engine: {tiles.ray_engine}")
     logger.info(f"processing geojson")
-    features = lct.process_geojson(geojson, tiles, category_colors)
+    features = lct.process_geojson(geojson, tiles, category_colors, category_steps, category_tolerances, args.workers)
     logging.info("Saving output.geojson")
     data = {
         "type": "FeatureCollection",
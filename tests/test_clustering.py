@@ -0,0 +1,40 @@
+import numpy as np
+import pytest
+from sklearn.cluster import DBSCAN
+
+from lct_solution import cluster_heights, cluster_heights_batch
+
+
+def _dbscan(heights, eps=5, min_samples=2):
+    return DBSCAN(eps=eps, min_samples=min_samples).fit(heights.reshape(-1, 1)).labels_
+
+
+def _random_heights(rng, count):
+    # a few levels with noise around them, and some rounded heights for exact ties and distances of eps
+    levels = rng.uniform(100, 200, rng.integers(1, 6))
+    heights = rng.choice(levels, count) + rng.normal(0, rng.choice([0.5, 3, 10]), count)
+    if rng.random() < 0.5:
+        heights = np.round(heights)
+    return heights
+
+
+@pytest.mark.parametrize('min_samples', [2, 3, 5])
+def test_cluster_heights_matches_dbscan(min_samples):
+    rng = np.random.default_rng(min_samples)
+    for _ in range(200):
+        heights = _random_heights(rng, rng.integers(1, 60))
+        np.testing.assert_array_equal(cluster_heights(heights, 5, min_samples), _dbscan(heights, 5, min_samples))
+
+
+@pytest.mark.parametrize('min_samples', [2, 3])
+def test_cluster_heights_batch_matches_dbscan_per_segment(min_samples):
+    rng = np.random.default_rng(10 + min_samples)
+    for _ in range(50):
+        rings = [_random_heights(rng, rng.integers(1, 40)) for _ in range(rng.integers(1, 10))]
+        # the heights of a segment do not have to be contiguous
+        order = rng.permutation(sum(len(ring) for ring in rings))
+        heights = np.concatenate(rings)[order]
+        segments = np.repeat(np.arange(len(rings)), [len(ring) for ring in rings])[order]
+        labels = cluster_heights_batch(heights, segments, 5, min_samples)
+        for i in range(len(rings)):
+            np.testing.assert_array_equal(labels[segments == i], _dbscan(heights[segments == i], 5, min_samples))
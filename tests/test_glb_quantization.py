@@ -0,0 +1,62 @@
+import numpy as np
+import trimesh as tm
+from PIL import Image
+
+from lct_solution.glb import GLBDecompress, MeshSegment, glb_to_trimeshes, load_glb
+from lct_solution.glb.decompress import PrimitiveDecompress
+from lct_solution.glb.to_trimesh import mesh_matrices
+
+
+def _textured_box(extents):
+    box = tm.creation.box(extents=extents)
+    box.visual = tm.visual.TextureVisuals(uv=np.random.default_rng(0).random((len(box.vertices), 2)),
+                                          image=Image.new('RGB', (4, 4)))
+    return box
+
+
+def _world_bounds(path):
+    gltf = load_glb(path)
+    matrices = mesh_matrices(gltf)
+    bounds = []
+    for i, mesh in enumerate(gltf.model.meshes):
+        for primitive in mesh.primitives:
+            points = PrimitiveDecompress(primitive, gltf).data.points.astype(np.float64)
+            points = points @ matrices[i][:3, :3].T + matrices[i][:3, 3]
+            bounds.append(np.array([points.min(axis=0), points.max(axis=0)]))
+    return bounds
+
+
+def test_quantized_export_keeps_children_in_place(tmp_path):
+    # a child node must not inherit the dequantization of the mesh of its parent
+    scene = tm.Scene()
+    scene.add_geometry(_textured_box([10, 10, 10]), node_name='parent', geom_name='parent',
+                       transform=tm.transformations.translation_matrix([0, 0, 5]))
+    scene.add_geometry(_textured_box([1, 1, 1]), node_name='child', geom_name='child', parent_node_name='parent',
+                       transform=tm.transformations.translation_matrix([5, 0, 195]))
+    scene.export(tmp_path / 'input.glb')
+
+    glb = GLBDecompress(tmp_path / 'input.glb')
+    glb.load_meshes()
+    glb.export(tmp_path / 'quantized.glb', quantize=True)
+
+    expected = _world_bounds(tmp_path / 'input.glb')
+    actual = _world_bounds(tmp_path / 'quantized.glb')
+    assert len(actual) == len(expected) == 2
+    for bounds, reference in zip(actual, expected):
+        np.testing.assert_allclose(bounds, reference, atol=1e-3)
+    np.testing.assert_allclose(expected[1], [[4.5, -0.5, 199.5], [5.5, 0.5, 200.5]], atol=1e-6)
+
+
+def test_quantized_export_loads_dequantized(tmp_path):
+    tm.Scene(_textured_box([10, 10, 10])).export(tmp_path / 'input.glb')
+    glb = GLBDecompress(tmp_path / 'input.glb')
+    glb.load_meshes()
+    glb.export(tmp_path / 'quantized.glb', quantize=True)
+
+    expected = [[-5, -5, -5], [5, 5, 5]]
+    for textures in (False, True):
+        meshes = glb_to_trimeshes(tmp_path / 'quantized.glb', textures=textures)
+        np.testing.assert_allclose(meshes[0].bounds, expected, atol=1e-3)
+    segments = MeshSegment.load_by_path(tmp_path / 'quantized.glb')
+    assert len(segments) == 1
+    np.testing.assert_allclose(segments[0].mesh.bounds, expected, atol=1e-3)
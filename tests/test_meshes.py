@@ -0,0 +1,128 @@
+import numpy as np
+import pytest
+from sklearn.cluster import DBSCAN
+
+from lct_solution import PolygonSegment, RayBatch
+from lct_solution._meshes import perpendicular_distance, rdp_mask
+from lct_solution._spatial import unique_lowest_points
+
+
+# reference implementations, as the code was before it was vectorized: the results must not change
+
+
+def _reference_unique_lowest_points(locations):
+    points = []
+    for location in np.array(locations, dtype=np.float64):
+        for p in points:
+            if np.linalg.norm(p[:2] - location[:2]) < 0.001:
+                # save only the lowest point
+                if location[2] < p[2]:
+                    p[2] = location[2]
+                break
+        else:
+            points.append(location)
+    return np.array(points).reshape(-1, 3)
+
+
+def _reference_find_real_height(positions, hits):
+    itersected_points = []
+    for locations in hits:
+        itersected_points.extend(_reference_unique_lowest_points(locations))
+    if len(itersected_points) < 5:
+        return np.zeros((0, 3))
+    itersected_points = np.array(itersected_points)
+    labels = DBSCAN(eps=5, min_samples=2).fit(itersected_points[:, 2].reshape(-1, 1)).labels_
+    unique_labels = np.unique(labels)
+    labels_mean = np.zeros(len(unique_labels))
+    for i, label in enumerate(unique_labels):
+        labels_mean[i] = np.mean(itersected_points[labels == label][:, 2])
+    # the index of the lowest mean is compared with the labels, and the labels with the mean height
+    mean_label = np.argmin(labels_mean)
+    if len(itersected_points[labels == mean_label]) < 4:
+        return np.zeros((0, 3))
+    mean_height = labels_mean[mean_label]
+    new_points = []
+    for point in positions:
+        nearst_idx = np.argmin([np.linalg.norm(x[:2] - point[:2]) for x in itersected_points])
+        if np.linalg.norm(point[:2] - itersected_points[nearst_idx][:2]) < 0.5:
+            new_point = itersected_points[nearst_idx].copy()
+            if labels[nearst_idx] != mean_height:
+                new_point[2] = mean_height
+        else:
+            new_point = point.copy()
+            new_point[2] = mean_height
+        new_points.append(new_point)
+    return np.array(new_points)
+
+
+def _reference_rdp(points, epsilon):
+    def rdp_recursive(start, end):
+        max_distance, index = 0, start
+        for i in range(start + 1, end):
+            distance = perpendicular_distance(points[i], points[start], points[end])
+            if distance > max_distance:
+                max_distance, index = distance, i
+        if max_distance > epsilon:
+            return rdp_recursive(start, index)[:-1] + rdp_recursive(index, end)
+        return [start, end]
+
+    return rdp_recursive(0, len(points) - 1)
+
+
+class _CastRays(RayBatch):
+    '''
+    RayBatch of a single ring whose hits are given instead of cast
+    '''
+    def __init__(self, hits) -> None:
+        self._origins = [None]
+        self._given_hits = hits
+        self._points = {}
+        self._labels = {}
+
+
+    def hits(self, ring):
+        return self._given_hits
+
+
+def _near_duplicates(rng, count):
+    # clusters and chains of points closer than the tolerance of 0.001, on top of each other at several heights
+    centers = rng.uniform(0, 0.01, (max(1, count // 4), 2))
+    xy = centers[rng.integers(len(centers), size=count)] + rng.choice([0, 0.0004, 0.0008, 0.0012], (count, 2))
+    return np.column_stack([xy, rng.choice([100.0, 101.0, 110.0], count) + rng.normal(0, 0.01, count)])
+
+
+def test_unique_lowest_points_matches_reference():
+    rng = np.random.default_rng(0)
+    for count in [0, 1, 2, 5, 20, 60] * 10:
+        points = _near_duplicates(rng, count)
+        np.testing.assert_array_equal(unique_lowest_points(points), _reference_unique_lowest_points(points))
+
+
+@pytest.mark.parametrize('seed', range(20))
+def test_find_real_height_matches_reference(seed):
+    rng = np.random.default_rng(seed)
+    positions = np.column_stack([np.cumsum(rng.uniform(0, 3, 30)), rng.uniform(0, 1, 30), np.zeros(30)])
+    hits = []
+    for _mesh in range(rng.integers(1, 4)):
+        # some rays miss the mesh, some hit it twice at the same place, a few hits are far below or above
+        rays = positions[rng.random(len(positions)) < 0.8]
+        rays = np.concatenate([rays, rays[rng.random(len(rays)) < 0.3]])
+        locations = rays + rng.normal(0, 0.2, rays.shape) * [1, 1, 0]
+        locations[:, 2] = rng.choice([150, 150, 150, 120, 190], len(rays)) + rng.normal(0, 1, len(rays))
+        hits.append(locations)
+    segment = PolygonSegment.__new__(PolygonSegment)
+    segment._positions = positions.copy()
+    segment._find_real_height(rays=_CastRays(hits), ring=0)
+    np.testing.assert_array_equal(segment.positions, _reference_find_real_height(positions, hits))
+
+
+def test_rdp_mask_matches_recursive_rdp():
+    rng = np.random.default_rng(0)
+    for count in [2, 3, 5, 20, 100] * 10:
+        points = np.cumsum(rng.normal(0, 1, (count, 3)), axis=0)
+        if rng.random() < 0.5:
+            # closed ring, the line between its ends is degenerate
+            points[-1] = points[0]
+        epsilon = rng.choice([0.1, 0.5, 1.0, 3.0])
+        np.testing.assert_array_equal(np.flatnonzero(rdp_mask(points, epsilon)), _reference_rdp(points, epsilon))
+        assert len(PolygonSegment.rdp(list(points), epsilon)) == len(_reference_rdp(points, epsilon))